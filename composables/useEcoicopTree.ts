@@ -0,0 +1,114 @@
+import { decodeValues } from '~/utils/inflationData'
+
+// The full-depth ECOICOP data is generated by fetch/process.py --ecoicop-dir
+// into public/data/ecoicop, one chunk per top-level division plus a small
+// manifest. Nothing of it is bundled with the app, the manifest is fetched
+// on first use and every chunk only when its subtree is opened.
+
+const ECOICOP_DIR = 'data/ecoicop/'
+
+export interface EcoicopSubtreeInfo {
+  code: string
+  name: string | null
+  // Share of the division in the latest basket, null if not in the basket
+  weight: number | null
+  file: string
+  nodes: number
+  bytes: number
+}
+
+export interface EcoicopManifest {
+  fetchedAt: string
+  firstPeriod: string | null
+  lastPeriod: string | null
+  subtrees: EcoicopSubtreeInfo[]
+}
+
+export interface EcoicopNode {
+  code: string
+  name: string
+  // Nearest ancestor present in the data, null for the divisions
+  parent: string | null
+  weight: number | null
+  // Aligned with EcoicopSubtree.periods, NaN where the period is missing
+  values: number[]
+}
+
+export interface EcoicopSubtree {
+  code: string
+  periods: string[]
+  nodes: EcoicopNode[]
+}
+
+interface GeneratedEcoicopChunk {
+  code: string
+  periods: string[]
+  scale: number | null
+  delta: boolean
+  nodes: (Omit<EcoicopNode, 'values'> & { values: (number | null)[] })[]
+}
+
+// Shared by all the callers, so that every file is fetched at most once
+let manifestPromise: Promise<EcoicopManifest> | null = null
+const subtreePromises = new Map<string, Promise<EcoicopSubtree>>()
+
+export const useEcoicopTree = () => {
+  const baseURL = useRuntimeConfig().app.baseURL
+
+  const loadManifest = (): Promise<EcoicopManifest> => {
+    if (!manifestPromise) {
+      manifestPromise = $fetch<EcoicopManifest>(`${baseURL}${ECOICOP_DIR}manifest.json`)
+      // Allow a retry after a failed request
+      manifestPromise.catch(() => { manifestPromise = null })
+    }
+    return manifestPromise
+  }
+
+  // Loads the chunk with the division of the code, e.g. 01 for 01.1.1
+  const loadSubtree = async (code: string): Promise<EcoicopSubtree | undefined> => {
+    const division = code.replace(/\./g, '').slice(0, 2)
+    const info = (await loadManifest()).subtrees.find(subtree => subtree.code === division)
+    if (!info) return undefined
+
+    let promise = subtreePromises.get(division)
+    if (!promise) {
+      promise = $fetch<GeneratedEcoicopChunk>(`${baseURL}${ECOICOP_DIR}${info.file}`).then(chunk => ({
+        code: chunk.code,
+        periods: chunk.periods,
+        nodes: chunk.nodes.map(node => ({ ...node, values: decodeValues(node.values, chunk) }))
+      }))
+      subtreePromises.set(division, promise)
+      promise.catch(() => subtreePromises.delete(division))
+    }
+    return promise
+  }
+
+  const getChildren = (subtree: EcoicopSubtree, code: string | null): EcoicopNode[] => {
+    return subtree.nodes.filter(node => node.parent === code)
+  }
+
+  // Change of the average index of the year against the previous one, in
+  // percent and annualized like useInflationCalculator does for the
+  // categories. NaN without a complete previous year.
+  const getYearlyRate = (subtree: EcoicopSubtree, code: string, year: number): number => {
+    const node = subtree.nodes.find(node => node.code === code)
+    if (!node) return NaN
+
+    const yearValues = (year: number) => subtree.periods
+      .map((period, i) => period.startsWith(`${year}-`) ? node.values[i] : NaN)
+      .filter(value => !isNaN(value))
+    const average = (values: number[]) => values.reduce((sum, value) => sum + value, 0) / values.length
+
+    const before = yearValues(year - 1)
+    const after = yearValues(year)
+    if (before.length < 12 || after.length === 0) return NaN
+    return (Math.pow(average(after) / average(before), 12 / after.length) - 1) * 100
+  }
+
+  return {
+    loadManifest,
+    loadSubtree,
+    getChildren,
+    getYearlyRate
+  }
+}
@@ -1,6 +1,7 @@
-import type { InflationResult, SpendingCategory, TimePeriod, CategoryInflationData } from '~/types'
-import { createTimePeriod, stringToTimePeriod, timePeriodToString } from '~/types'
-import { inflationRates } from '~/data/inflationRates'
+import type { InflationResult, SpendingCategory, TimePeriod } from '~/types'
+import { createTimePeriod } from '~/types'
+import { getCategoryPosition, getYearSummary, lastCompleteYear, prefetchLastCompleteYear } from '~/utils/inflationData'
+import type { YearSummary } from '~/utils/inflationData'
 
 export interface TimeRange {
   from: TimePeriod
@@ -8,40 +9,9 @@ export interface TimeRange {
 }
 
 export const useInflationCalculator = () => {
-  const determineLastCompleteYear = (): number => {
-    // Get all unique years from the data keys
-    const years = new Set<number>()
-    
-    // Use the first category's rates as reference for available time periods
-    const timeKeys = Object.keys(inflationRates[0].rates)
-    
-    // Extract years from time keys (format: "YYYY-MM")
-    timeKeys.forEach(key => {
-      const year = parseInt(key.split('-')[0])
-      years.add(year)
-    })
-    
-    // Sort years in descending order
-    const sortedYears = Array.from(years).sort((a, b) => b - a)
-    
-    // Find the most recent year with all 12 months
-    for (const year of sortedYears) {
-      let hasAllMonths = true
-      for (let month = 1; month <= 12; month++) {
-        const key = `${year}-${month.toString().padStart(2, '0')}`
-        if (!timeKeys.includes(key)) {
-          hasAllMonths = false
-          break
-        }
-      }
-      if (hasAllMonths) {
-        return year
-      }
-    }
-    
-    // Fallback: return the earliest year if no complete year found
-    return sortedYears[sortedYears.length - 1]
-  }
+  // With chunked data, the years load on first access, the most relevant
+  // ones should not wait for the rest
+  prefetchLastCompleteYear()
 
   const calculateInflationForYear = (
     categories: SpendingCategory[],
@@ -53,21 +23,9 @@ export const useInflationCalculator = () => {
     // We compare december of the previous year to december of this year
     // If we do not have data for january of the previous year, we return NaN
 
-    const validTimeKeys = Object.keys(inflationRates[0].rates)
-    const generateValidKeysForYear = (year: number) => {
-      const keys = []
-      for (let month = 1; month <= 12; month++) {
-        const key = `${year}-${month.toString().padStart(2, '0')}`
-        if (validTimeKeys.includes(key)) {
-          keys.push(key)
-        }
-      }
-      return keys
-    }
-
-    const prevKeys = generateValidKeysForYear(year - 1)
-    const thisKeys = generateValidKeysForYear(year).filter(k => validTimeKeys.includes(k))
-    if (prevKeys.length < 12) {
+    const prevSummary = getYearSummary(year - 1)
+    const thisSummary = getYearSummary(year)
+    if (!prevSummary || prevSummary.months.length < 12 || !thisSummary) {
       return {
         personalRate: NaN,
         from: createTimePeriod(year - 1, 12),
@@ -77,36 +35,37 @@ export const useInflationCalculator = () => {
       }
     }
 
-    const sumSpendForKeys = (keys: string[]) => {
-      return categories.reduce((acc, cat) => {
-        const categoryData = inflationRates.find(c => c.id === cat.categoryId)
-        if (!categoryData) {
+    // process.py precomputes the per-category sums over each year, so
+    // the average spend is just a dot product of the amounts with them
+    const avgSpendForYear = (summary: YearSummary) => {
+      const total = categories.reduce((acc, cat) => {
+        const position = getCategoryPosition(cat.categoryId)
+        if (position === undefined) {
           // WTF?
           console.log(`Could not find category data for ${cat.categoryId}`)
           return NaN
         }
-        const rates = categoryData.rates
-        return keys.reduce((acc, key) => {
-          return acc + cat.amount * rates[key]
-        }, acc)
+        return acc + cat.amount * (summary.sums[position] ?? NaN)
       }, 0)
+      return total / summary.months.length
     }
 
-    const avgSpendBefore = sumSpendForKeys(prevKeys) / prevKeys.length
-    const avgSpendAfter = sumSpendForKeys(thisKeys) / thisKeys.length
+    const avgSpendBefore = avgSpendForYear(prevSummary)
+    const avgSpendAfter = avgSpendForYear(thisSummary)
 
     const avgSpendRatio = avgSpendAfter / avgSpendBefore
     // Annualize the ratio
-    const annualizedRatio = Math.pow(avgSpendRatio, 12 / thisKeys.length)
+    const annualizedRatio = Math.pow(avgSpendRatio, 12 / thisSummary.months.length)
 
     const personalRate = (annualizedRatio - 1.0) * 100
 
+    const months = thisSummary.months
     return {
       personalRate,
-      from: stringToTimePeriod(thisKeys[0]),
-      to: stringToTimePeriod(thisKeys[thisKeys.length - 1]),
-      isComplete: thisKeys.length === 12,
-      isLastComplete: year === determineLastCompleteYear()
+      from: createTimePeriod(year, months[0]),
+      to: createTimePeriod(year, months[months.length - 1]),
+      isComplete: months.length === 12,
+      isLastComplete: year === lastCompleteYear
     }
   }
 
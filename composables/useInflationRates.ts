@@ -1,31 +1,25 @@
-import type { CategoryInflationData, TimePeriod } from '~/types'
-import { stringToTimePeriod, timePeriodToString } from '~/types'
-import { inflationRates } from '~/data/inflationRates'
+import type { CategoryDefinition, TimePeriod } from '~/types'
+import { timePeriodToString } from '~/types'
+import { getRate, inflationCategories, inflationPeriods } from '~/utils/inflationData'
 
 export const useInflationRates = () => {
   const getRateForCategory = (categoryId: string, period: TimePeriod): number => {
-    const category = inflationRates.find(c => c.id === categoryId)
-    if (!category) return 0
-
-    const periodStr = timePeriodToString(period)
-    return category.rates[periodStr] || 0
+    return getRate(categoryId, timePeriodToString(period)) || 0
   }
 
   const getYearlyRateForCategory = (categoryId: string, year: number): number => {
-    const category = inflationRates.find(c => c.id === categoryId)
-    if (!category) return 0
-
     // Calculate average rate for the year
-    const yearRates = Object.entries(category.rates)
-      .filter(([period]) => period.startsWith(year.toString()))
-      .map(([, rate]) => rate)
+    const yearRates = inflationPeriods
+      .filter(period => period.startsWith(year.toString()))
+      .map(period => getRate(categoryId, period))
+      .filter((rate): rate is number => rate !== undefined)
 
     if (yearRates.length === 0) return 0
     return yearRates.reduce((sum, rate) => sum + rate, 0) / yearRates.length
   }
 
-  const getCategoryDefinition = (categoryId: string) => {
-    return inflationRates.find(c => c.id === categoryId)
+  const getCategoryDefinition = (categoryId: string): CategoryDefinition | undefined => {
+    return inflationCategories.find(c => c.id === categoryId)
   }
 
   return {
@@ -33,4 +27,4 @@ export const useInflationRates = () => {
     getYearlyRateForCategory,
     getCategoryDefinition
   }
-}
\ No newline at end of file
+}
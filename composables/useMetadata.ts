@@ -1,7 +1,7 @@
 
 import type { CategoryDefinition, TimePeriod } from '~/types'
 import { stringToTimePeriod } from '~/types'
-import { inflationRates } from '~/data/inflationRates'
+import { inflationCategories, inflationPeriods } from '~/utils/inflationData'
 
 export interface DataMetadata {
   categories: CategoryDefinition[],
@@ -10,17 +10,16 @@ export interface DataMetadata {
 }
 
 export const useMetadata = (): DataMetadata => {
-  const categories = inflationRates.map((rate) => {
+  const categories = inflationCategories.map((category) => {
     return {
-      id: rate.id,
-      name: rate.name,
-      description: rate.description,
+      id: category.id,
+      name: category.name,
+      description: category.description,
     }
   })
-  // We can assume that all categories have the same time periods
-  const timeKeys = Object.keys(inflationRates[0].rates)
-  const minTimePeriod = stringToTimePeriod(timeKeys.reduce((a, b) => a < b ? a : b, timeKeys[0]))
-  const maxTimePeriod = stringToTimePeriod(timeKeys.reduce((a, b) => a > b ? a : b, timeKeys[0]))
+  // The periods are sorted
+  const minTimePeriod = stringToTimePeriod(inflationPeriods[0])
+  const maxTimePeriod = stringToTimePeriod(inflationPeriods[inflationPeriods.length - 1])
 
   return {
     categories,
@@ -1,9 +1,9 @@
 import type { CategoryDefinition } from '~/types'
-import { inflationRates } from './inflationRates'
+import { inflationCategories } from '~/utils/inflationData'
 
 // Convert inflation rates data to category definitions
-export const categories: CategoryDefinition[] = inflationRates.map(rate => ({
-  id: rate.id,
-  name: rate.name,
-  description: rate.description
+export const categories: CategoryDefinition[] = inflationCategories.map(category => ({
+  id: category.id,
+  name: category.name,
+  description: category.description
 }))
\ No newline at end of file
@@ -0,0 +1,193 @@
+#! /usr/bin/env python3
+"""
+Benchmarks the stages of process.py on synthetic data.
+
+Every stage is timed (best of --repeat runs) and its peak Python memory is
+measured in a separate run under tracemalloc. The results are compared with
+a stored baseline and the script fails if any stage got slower or hungrier
+than the allowed ratio.
+
+The times are stored relative to a fixed pure Python workload timed in the
+same run, so that a baseline recorded on one machine can be checked on
+another. The ratios still shift a little between CPUs and Python versions,
+hence the generous default --max-ratio. Regenerate the baseline when a
+change is expected to make a stage slower.
+
+    ./benchmark.py --preset medium
+    ./benchmark.py --preset medium --update-baseline
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import process
+import synthetic
+
+DEFAULT_BASELINE = Path(__file__).absolute().parent / "benchmark_baseline.json"
+
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS_DIFFERENCE = 0.05
+MIN_MB_DIFFERENCE = 1.0
+
+PRESETS = {
+    # Roughly what production processes today
+    "small": synthetic.SyntheticConfig(years=7),
+    "medium": synthetic.SyntheticConfig(years=20, extra_depth=1, regions=4),
+    # Decades of data, full ECOICOP depth, all the regions
+    "large": synthetic.SyntheticConfig(start_year=1990, years=35, extra_depth=2, regions=14),
+}
+
+
+@dataclass
+class StageResult:
+    seconds: float
+    peak_mb: float
+    # seconds in units of the calibration workload, see calibrate
+    relative_seconds: float = 0.0
+
+
+def measure(function: Callable[[], object], repeat: int) -> Tuple[object, StageResult]:
+    # Returns the value of the function and the measurements
+    tracemalloc.start()
+    value = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return value, StageResult(seconds=best, peak_mb=peak / 1024 / 1024)
+
+
+def calibrate(repeat: int) -> float:
+    # Seconds of a fixed workload of dict, float and sorting operations, like
+    # the ones the stages are made of
+    def workload():
+        values = {}
+        for i in range(200_000):
+            values[f"{i:06d}"] = i * 1.5 % 997
+        return sorted(values.items(), key=lambda item: item[1])
+
+    return measure(workload, max(repeat, 3))[1].seconds
+
+
+def run_stages(input_files: List[Path], basket_csv: Path, repeat: int) -> Dict[str, StageResult]:
+    results = {}
+
+    def stage(name: str, function: Callable[[], object]):
+        value, results[name] = measure(function, repeat)
+        print(f"{name:<28} {results[name].seconds:9.3f} s {results[name].peak_mb:9.1f} MB")
+        return value
+
+    baskets = stage("basket_load", lambda: process.BasketVintages.load_from_specs([str(basket_csv)]))
+    parsed = stage("parse_xml", lambda: [
+        process.parse_xml(input_file, dataset=synthetic.DATASET) for input_file in input_files
+    ])
+    stage("check_all_categories_covered", lambda: [process.check_all_categories_covered(entries) for entries in parsed])
+
+    all_entries = {}
+    for entries in parsed:
+        for element, element_entries in entries.items():
+            all_entries.setdefault(element, []).extend(element_entries)
+
+    stage("rebase_entries", lambda: process.rebase_entries(all_entries))
+
+    # The outputs are national, see process.load_store_entries
+    all_entries = {
+        element: [entry for entry in element_entries if not entry.region]
+        for element, element_entries in all_entries.items()
+    }
+
+    # Same basket weight lookups as produce_inflation_data makes, one per entry
+    stage("code_weight_lookups", lambda: [
+        baskets.resolve(entry.time.period).code_weights.get(element.kod, 0.0)
+        for element, element_entries in all_entries.items()
+        for entry in element_entries
+    ])
+    inflation_data = stage("produce_inflation_data", lambda: process.produce_inflation_data(all_entries, baskets))
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("NumPy not available, skipping produce_inflation_data_numpy")
+    else:
+        stage("produce_inflation_data_numpy", lambda: process.produce_inflation_data_numpy(all_entries, baskets))
+    stage("serialize_inflation_data", lambda: process.serialize_inflation_data(inflation_data))
+
+    return results
+
+
+def compare(results: Dict[str, StageResult], baseline: Dict[str, dict], unit_seconds: float,
+            max_ratio: float) -> List[str]:
+    # The baseline times are converted to this machine by the unit_seconds
+    # of this run
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, expected, min_difference in (
+            ("seconds", baseline[name]["relative_seconds"] * unit_seconds, MIN_SECONDS_DIFFERENCE),
+            ("peak_mb", baseline[name]["peak_mb"], MIN_MB_DIFFERENCE),
+        ):
+            actual = getattr(result, metric)
+            if actual - expected > min_difference and actual > expected * max_ratio:
+                regressions.append(f"{name}: {metric} {actual:.3f} vs baseline {expected:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the process.py stages on synthetic data.")
+    parser.add_argument("--preset", choices=list(PRESETS), default="small")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every stage")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--max-ratio", type=float, default=2.0,
+        help="Fail when a stage is this many times slower or bigger than the baseline"
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--data-dir", type=Path, help="Keep the generated data in this directory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or Path(tmp_dir)
+        print(f"Generating {args.preset} dataset in {data_dir}")
+        input_files = synthetic.generate(data_dir, PRESETS[args.preset])
+        results = run_stages(input_files, data_dir / "basket.csv", args.repeat)
+    unit_seconds = calibrate(args.repeat)
+    print(f"{'calibration':<28} {unit_seconds:9.3f} s")
+    for result in results.values():
+        result.relative_seconds = result.seconds / unit_seconds
+
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.update_baseline:
+        # Only the relative times, the absolute ones are of this machine
+        baselines[args.preset] = {
+            name: {"relative_seconds": result.relative_seconds, "peak_mb": result.peak_mb}
+            for name, result in results.items()
+        }
+        args.baseline.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if args.preset not in baselines:
+        print(f"No baseline for the {args.preset} preset")
+        return
+    regressions = compare(results, baselines[args.preset], unit_seconds, args.max_ratio)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Columnar NumPy engine for the category aggregation in process.py.
+
+Instead of grouping Entry objects in dicts, the entries are binned into a
+region x ECOICOP x period cube of sums and observation counts. The regions
+only add up, so every category's weighted average for every period comes
+out of a matrix product of a category x ECOICOP weight matrix with the
+region totals, one matrix per basket vintage. Another region costs one more
+slice of the cube, not more Python objects.
+
+This module deliberately does not import process.py (which is usually run
+as __main__), it works with anything that looks like its entries and
+categories.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+# (year, month)
+Period = Tuple[int, int]
+
+
+@dataclass
+class ObservationCube:
+    # Distinct regions, ECOICOP codes and periods, the axes of the arrays
+    regions: List[str]
+    codes: List[str]
+    periods: List[Period]
+    # Region x code x period sum and number of the observations. A cell can
+    # have several observations, e.g. from overlapping exports, which the
+    # weighting then counts like any other.
+    sums: np.ndarray
+    counts: np.ndarray
+
+    @staticmethod
+    def from_entries(entries: Mapping[object, Sequence[object]]) -> "ObservationCube":
+        region_index = {}
+        code_index = {}
+        period_index = {}
+        region_indices = []
+        code_indices = []
+        period_indices = []
+        values = []
+        for element, element_entries in entries.items():
+            code = code_index.setdefault(element.kod, len(code_index))
+            for entry in element_entries:
+                # The month precomputed by process.validate_time
+                month = entry.time.period
+                if month is None:
+                    raise ValueError(f"Time {entry.time} of ECOICOP {element.kod} is not a validated month")
+                region_indices.append(region_index.setdefault(entry.region, len(region_index)))
+                code_indices.append(code)
+                period_indices.append(period_index.setdefault(month, len(period_index)))
+                values.append(entry.value)
+
+        # Renumber the regions and periods, so that the axes are sorted
+        regions = sorted(region_index)
+        region_remap = np.empty(len(regions), dtype=np.int64)
+        for new_index, region in enumerate(regions):
+            region_remap[region_index[region]] = new_index
+        months = sorted(period_index, key=lambda month: (month.year, month.month))
+        period_remap = np.empty(len(months), dtype=np.int64)
+        for new_index, month in enumerate(months):
+            period_remap[period_index[month]] = new_index
+
+        # One flat bin per cell, so that a single bincount fills the cube
+        shape = (len(regions), len(code_index), len(months))
+        cells = np.ravel_multi_index(
+            (
+                region_remap[np.asarray(region_indices, dtype=np.int64)],
+                np.asarray(code_indices, dtype=np.int64),
+                period_remap[np.asarray(period_indices, dtype=np.int64)],
+            ),
+            shape,
+        )
+        size = int(np.prod(shape))
+        return ObservationCube(
+            regions=regions,
+            codes=list(code_index),
+            periods=[(month.year, month.month) for month in months],
+            sums=np.bincount(cells, np.asarray(values, dtype=np.float64), minlength=size).reshape(shape),
+            counts=np.bincount(cells, minlength=size).reshape(shape),
+        )
+
+
+def build_weight_matrix(categories: Sequence[object], codes: List[str],
+                        code_weights: Sequence[Mapping[str, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the vintage x category x ECOICOP weight tensor and the boolean
+    category x ECOICOP membership matrix.
+    """
+    membership = np.zeros((len(categories), len(codes)), dtype=bool)
+    for category_index, category in enumerate(categories):
+        for code_index, code in enumerate(codes):
+            membership[category_index, code_index] = code in category.ecoicop_numbers
+
+    vintage_weights = np.array(
+        [[vintage.get(code, 0.0) for code in codes] for vintage in code_weights], dtype=np.float64
+    ).reshape(len(code_weights), len(codes))
+    weights = np.where(membership[None, :, :], vintage_weights[:, None, :], 0.0)
+    return weights, membership
+
+
+def compute_category_rates(entries: Mapping[object, Sequence[object]], categories: Sequence[object],
+                           code_weights: Sequence[Mapping[str, float]],
+                           vintage_of: Callable[[Period], int]) -> Dict[str, Dict[Period, float]]:
+    """
+    Computes the weighted average of every category for every period. The
+    observations of all the regions in entries are averaged with equal
+    weights, so process.py only passes the national ones.
+
+    Args:
+        entries: Entries grouped by their element, as produced by process.py
+        categories: Category definitions with `id` and `ecoicop_numbers`
+        code_weights: ECOICOP -> basket weight, one mapping per basket vintage
+        vintage_of: Returns the index into code_weights of the vintage in
+            effect in a period, called once per distinct period
+
+    Returns:
+        Category id -> (year, month) -> rate, periods sorted
+    """
+    cube = ObservationCube.from_entries(entries)
+    weights, membership = build_weight_matrix(categories, cube.codes, code_weights)
+
+    # Code x period totals over the regions, the weights do not depend on
+    # the region
+    code_sums = cube.sums.sum(axis=0)
+    code_counts = cube.counts.sum(axis=0).astype(np.float64)
+
+    n_categories = len(categories)
+    n_periods = len(cube.periods)
+    weighted_sums = np.zeros((n_categories, n_periods))
+    total_weights = np.zeros((n_categories, n_periods))
+    counts = np.zeros((n_categories, n_periods))
+
+    period_vintages = np.array([vintage_of(period) for period in cube.periods], dtype=np.int64)
+    for vintage in np.unique(period_vintages):
+        columns = period_vintages == vintage
+        vintage_weights = weights[vintage]
+
+        # A code of a category observed in a period needs a weight in it
+        observed = code_counts[:, columns].any(axis=1)
+        missing = membership & ~(vintage_weights > 0) & observed[None, :]
+        if missing.any():
+            _, code_index = np.argwhere(missing)[0]
+            raise ValueError(f"Expected positive weight for ECOICOP {cube.codes[code_index]}")
+
+        weighted_sums[:, columns] = vintage_weights @ code_sums[:, columns]
+        total_weights[:, columns] = vintage_weights @ code_counts[:, columns]
+        counts[:, columns] = membership.astype(np.float64) @ code_counts[:, columns]
+
+    present = counts > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = weighted_sums / total_weights
+
+    result = {}
+    for category_index, category in enumerate(categories):
+        category_present = present[category_index]
+        result[category.id] = {
+            period: float(rates[category_index, period_index])
+            for period_index, period in enumerate(cube.periods)
+            if category_present[period_index]
+        }
+    return result
+
+
+def compare_rates(expected: Dict[str, Dict[Period, float]], actual: Dict[str, Dict[Period, float]],
+                  rtol: float = 1e-9) -> List[str]:
+    """Returns a list of human readable differences, empty if they match."""
+    differences = []
+    for category_id in sorted(set(expected) | set(actual)):
+        expected_rates = expected.get(category_id, {})
+        actual_rates = actual.get(category_id, {})
+        for period in sorted(set(expected_rates) | set(actual_rates)):
+            if period not in actual_rates or period not in expected_rates:
+                differences.append(f"{category_id} {period[0]}-{period[1]:02d}: present in only one result")
+                continue
+            if not np.isclose(actual_rates[period], expected_rates[period], rtol=rtol, atol=0.0):
+                differences.append(
+                    f"{category_id} {period[0]}-{period[1]:02d}: "
+                    f"expected {expected_rates[period]}, got {actual_rates[period]}"
+                )
+    return differences
@@ -0,0 +1,110 @@
+"""
+Reading and writing of optionally compressed ČSÚ exports.
+
+The exports are verbose XML, so they are usually stored compressed. Files
+are always streamed in chunks, never loaded into memory as a whole. The
+reader detects the compression from the magic bytes, so the file name does
+not matter.
+"""
+
+import gzip
+import io
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+CHUNK_SIZE = 64 * 1024
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+COMPRESSIONS = [COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZSTD]
+
+_SUFFIXES = {
+    '.gz': COMPRESSION_GZIP,
+    '.zst': COMPRESSION_ZSTD,
+}
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _import_zstandard():
+    # zstandard is an optional dependency, gzip is always available
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression requires the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def compression_from_suffix(path: Path) -> str:
+    """Guesses the compression from the file name, e.g. data.xml.gz -> gzip."""
+    return _SUFFIXES.get(path.suffix, COMPRESSION_NONE)
+
+
+def _compression_from_magic(magic: bytes) -> str:
+    if magic.startswith(_GZIP_MAGIC):
+        return COMPRESSION_GZIP
+    if magic.startswith(_ZSTD_MAGIC):
+        return COMPRESSION_ZSTD
+    return COMPRESSION_NONE
+
+
+def detect_compression(path: Path) -> str:
+    with path.open('rb') as f:
+        return _compression_from_magic(f.read(4))
+
+
+def open_output(path: Path, compression: str) -> BinaryIO:
+    """Opens a binary file for writing, compressing everything written to it."""
+    if compression == COMPRESSION_NONE:
+        return path.open('wb')
+    if compression == COMPRESSION_GZIP:
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == COMPRESSION_ZSTD:
+        zstandard = _import_zstandard()
+        return zstandard.ZstdCompressor(level=10).stream_writer(path.open('wb'), closefd=True)
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def open_input(source: Union[Path, BinaryIO], compression: Optional[str] = None) -> BinaryIO:
+    """
+    Opens a possibly compressed file for reading, the returned stream yields
+    the decompressed bytes. The source can also be a seekable binary stream,
+    e.g. an io.BytesIO of a download.
+    """
+    if not isinstance(source, Path):
+        if compression is None:
+            compression = _compression_from_magic(source.read(4))
+            source.seek(0)
+        if compression == COMPRESSION_NONE:
+            return source
+        if compression == COMPRESSION_GZIP:
+            return gzip.GzipFile(fileobj=source, mode='rb')
+        if compression == COMPRESSION_ZSTD:
+            zstandard = _import_zstandard()
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(source), buffer_size=CHUNK_SIZE)
+        raise ValueError(f"Unknown compression {compression}")
+
+    if compression is None:
+        compression = detect_compression(source)
+    if compression == COMPRESSION_NONE:
+        return source.open('rb')
+    if compression == COMPRESSION_GZIP:
+        return gzip.open(source, 'rb')
+    if compression == COMPRESSION_ZSTD:
+        zstandard = _import_zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(source.open('rb'), closefd=True)
+        return io.BufferedReader(reader, buffer_size=CHUNK_SIZE)
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def recompress(source: Path, destination: Path, compression: str):
+    """Copies source to destination, converting it to the given compression."""
+    source_compression = detect_compression(source)
+    if source_compression == compression:
+        shutil.copyfile(source, destination)
+        return
+    with open_input(source, source_compression) as src, open_output(destination, compression) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
@@ -0,0 +1,103 @@
+"""
+Registry of the ČSÚ tables that fetch.py and process.py handle.
+
+Every dataset describes the query of its XML export, i.e. the parameters of
+the vdb.czso.cz xmlexp endpoint, and the dimensions its observations are
+keyed by. The downloader builds its requests from the dataset and the
+parser keeps the dimensions it names, so supporting another table only
+takes registering it here. Observations of a table with a region dimension
+are kept per region, exports without it are national. The outputs only use
+the national observations.
+
+This module deliberately does not import fetch.py or process.py, both of
+them use it.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# The parameters every export is requested with: the whole table as XML,
+# with the codes, definitions, attributes and the time dictionary
+EXPORT_PARAMS = {
+    "page": "vystup-objekt",
+    "z": "T",
+    "f": "TABULKA",
+    "kodjaz": "203",
+    "nasexp": "ss",
+    "expJenKody": "N",
+    "expdefinice": "A",
+    "datovytyp": "A",
+    "expatrib": "A",
+    "expcasdb": "A",
+}
+
+REFERER_URL = "https://vdb.czso.cz/vdbvo2/faces/cs/index.jsf"
+
+
+@dataclass(frozen=True)
+class Dataset:
+    # Key in DATASETS, also used on the command line
+    id: str
+    title: str
+    # The pvo, skupId and katalog parameters of the export
+    table: str
+    group_id: str
+    catalog: str
+    # The evo selections, {version} and {year} are filled in per request
+    selections: Tuple[str, ...]
+    # The str parameter, the layout of the table
+    layout: str
+    default_version: str
+    # Name of the downloaded files, {year} is filled in
+    file_template: str
+    # The dim of the elements with the ECOICOP codes and with the regions.
+    # The exports of national tables also name their one territory, their
+    # region_dimension is None, so that their observations are national.
+    code_dimension: str = "ECOICOP"
+    region_dimension: Optional[str] = None
+    # Code of Česko in the territory codelist (číselník 97). Its observations
+    # in regional tables are kept as national ones, i.e. with an empty region.
+    national_region: str = "19"
+
+    def query_params(self, year: int, version: str) -> dict:
+        return {
+            **EXPORT_PARAMS,
+            "skupId": self.group_id,
+            "katalog": self.catalog,
+            "pvo": self.table,
+            "evo": [selection.format(version=version, year=year) for selection in self.selections],
+            "str": self.layout,
+        }
+
+    def referer(self, year: int, version: str) -> str:
+        # The page of the table in the web UI, which the export is linked from
+        query = [
+            ("page", "vystup-objekt"),
+            ("pvo", self.table),
+            ("z", "T"),
+            ("f", "TABULKA"),
+            ("skupId", self.group_id),
+            ("katalog", self.catalog),
+            *(("evo", selection.format(version=version, year=year)) for selection in self.selections),
+            ("str", self.layout),
+        ]
+        return f"{REFERER_URL}?{'&'.join(f'{name}={value}' for name, value in query)}"
+
+
+CPI_ECOICOP = Dataset(
+    id="cpi-ecoicop",
+    title="Indexy spotřebitelských cen podle ECOICOP, Česká republika (CEN082A)",
+    table="CEN082A",
+    group_id="2198",
+    catalog="31779",
+    selections=("{version}_!_CEN082A-{year}_1", "v9744_!_CEN08klasifikacelek-kopie_1"),
+    layout="v3409",
+    default_version="v10111",
+    file_template="eucoicop_{year}.xml.gz",
+)
+
+# Regional CPI and HICP tables go here once their export parameters are
+# known, the parsing and aggregation already handle the region dimension
+DATASETS: Dict[str, Dataset] = {dataset.id: dataset for dataset in (CPI_ECOICOP,)}
+
+DEFAULT_DATASET = CPI_ECOICOP
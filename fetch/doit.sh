@@ -7,22 +7,9 @@ set -e
 current_year=$(date +"%Y")
 start_year=2018
 
-# Create arrays to store filenames
-declare -a xml_files
-declare -a process_args
-
-# First, fetch all XML files
-echo "Fetching XML files..."
-for year in $(seq $start_year $current_year)
-do
-    output_file="eucoicop_${year}.xml"
-    echo "Fetching data for ${year}..."
-    ./fetch.py -y ${year} -o ${output_file}
-    xml_files+=("${output_file}")
-done
-
-# Process all XML files together
-echo -e "\nProcessing XML files..."
-output_file="output_$(date +"%Y%m%d").json"
-echo "Processing all files..."
-./process.py "${xml_files[@]}"
+# Fetch the XML exports of all the years and process them in one process,
+# the downloads go straight to the parser without intermediate files.
+# Exits with 3 when the data did not change and the outputs were left
+# untouched, extra arguments (e.g. --force) are passed to process.py
+echo "Fetching and processing ${start_year}-${current_year}..."
+./pipeline.py run -y "${start_year}-${current_year}" --prune-download-cache --output-format chunked --ecoicop-dir ../public/data/ecoicop "$@"
@@ -0,0 +1,100 @@
+"""
+Prefix tree over ECOICOP codes.
+
+ECOICOP codes are hierarchical by prefix, 01 contains 011, which contains
+0111 and so on. The index answers weight, subtree, children and overlap
+queries without rescanning every known code.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ("code", "children", "present", "weight", "element")
+
+    def __init__(self, code: str):
+        self.code = code
+        # Next character -> node
+        self.children: Dict[str, "_Node"] = {}
+        # Whether the code itself was added, or the node is only a prefix
+        self.present = False
+        self.weight = 0.0
+        self.element = None
+
+
+class EcoicopIndex:
+
+    def __init__(self, codes: Iterable[str] = ()):
+        self._root = _Node("")
+        # Direct access to the nodes, the tree is only walked for subtrees
+        self._nodes: Dict[str, _Node] = {"": self._root}
+        for code in codes:
+            self.add(code)
+
+    def add(self, code: str, weight: float = 0.0, element=None):
+        node = self._root
+        for i, char in enumerate(code):
+            child = node.children.get(char)
+            if child is None:
+                child = _Node(code[:i + 1])
+                node.children[char] = child
+                self._nodes[child.code] = child
+            node = child
+        node.present = True
+        node.weight += weight
+        if element is not None:
+            node.element = element
+
+    def __contains__(self, code: str) -> bool:
+        node = self._nodes.get(code)
+        return node is not None and node.present
+
+    def __iter__(self) -> Iterator[str]:
+        return self._iter_present(self._root)
+
+    def weight(self, code: str) -> float:
+        # Weight of the code itself, 0 for unknown codes
+        node = self._nodes.get(code)
+        return node.weight if node is not None else 0.0
+
+    def element(self, code: str):
+        node = self._nodes.get(code)
+        return node.element if node is not None else None
+
+    @staticmethod
+    def _iter_present(node: _Node) -> Iterator[str]:
+        if node.present:
+            yield node.code
+        for char in sorted(node.children):
+            yield from EcoicopIndex._iter_present(node.children[char])
+
+    def subtree(self, code: str) -> List[str]:
+        # All the known codes starting with code, including code itself
+        node = self._nodes.get(code)
+        return list(self._iter_present(node)) if node is not None else []
+
+    def children(self, code: str) -> List[str]:
+        # The nearest known descendants, skipping the levels that are missing
+        node = self._nodes.get(code)
+        if node is None:
+            return []
+
+        result = []
+        stack = [node.children[char] for char in sorted(node.children, reverse=True)]
+        while stack:
+            child = stack.pop()
+            if child.present:
+                result.append(child.code)
+            else:
+                stack.extend(child.children[char] for char in sorted(child.children, reverse=True))
+        return result
+
+    @staticmethod
+    def find_overlap(codes: Iterable[str]) -> Optional[Tuple[str, str]]:
+        # Returns a (parent, child) pair if any of the codes contains another
+        codes = set(codes)
+        for code in codes:
+            for length in range(1, len(code)):
+                if code[:length] in codes:
+                    return code[:length], code
+        return None
@@ -1,19 +1,256 @@
 #!/usr/bin/env python3
 
 import argparse
+import fcntl
+import hashlib
+import json
+import os
 import requests
 import logging
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import Optional
-from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+import compressed_io
+from datasets import DATASETS, DEFAULT_DATASET, Dataset
+from years import parse_years
+
+T = TypeVar('T')
+
+
+@contextmanager
+def replace_atomically(path: Path):
+    """
+    Yields a temporary path next to `path` that replaces it once the block
+    finishes, so that a crash never leaves a truncated file behind.
+    """
+    tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of downloading a single year."""
+    year: int
+    output_path: Optional[Path] = None
+    # The uncompressed export, when downloaded into memory
+    content: Optional[bytes] = None
+    error: Optional[Exception] = None
+    # One of the DownloadCache.STATUS_* values
+    cache_status: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class CacheEntry:
+    """Metadata of a cached export, the body itself is stored by its hash."""
+    year: int
+    version: str
+    sha256: str
+    fetched_at: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class DownloadCache:
+    """
+    Content-addressed cache of ČSÚ exports.
+
+    Every request is identified by a key derived from the year, version and
+    query parameters. The key maps to a small JSON file with the validators
+    (ETag/Last-Modified) and the SHA-256 of the uncompressed body, which is
+    stored (compressed) under objects/<sha256>.
+
+    Several processes may share the cache, e.g. the watch daemon and a
+    scheduled run. Each of them holds a shared lock on the .lock file while
+    it has the cache open, and objects are only deleted under an exclusive
+    lock, so never while another process could be reading or adding them.
+    """
+
+    STATUS_HIT = 'hit'                  # Served from the cache, no request made
+    STATUS_REVALIDATED = 'revalidated'  # Server answered 304 Not Modified
+    STATUS_UNCHANGED = 'unchanged'      # Downloaded, but the hash did not change
+    STATUS_MISS = 'miss'                # Downloaded new content
+    STATUS_DISABLED = 'disabled'        # No cache in use
+
+    def __init__(self, cache_dir: Path, compression: str = compressed_io.COMPRESSION_GZIP):
+        self.cache_dir = cache_dir
+        self.compression = compression
+        self.objects_dir = cache_dir / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock_file = (cache_dir / '.lock').open('a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+        # Serializes the lock conversions of the threads of this process
+        self._exclusive_lock = threading.Lock()
+
+    def close(self):
+        """Releases the lock, the cache must not be used afterwards."""
+        self._lock_file.close()
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[bool]:
+        """
+        Yields whether this is the only process with the cache open, and
+        keeps it that way until the block ends.
+        """
+        with self._exclusive_lock:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                exclusive = True
+            except BlockingIOError:
+                exclusive = False
+            try:
+                yield exclusive
+            finally:
+                # Also after a failed conversion, which may drop the lock
+                fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+
+    @staticmethod
+    def make_key(year: int, version: str, params: dict) -> str:
+        key_data = json.dumps(
+            {'year': year, 'version': version, 'params': params},
+            sort_keys=True
+        )
+        return hashlib.sha256(key_data.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.json'
+
+    def _object_path(self, sha256: str) -> Path:
+        return self.objects_dir / sha256
+
+    def _read_entry(self, entry_path: Path) -> Optional[CacheEntry]:
+        if not entry_path.exists():
+            return None
+        return CacheEntry(**json.loads(entry_path.read_text()))
+
+    def _referenced_objects(self) -> set:
+        # The hashes of the bodies the entries point to, there is only one
+        # entry per year and version
+        return {self._read_entry(entry_path).sha256 for entry_path in self.cache_dir.glob('*.json')}
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._read_entry(self._entry_path(key))
+        if entry is None or not self._object_path(entry.sha256).exists():
+            return None
+        return entry
+
+    def object_path(self, entry: CacheEntry) -> Path:
+        return self._object_path(entry.sha256)
+
+    def add_object(self, body_path: Path, sha256: str) -> Path:
+        """Moves a downloaded (already compressed) body into the cache."""
+        object_path = self._object_path(sha256)
+        if object_path.exists():
+            body_path.unlink()
+        else:
+            os.replace(body_path, object_path)
+        return object_path
+
+    def put(self, key: str, entry: CacheEntry):
+        """
+        Stores the entry of the key, and deletes the body it replaces unless
+        another entry still points to it. Otherwise every revision of the
+        current year would stay in the cache forever. While another process
+        has the cache open, the body is left for prune.
+        """
+        previous = self._read_entry(self._entry_path(key))
+        with replace_atomically(self._entry_path(key)) as tmp_path:
+            tmp_path.write_text(json.dumps(asdict(entry), indent=2))
+        if previous is None or previous.sha256 == entry.sha256:
+            return
+        with self._exclusive() as exclusive:
+            if exclusive and previous.sha256 not in self._referenced_objects():
+                self._object_path(previous.sha256).unlink(missing_ok=True)
+
+    def prune(self) -> Optional[int]:
+        """
+        Deletes the bodies no entry points to, such as those superseded
+        while another process had the cache open. The downloads of this
+        process add their bodies before their entries, so it must not be
+        called while they are in progress.
+
+        Returns:
+            Optional[int]: Number of deleted bodies, None if skipped because
+            another process has the cache open
+        """
+        with self._exclusive() as exclusive:
+            if not exclusive:
+                logging.warning(f"Not pruning {self.cache_dir}, another process is using it")
+                return None
+            referenced = self._referenced_objects()
+            unreferenced = [
+                object_path for object_path in self.objects_dir.iterdir()
+                if not object_path.name.startswith('.') and object_path.name not in referenced
+            ]
+            for object_path in unreferenced:
+                object_path.unlink()
+        logging.info(f"Pruned {len(unreferenced)} unused bodies from {self.cache_dir}")
+        return len(unreferenced)
+
 
 class CSUDownloader:
-    """Downloads data from Czech Statistical Office (ČSÚ)."""
+    """Downloads the exports of a dataset from Czech Statistical Office (ČSÚ)."""
     
     BASE_URL = "https://vdb.czso.cz/vdbvo2/faces/cs/xmlexp"
+
+    # Status codes worth retrying, everything else fails immediately
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    # ČSÚ occasionally revises the last months of a year early in the next
+    # one, so a year only counts as closed this many months after it ended
+    CLOSED_YEAR_LAG_MONTHS = 3
     
-    def __init__(self):
+    def __init__(self, base_url: str = BASE_URL, max_workers: int = 4,
+                 retries: int = 3, backoff: float = 1.0, timeout: float = 120.0,
+                 cache: Optional[DownloadCache] = None, refresh: bool = False,
+                 compression: Optional[str] = None, dataset: Dataset = DEFAULT_DATASET):
+        """
+        Args:
+            base_url: URL of the XML export endpoint (override to point at a local server)
+            max_workers: Maximum number of concurrent requests to ČSÚ
+            retries: How many times to retry a failed request
+            backoff: Base delay in seconds, doubled after every failed attempt
+            timeout: Timeout of a single request in seconds
+            cache: Optional download cache
+            refresh: Revalidate even closed years instead of trusting the cache
+            compression: Compression of the output files, guessed from the
+                file suffix when not given
+            dataset: The table to download, see datasets.py
+        """
+        self.base_url = base_url
+        self.dataset = dataset
+        self.compression = compression
+        self.cache = cache
+        self.refresh = refresh
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
         self.session = requests.Session()
+        # One pooled session shared by all the workers, so that we do not pay
+        # for a new TLS handshake for every year
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:133.0) Gecko/20100101 Firefox/133.0',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
@@ -21,65 +258,282 @@ class CSUDownloader:
             'Accept-Encoding': 'gzip, deflate, br, zstd'
         })
 
-    def download_price_data(self, year: int, output_path: Optional[Path] = None, version: str = "v10111") -> str:
+    @staticmethod
+    def _validate_year(year: int):
+        current_year = datetime.now().year
+        if not (1990 <= year <= current_year):
+            raise ValueError(f"Year must be between 1990 and {current_year}")
+
+    @classmethod
+    def is_closed_year(cls, year: int) -> bool:
+        """Whether the data for the year are final and will not change anymore."""
+        now = datetime.now()
+        months_since_end = (now.year - year - 1) * 12 + now.month
+        return months_since_end > cls.CLOSED_YEAR_LAG_MONTHS
+
+    def _build_params(self, year: int, version: str) -> dict:
+        return self.dataset.query_params(year, version)
+
+    def _get(self, year: int, version: str, consume: Callable[[requests.Response], T],
+             extra_headers: Optional[dict] = None) -> T:
+        """
+        Performs the request for a single year and returns what `consume`
+        makes of the response, typically by streaming its body. Transient
+        failures of both the request and the streaming are retried with
+        exponential backoff, so `consume` has to be safe to call again.
+        """
+        params = self._build_params(year, version)
+        headers = {
+            'Referer': self.dataset.referer(year, version)
+        }
+        headers.update(extra_headers or {})
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.get(
+                    self.base_url,
+                    params=params,
+                    headers=headers,
+                    timeout=self.timeout,
+                    stream=True
+                )
+                try:
+                    response.raise_for_status()
+                    return consume(response)
+                finally:
+                    # With stream=True, the connection only goes back to the
+                    # pool once the response is closed
+                    response.close()
+            except requests.RequestException as e:
+                # Also covers the errors while streaming the body, such as
+                # ChunkedEncodingError, which have no response
+                status = e.response.status_code if e.response is not None else None
+                retryable = status is None or status in self.RETRY_STATUS_CODES
+                if not retryable or attempt > self.retries:
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1)
+                logging.warning(f"Year {year}: attempt {attempt} failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    @staticmethod
+    def _stream_response(response: requests.Response, output_path: Path, output_compression: str,
+                         content: Optional[bytearray] = None) -> str:
+        """
+        Writes the response body to a file chunk by chunk, and also appends
+        it to `content` if given.
+
+        Returns:
+            str: SHA-256 of the uncompressed body
+        """
+        digest = hashlib.sha256()
+        with response, compressed_io.open_output(output_path, output_compression) as f:
+            for chunk in response.iter_content(compressed_io.CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+                if content is not None:
+                    content += chunk
+        return digest.hexdigest()
+
+    def _fetch_cached(self, year: int, version: str, content: Optional[bytearray] = None) -> Tuple[Path, str]:
+        """
+        Makes sure the export for the year is in the cache.
+
+        Closed years are served straight from the cache. Other years are
+        revalidated with a conditional request, and if the server does not
+        support it, the hash of the new body is compared with the cached one.
+        A downloaded body is also appended to `content` if given, so that it
+        does not have to be read back from the cache.
+
+        Returns:
+            Tuple[Path, str]: Path to the cached body and the cache status
+        """
+        key = DownloadCache.make_key(year, version, self._build_params(year, version))
+        entry = self.cache.get(key)
+        if entry is not None and not self.refresh and self.is_closed_year(year):
+            return self.cache.object_path(entry), DownloadCache.STATUS_HIT
+
+        conditional_headers = {}
+        if entry is not None:
+            if entry.etag:
+                conditional_headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                conditional_headers['If-Modified-Since'] = entry.last_modified
+
+        def stream(response: requests.Response) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+            # None if not modified, the hash, ETag and Last-Modified otherwise
+            if entry is not None and response.status_code == 304:
+                return None
+            if content is not None:
+                # Drop whatever a failed attempt collected
+                del content[:]
+            sha256 = self._stream_response(response, Path(tmp_name), self.cache.compression, content)
+            return sha256, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache.objects_dir, prefix='.tmp-')
+        os.close(fd)
+        try:
+            downloaded = self._get(year, version, stream, conditional_headers)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        if downloaded is None:
+            os.unlink(tmp_name)
+            return self.cache.object_path(entry), DownloadCache.STATUS_REVALIDATED
+
+        sha256, etag, last_modified = downloaded
+        object_path = self.cache.add_object(Path(tmp_name), sha256)
+
+        status = DownloadCache.STATUS_MISS
+        if entry is not None and entry.sha256 == sha256:
+            status = DownloadCache.STATUS_UNCHANGED
+        self.cache.put(key, CacheEntry(
+            year=year,
+            version=version,
+            sha256=sha256,
+            fetched_at=datetime.now(timezone.utc).isoformat(),
+            etag=etag,
+            last_modified=last_modified
+        ))
+        return object_path, status
+
+    def download_price_data(self, year: int, output_path: Path, version: Optional[str] = None) -> DownloadResult:
         """
         Downloads price data from ČSÚ for a specific year.
+
+        The body is streamed to disk in chunks and never held in memory.
         
         Args:
             year: The year for which to download data
-            output_path: Optional path to save the data to
-            version: The version code for the ČSÚ API (defaults to v10111)
+            output_path: Path to save the data to
+            version: The version code for the ČSÚ API (defaults to the one of the dataset)
             
         Returns:
-            str: The downloaded data as a string
+            DownloadResult: Where the data were saved and the cache status
         """
-        # Validate year
-        current_year = datetime.now().year
-        if not (1990 <= year <= current_year):
-            raise ValueError(f"Year must be between 1990 and {current_year}")
+        self._validate_year(year)
+        version = version or self.dataset.default_version
+        output_compression = self.compression or compressed_io.compression_from_suffix(output_path)
 
-        params = {
-            'page': 'vystup-objekt',
-            'z': 'T',
-            'f': 'TABULKA',
-            'skupId': '2198',
-            'katalog': '31779',
-            'pvo': 'CEN082A',
-            'evo': [
-                f'{version}_!_CEN082A-{year}_1',
-                'v9744_!_CEN08klasifikacelek-kopie_1'
-            ],
-            'str': 'v3409',
-            'kodjaz': '203',
-            'nasexp': 'ss',
-            'expJenKody': 'N',
-            'expdefinice': 'A',
-            'datovytyp': 'A',
-            'expatrib': 'A',
-            'expcasdb': 'A'
-        }
-        
         try:
-            response = self.session.get(
-                self.BASE_URL,
-                params=params,
-                headers={
-                    'Referer': f'https://vdb.czso.cz/vdbvo2/faces/cs/index.jsf?page=vystup-objekt&pvo=CEN082A&z=T&f=TABULKA&skupId=2198&katalog=31779&evo={version}_!_CEN082A-{year}_1&&evo=v9744_!_CEN08klasifikacelek-kopie_1&str=v3409'
-                }
-            )
-            response.raise_for_status()
-            
-            if output_path:
-                output_path.write_text(response.text, encoding='utf-8')
-                logging.info(f"Data saved to {output_path}")
-            
-            return response.text
+            with replace_atomically(output_path) as tmp_path:
+                if self.cache is None:
+                    self._get(
+                        year, version, lambda response: self._stream_response(response, tmp_path, output_compression)
+                    )
+                    cache_status = DownloadCache.STATUS_DISABLED
+                else:
+                    cached_path, cache_status = self._fetch_cached(year, version)
+                    compressed_io.recompress(cached_path, tmp_path, output_compression)
+            logging.debug(f"Year {year}: cache {cache_status}")
+            logging.info(f"Data saved to {output_path}")
+
+            return DownloadResult(year=year, output_path=output_path, cache_status=cache_status)
             
         except requests.RequestException as e:
             logging.error(f"Failed to download data: {str(e)}")
             raise
 
-def parse_args() -> argparse.Namespace:
+    def fetch_price_data(self, year: int, version: Optional[str] = None) -> DownloadResult:
+        """
+        Downloads price data from ČSÚ for a specific year into memory, so that
+        it can be parsed right away without writing it to a file.
+
+        The cache is used the same way as by download_price_data. A body
+        that gets downloaded is kept in memory while it is written to the
+        cache, only the cache hits are read from it.
+
+        Args:
+            year: The year for which to download data
+            version: The version code for the ČSÚ API (defaults to the one of the dataset)
+
+        Returns:
+            DownloadResult: The uncompressed export and the cache status
+        """
+        self._validate_year(year)
+        version = version or self.dataset.default_version
+
+        if self.cache is None:
+            content = self._get(year, version, lambda response: response.content)
+            cache_status = DownloadCache.STATUS_DISABLED
+        else:
+            downloaded = bytearray()
+            cached_path, cache_status = self._fetch_cached(year, version, downloaded)
+            if cache_status in (DownloadCache.STATUS_HIT, DownloadCache.STATUS_REVALIDATED):
+                with compressed_io.open_input(cached_path) as f:
+                    content = f.read()
+            else:
+                content = bytes(downloaded)
+        logging.debug(f"Year {year}: cache {cache_status}")
+
+        return DownloadResult(year=year, content=content, cache_status=cache_status)
+
+    def fetch_years(self, years: Iterable[int], version: Optional[str] = None) -> List[DownloadResult]:
+        """
+        Downloads price data for several years concurrently into memory, see
+        fetch_price_data and download_years. All the exports are held in
+        memory at once, see iter_fetch_years for the alternative.
+
+        Returns:
+            List[DownloadResult]: One result per year, in the order of `years`
+        """
+        return list(self.iter_fetch_years(years, version))
+
+    def iter_fetch_years(self, years: Iterable[int], version: Optional[str] = None) -> Iterator[DownloadResult]:
+        """
+        Same as fetch_years, but yields the results in the order of `years`
+        and downloads at most `max_workers` years ahead of the consumer. So
+        only a few exports are in memory at a time if the consumer drops
+        every export once it is done with it.
+
+        Yields:
+            DownloadResult: One result per year, in the order of `years`
+        """
+        def fetch_one(year: int) -> DownloadResult:
+            try:
+                return self.fetch_price_data(year, version)
+            except Exception as e:
+                return DownloadResult(year=year, error=e)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for year in years:
+                pending.append(executor.submit(fetch_one, year))
+                if len(pending) > self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def download_years(self, years: Iterable[int], output_template: str, version: Optional[str] = None) -> List[DownloadResult]:
+        """
+        Downloads price data for several years concurrently.
+
+        At most `max_workers` requests are in flight at any time. A failure
+        of one year does not abort the others.
+
+        Args:
+            years: The years for which to download data
+            output_template: Output path, `{year}` is replaced by the year
+            version: The version code for the ČSÚ API (defaults to the one of the dataset)
+
+        Returns:
+            List[DownloadResult]: One result per year, in the order of `years`
+        """
+        years = list(years)
+
+        def download_one(year: int) -> DownloadResult:
+            output_path = Path(output_template.format(year=year))
+            try:
+                return self.download_price_data(year, output_path, version)
+            except Exception as e:
+                return DownloadResult(year=year, output_path=output_path, error=e)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(download_one, years))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(
         description='Download price data from Czech Statistical Office (ČSÚ)',
@@ -88,16 +542,24 @@ def parse_args() -> argparse.Namespace:
     
     parser.add_argument(
         '-y', '--year',
-        type=int,
+        type=parse_years,
+        nargs='+',
         required=True,
-        help='Year for which to download data (1990-current)'
+        help='Years for which to download data (1990-current), either single years or ranges like 2018-2025'
     )
     
+    parser.add_argument(
+        '-d', '--dataset',
+        choices=list(DATASETS),
+        default=DEFAULT_DATASET.id,
+        help='Table to download, see datasets.py'
+    )
+
     parser.add_argument(
         '-o', '--output',
-        type=Path,
-        required=True,
-        help='Output file path'
+        type=str,
+        help="Output file path, must contain {year} when downloading multiple years. "
+             "Defaults to the file name of the dataset, e.g. eucoicop_{year}.xml.gz"
     )
     
     parser.add_argument(
@@ -110,15 +572,75 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         '--version',
         type=str,
-        default='v10111',
-        help='Version code for the ČSÚ API (default: v10111)'
+        help='Version code for the ČSÚ API, defaults to the one of the dataset'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=4,
+        help='Maximum number of concurrent downloads'
+    )
+
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=3,
+        help='Number of retries of a failed download'
+    )
+
+    parser.add_argument(
+        '--base-url',
+        type=str,
+        default=CSUDownloader.BASE_URL,
+        help='URL of the ČSÚ XML export endpoint'
+    )
+    
+    parser.add_argument(
+        '-c', '--compress',
+        choices=compressed_io.COMPRESSIONS,
+        help='Compression of the output files, guessed from the output suffix (.gz, .zst) by default'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=Path,
+        default=Path(__file__).absolute().parent / '.cache' / 'downloads',
+        help='Directory of the download cache'
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always download everything and do not touch the cache'
+    )
+
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Revalidate closed years instead of serving them from the cache'
+    )
+
+    parser.add_argument(
+        '--prune-cache',
+        action='store_true',
+        help='Before downloading, delete the cached bodies no entry refers to. '
+             'Skipped while another process is using the cache'
     )
     
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    # Flatten the ranges and drop duplicates while keeping the order
+    args.year = list(dict.fromkeys(year for years in args.year for year in years))
+    args.dataset = DATASETS[args.dataset]
+    if args.output is None:
+        args.output = args.dataset.file_template
+    if len(args.year) > 1 and '{year}' not in args.output:
+        parser.error('--output must contain {year} when downloading multiple years')
+    return args
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """Main function to run the CLI utility."""
-    args = parse_args()
+    args = parse_args(argv)
     
     # Setup logging
     log_level = logging.DEBUG if args.verbose else logging.INFO
@@ -128,13 +650,41 @@ def main():
     )
     
     try:
-        downloader = CSUDownloader()
-        logging.info(f"Downloading price data for year {args.year}")
-        downloader.download_price_data(args.year, args.output, args.version)
+        cache = None if args.no_cache else DownloadCache(args.cache_dir)
+        if cache is not None and args.prune_cache:
+            cache.prune()
+        downloader = CSUDownloader(
+            base_url=args.base_url,
+            max_workers=args.jobs,
+            retries=args.retries,
+            cache=cache,
+            refresh=args.refresh,
+            compression=args.compress,
+            dataset=args.dataset
+        )
+        logging.info(f"Downloading {args.dataset.id} for years {', '.join(map(str, args.year))}")
+        results = downloader.download_years(args.year, args.output, args.version)
 
     except Exception as e:
         logging.error(f"Error: {str(e)}")
         exit(1)
 
+    for result in results:
+        if result.ok:
+            logging.info(f"Year {result.year}: OK, cache {result.cache_status} ({result.output_path})")
+        else:
+            logging.error(f"Year {result.year}: FAILED ({str(result.error)})")
+
+    if not args.no_cache:
+        statuses = Counter(result.cache_status for result in results if result.ok)
+        hits = sum(statuses[status] for status in (
+            DownloadCache.STATUS_HIT, DownloadCache.STATUS_REVALIDATED, DownloadCache.STATUS_UNCHANGED
+        ))
+        summary = ', '.join(f"{count} {status}" for status, count in sorted(statuses.items()))
+        logging.info(f"Cache: {hits} hits, {statuses[DownloadCache.STATUS_MISS]} misses ({summary})")
+
+    if not all(result.ok for result in results):
+        exit(1)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+"""
+Stage-level metrics of a process.py run.
+
+Every stage records wall time, CPU time, the high-water mark of the
+process RSS when it finished and how much the stage raised it. The
+high-water mark covers the whole process, so a stage that stays below the
+peak of an earlier one shows no growth. Where the current RSS is known
+(Linux), its growth during the stage is recorded as well. With tracemalloc
+enabled, it also records the peak of traced Python allocations during the
+stage, which is reset at the start of every stage. The report is written as
+JSON, so that runs can be compared over time.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+
+def max_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    # Only Linux has it at hand, None elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+class PipelineMetrics:
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.stages: Dict[str, dict] = {}
+        self.files: List[dict] = []
+        self.counts: Dict[str, int] = {}
+        self._start = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        max_rss_start = max_rss_mb()
+        rss_start = current_rss_mb()
+        try:
+            yield
+        finally:
+            stage = {
+                "wallSeconds": time.perf_counter() - wall_start,
+                "cpuSeconds": time.process_time() - cpu_start,
+                "maxRssMb": max_rss_mb(),
+                "maxRssGrowthMb": max_rss_mb() - max_rss_start,
+            }
+            rss_end = current_rss_mb()
+            if rss_start is not None and rss_end is not None:
+                stage["rssGrowthMb"] = rss_end - rss_start
+            if self.trace_memory:
+                stage["tracedPeakMb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            self.stages[name] = stage
+
+    def count(self, name: str, value: int):
+        self.counts[name] = value
+
+    def add_file(self, file_metrics: dict):
+        self.files.append(file_metrics)
+
+    def to_dict(self) -> dict:
+        return {
+            "startedAt": self.started_at,
+            "wallSeconds": time.perf_counter() - self._start,
+            "maxRssMb": max_rss_mb(),
+            "stages": self.stages,
+            "counts": self.counts,
+            "files": self.files,
+        }
+
+    def write(self, path: Path):
+        path.write_text(json.dumps(self.to_dict(), indent=2) + "\n")
@@ -0,0 +1,334 @@
+#! /usr/bin/env python3
+"""
+Batch evaluation of personal inflation rates.
+
+Computes the same number as useInflationCalculator on the front end, but for
+many spending profiles and years at once. The generated category x period
+data is loaded once and reduced to the yearly sums of inflationIndex. The
+average monthly spend of every profile in every year is then one matrix
+product of the profile amounts with those sums.
+
+The front-end formula for a profile with amounts a and a year y is
+
+    avg(y) = sum(a[c] * sums[y][c]) / months(y)
+    rate = ((avg(y) / avg(y - 1)) ** (12 / months(y)) - 1) * 100
+
+It is NaN unless y - 1 has all 12 months and y has at least one. A partial
+year is annualized by the exponent. A category missing from the data, or a
+category missing a month, makes the profile's rate NaN.
+
+    ./personal_inflation.py --profiles ../data/userProfiles.ts
+    ./personal_inflation.py --profiles households.csv --years 2020-2025 --format json -o rates.json
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+import process
+from years import parse_years
+
+DEFAULT_RATES_FILE = Path(__file__).absolute().parent.parent / "data" / "inflationRates.ts"
+
+
+@dataclass
+class Profile:
+    id: str
+    # (categoryId, amount) in the order of the profile, ids may repeat
+    categories: List[Tuple[str, float]]
+
+
+@dataclass
+class ProfileMatrix:
+    # Profile x category amounts
+    amounts: np.ndarray
+    # Profile x category, whether the profile lists the category at all. The
+    # calculator only touches the listed categories, so a category missing a
+    # month only spoils the profiles listing it, even with a zero amount.
+    listed: np.ndarray
+
+
+@dataclass
+class YearPeriods:
+    # Per evaluated year, what InflationResult reports besides the rate
+    year: int
+    from_period: str
+    to_period: str
+    is_complete: bool
+    is_last_complete: bool
+
+
+class PersonalInflationEngine:
+
+    def __init__(self, index: dict):
+        # index is inflationIndex, see process.build_inflation_index
+        self.category_positions = {category_id: position for position, category_id in enumerate(index["categories"])}
+        self.years = [summary["year"] for summary in index["years"]]
+        self.last_complete_year = index["lastCompleteYear"]
+        self._months = {summary["year"]: summary["months"] for summary in index["years"]}
+        # Year x category, 0 where a category misses a month of the year, see
+        # missing
+        self.sums = np.array(
+            [[0.0 if value is None else value for value in summary["sums"]] for summary in index["years"]],
+            dtype=np.float64,
+        ).reshape(len(self.years), len(self.category_positions))
+        self.missing = np.array(
+            [[value is None for value in summary["sums"]] for summary in index["years"]],
+            dtype=bool,
+        ).reshape(self.sums.shape)
+        self._year_rows = {year: row for row, year in enumerate(self.years)}
+
+    @staticmethod
+    def from_generated_ts(ts_file: Path, chunks_dir: Optional[Path] = None) -> "PersonalInflationEngine":
+        exports = process.read_generated_ts(ts_file)
+        index = exports.get("inflationIndex")
+        if index is None:
+            # Generated before process.py emitted the index, or in the chunked
+            # format, which keeps the yearly sums in the chunks
+            index = process.build_inflation_index(process.read_serialized_inflation_data(ts_file, chunks_dir))
+        return PersonalInflationEngine(index)
+
+    def profile_matrix(self, profiles: List[Profile]) -> ProfileMatrix:
+        # A profile with an unknown category gets a NaN row, like the reduce
+        # in the calculator
+        amounts = np.zeros((len(profiles), len(self.category_positions)), dtype=np.float64)
+        listed = np.zeros(amounts.shape, dtype=bool)
+        for row, profile in enumerate(profiles):
+            for category_id, amount in profile.categories:
+                position = self.category_positions.get(category_id)
+                if position is None:
+                    amounts[row, :] = np.nan
+                    break
+                amounts[row, position] += amount
+                listed[row, position] = True
+        return ProfileMatrix(amounts=amounts, listed=listed)
+
+    def year_periods(self, years: Iterable[int]) -> List[YearPeriods]:
+        result = []
+        for year in years:
+            if self._is_computable(year):
+                months = self._months[year]
+                result.append(YearPeriods(
+                    year=year,
+                    from_period=f"{year}-{months[0]:02d}",
+                    to_period=f"{year}-{months[-1]:02d}",
+                    is_complete=len(months) == 12,
+                    is_last_complete=year == self.last_complete_year,
+                ))
+            else:
+                result.append(YearPeriods(
+                    year=year,
+                    from_period=f"{year - 1}-12",
+                    to_period=f"{year}-12",
+                    is_complete=False,
+                    is_last_complete=False,
+                ))
+        return result
+
+    def _is_computable(self, year: int) -> bool:
+        previous_months = self._months.get(year - 1)
+        return previous_months is not None and len(previous_months) == 12 and year in self._months
+
+    def compute(self, profiles: ProfileMatrix, years: List[int]) -> np.ndarray:
+        """
+        Computes the personal rates of all the profiles in all the years.
+
+        Args:
+            profiles: Amounts of the profiles, see profile_matrix
+            years: Years to evaluate
+
+        Returns:
+            Profile x year rates in percent, NaN where the calculator shows NaN
+        """
+        computable = [year for year in years if self._is_computable(year)]
+        rates = np.full((profiles.amounts.shape[0], len(years)), np.nan)
+        if not computable:
+            return rates
+
+        rows = np.array([self._year_rows[year] for year in computable])
+        previous_rows = np.array([self._year_rows[year - 1] for year in computable])
+        month_counts = np.array([len(self._months[year]) for year in self.years], dtype=np.float64)
+
+        # Profile x year average monthly spend, for every year of the data
+        average_spend = (profiles.amounts @ self.sums.T) / month_counts[None, :]
+        spoiled = (profiles.listed.astype(np.int64) @ self.missing.T.astype(np.int64)) > 0
+        average_spend[spoiled] = np.nan
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = average_spend[:, rows] / average_spend[:, previous_rows]
+            annualized = np.power(ratios, 12 / month_counts[rows][None, :])
+
+        columns = [position for position, year in enumerate(years) if self._is_computable(year)]
+        rates[:, columns] = (annualized - 1.0) * 100
+        return rates
+
+
+def _parse_amount(value) -> float:
+    return float(value) if value not in ("", None) else 0.0
+
+
+def read_user_profiles_ts(ts_file: Path) -> List[Profile]:
+    # data/userProfiles.ts is hand written TypeScript, not JSON. Every
+    # categoryId/amount pair belongs to the closest preceding profile id.
+    text = ts_file.read_text()
+    token = re.compile(
+        r"""\bid\s*:\s*['"](?P<id>[^'"]+)['"]"""
+        r"""|["']?categoryId["']?\s*:\s*['"](?P<category>[^'"]+)['"]\s*,\s*["']?amount["']?\s*:\s*(?P<amount>[-\d.eE+]+)"""
+    )
+    profiles = []
+    for match in token.finditer(text):
+        if match.group("id") is not None:
+            profiles.append(Profile(id=match.group("id"), categories=[]))
+        elif profiles:
+            profiles[-1].categories.append((match.group("category"), float(match.group("amount"))))
+    return profiles
+
+
+def iter_profiles(path: Path) -> Iterator[Profile]:
+    """
+    Reads spending profiles from one of
+
+    - data/userProfiles.ts (.ts)
+    - a JSON list of {id, categories: [{categoryId, amount}]} profiles, or a
+      single preset as written by process.py -p (.json)
+    - a CSV with an id column and one column of amounts per category id, one
+      row per profile (.csv), read lazily
+    """
+    if path.suffix == ".ts":
+        yield from read_user_profiles_ts(path)
+    elif path.suffix == ".json":
+        data = json.loads(path.read_text())
+        if data and "categoryId" in data[0]:
+            data = [{"id": path.stem, "categories": data}]
+        for profile in data:
+            yield Profile(
+                id=str(profile["id"]),
+                categories=[(category["categoryId"], float(category["amount"])) for category in profile["categories"]],
+            )
+    elif path.suffix == ".csv":
+        with path.open(newline="") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                profile_id = row.pop("id")
+                yield Profile(
+                    id=profile_id,
+                    categories=[(category_id, _parse_amount(amount)) for category_id, amount in row.items()],
+                )
+    else:
+        raise ValueError(f"Unsupported profile file {path}, expected .ts, .json or .csv")
+
+
+def _chunks(profiles: Iterable[Profile], size: int) -> Iterator[List[Profile]]:
+    chunk = []
+    for profile in profiles:
+        chunk.append(profile)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+FIELDS = ["profileId", "year", "personalRate", "from", "to", "isComplete", "isLastComplete"]
+
+
+def _rows(profiles: List[Profile], periods: List[YearPeriods], rates: np.ndarray) -> Iterator[tuple]:
+    # Rows in the order of FIELDS, None for NaN rates
+    for profile, profile_rates in zip(profiles, rates.tolist()):
+        for year_periods, rate in zip(periods, profile_rates):
+            yield (
+                profile.id,
+                year_periods.year,
+                None if rate != rate else rate,
+                year_periods.from_period,
+                year_periods.to_period,
+                year_periods.is_complete,
+                year_periods.is_last_complete,
+            )
+
+
+def evaluate(engine: PersonalInflationEngine, profiles: Iterable[Profile], years: List[int], output: TextIO,
+             output_format: str = "csv", chunk_size: int = 4096) -> int:
+    # Streams the results of the profiles in chunks, so that the memory does
+    # not grow with the number of profiles. Returns the number of profiles.
+    periods = engine.year_periods(years)
+    count = 0
+    first = True
+    if output_format == "csv":
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(FIELDS)
+    else:
+        output.write("[")
+
+    for chunk in _chunks(profiles, chunk_size):
+        rates = engine.compute(engine.profile_matrix(chunk), years)
+        rows = _rows(chunk, periods, rates)
+        if output_format == "csv":
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                output.write("\n" if first else ",\n")
+                json.dump(dict(zip(FIELDS, row)), output, ensure_ascii=False)
+                first = False
+        count += len(chunk)
+
+    if output_format == "json":
+        output.write("\n]\n")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute personal inflation rates of many spending profiles.")
+    parser.add_argument(
+        "--profiles",
+        type=Path,
+        nargs="+",
+        required=True,
+        help="Profile files, .ts (data/userProfiles.ts), .json or .csv (id column plus a column per category)",
+    )
+    parser.add_argument(
+        "-r", "--rates-file",
+        type=Path,
+        default=DEFAULT_RATES_FILE,
+        help="Generated rates in either output format of process.py",
+    )
+    parser.add_argument(
+        "--chunks-dir",
+        type=Path,
+        help="Directory with the year chunks, when the rates file is in the chunked format",
+        default=Path(__file__).absolute().parent.parent / "public" / "data" / "rates",
+    )
+    parser.add_argument(
+        "-y", "--years",
+        type=parse_years,
+        nargs="+",
+        help="Years to evaluate, single years or ranges like 2018-2025. Defaults to all the years with data",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Output file, standard output if omitted")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="Number of profiles evaluated in one pass")
+    args = parser.parse_args()
+
+    engine = PersonalInflationEngine.from_generated_ts(args.rates_file, args.chunks_dir)
+    years = list(dict.fromkeys(year for years in args.years for year in years)) if args.years else engine.years
+    profiles = (profile for path in args.profiles for profile in iter_profiles(path))
+
+    output: Optional[TextIO] = None
+    try:
+        output = args.output.open("w", newline="") if args.output is not None else sys.stdout
+        count = evaluate(engine, profiles, years, output, args.format, args.chunk_size)
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+    print(f"Evaluated {count} profiles in {len(years)} years", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+#! /usr/bin/env python3
+"""
+Single entry point of the data pipeline.
+
+    ./pipeline.py fetch -y 2018-2025 -o 'eucoicop_{year}.xml.gz'   # fetch.py
+    ./pipeline.py process eucoicop_*.xml.gz                          # process.py
+    ./pipeline.py run -y 2018-2025 --output-format chunked
+    ./pipeline.py watch --output-format chunked
+
+fetch and process take the arguments of fetch.py and process.py. run
+downloads the exports and hands the bytes straight to the parser, so a full
+refresh is a single process that writes no intermediate files. The bodies
+are written to the download cache in the same pass, only the cache hits are
+read back from it, and --no-download-cache skips the cache altogether. Only
+a few exports are in memory at a time. Its own options select what to
+download, all the other arguments go to process.py. The exit code is that
+of process.py, 3 when the outputs are up to date.
+
+watch is a long running run. It polls only the export of the year of the
+next expected month, often once that month is due and rarely before, and
+backs off exponentially after failures. Until its January is published, the
+export of a new year does not exist, which is not counted as a failure. The
+exports are processed only when their time dictionary lists a month that
+was not seen before. The months seen and the times of the last check and of
+the last change are kept in .cache/watch.json. As it processes only the
+polled year, the observations of the others are kept in the --store of
+process.py, by default .cache/observations.sqlite. With --incremental,
+process.py only recomputes the months the polled export added or revised.
+
+The modules are only imported by the subcommands that need them, so e.g.
+regenerating the outputs from the store loads neither requests nor lxml.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from datasets import DATASETS, DEFAULT_DATASET
+from years import parse_years
+
+# The first year of the exports doit.sh has always processed
+START_YEAR = 2018
+
+# ČSÚ publishes the index of a month around the 10th of the next one. From
+# WATCH_PUBLICATION_DAY on, watch polls every WATCH_INTERVAL seconds until
+# the month shows up, before that only every WATCH_IDLE_INTERVAL seconds in
+# case it comes early
+WATCH_INTERVAL = 10 * 60
+WATCH_IDLE_INTERVAL = 6 * 60 * 60
+WATCH_PUBLICATION_DAY = 8
+# Every delay is randomized by this fraction, so that the requests do not
+# line up with anyone else's schedule
+WATCH_JITTER = 0.1
+DEFAULT_WATCH_STATUS = Path(__file__).absolute().parent / ".cache" / "watch.json"
+DEFAULT_WATCH_STORE = Path(__file__).absolute().parent / ".cache" / "observations.sqlite"
+
+
+def run_fetch(argv: List[str]):
+    import fetch
+
+    fetch.main(argv)
+
+
+def run_process(argv: List[str]):
+    import process
+
+    process.main(argv)
+
+
+class DownloadFailed(Exception):
+    pass
+
+
+def _iter_streams(results, dataset) -> Iterator[Tuple[str, io.BytesIO]]:
+    # Named like the files fetch.py would write, which is what the store
+    # records as the source. Every export is dropped once it was parsed, so
+    # with CSUDownloader.iter_fetch_years only a few are in memory at a time.
+    for result in results:
+        if not result.ok:
+            raise DownloadFailed(f"Year {result.year}: FAILED ({str(result.error)})") from result.error
+        content, result.content = result.content, None
+        yield dataset.file_template.format(year=result.year), io.BytesIO(content)
+
+
+def _add_download_arguments(parser: argparse.ArgumentParser):
+    # The options of run and watch that configure the downloader
+    parser.add_argument("-d", "--dataset", choices=list(DATASETS), default=DEFAULT_DATASET.id)
+    parser.add_argument("--version", help="Version code for the ČSÚ API, defaults to the one of the dataset")
+    parser.add_argument("--fetch-jobs", type=int, default=4, help="Maximum number of concurrent downloads")
+    parser.add_argument("--retries", type=int, default=3, help="Number of retries of a failed download")
+    parser.add_argument("--base-url", help="URL of the ČSÚ XML export endpoint")
+    parser.add_argument(
+        "--download-cache-dir",
+        type=Path,
+        default=Path(__file__).absolute().parent / ".cache" / "downloads",
+        help="Directory of the download cache",
+    )
+    parser.add_argument("--no-download-cache", action="store_true", help="Download everything, bypassing the cache")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate closed years instead of trusting the cache")
+    parser.add_argument(
+        "--prune-download-cache",
+        action="store_true",
+        help="Before downloading, delete the cached bodies no entry refers to, unless another process uses the cache",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging of the downloads")
+
+
+def _make_downloader(args: argparse.Namespace, dataset):
+    import fetch
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    cache = None if args.no_download_cache else fetch.DownloadCache(args.download_cache_dir)
+    if cache is not None and args.prune_download_cache:
+        cache.prune()
+    return fetch.CSUDownloader(
+        base_url=args.base_url or fetch.CSUDownloader.BASE_URL,
+        max_workers=args.fetch_jobs,
+        retries=args.retries,
+        cache=cache,
+        refresh=args.refresh,
+        dataset=dataset,
+    )
+
+
+def run(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="pipeline.py run",
+        description="Download the exports and process them in memory. "
+                    "Arguments not listed here are passed to process.py.",
+        # Do not let an abbreviation swallow an option of process.py
+        allow_abbrev=False,
+    )
+    parser.add_argument(
+        "-y", "--year",
+        nargs="+",
+        default=[f"{START_YEAR}-{datetime.now().year}"],
+        help="Years to download, single years or ranges like 2018-2025. Defaults to 2018 up to the current year",
+    )
+    _add_download_arguments(parser)
+    args, process_argv = parser.parse_known_args(argv)
+
+    import fetch
+    import process
+
+    try:
+        years = list(dict.fromkeys(year for value in args.year for year in parse_years(value)))
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    dataset = DATASETS[args.dataset]
+
+    downloader = _make_downloader(args, dataset)
+    logging.info(f"Downloading {dataset.id} for years {', '.join(map(str, years))}")
+    # Every year is parsed and stored as soon as it arrives. A failed year
+    # aborts the run before any output is written, the years stored until
+    # then are simply upserted again by the next run.
+    results = downloader.iter_fetch_years(years, args.version)
+    try:
+        process.main(process_argv + ["--dataset", dataset.id], input_streams=_iter_streams(results, dataset))
+    except DownloadFailed as e:
+        logging.error(str(e))
+        sys.exit(1)
+
+
+@dataclass
+class WatchStatus:
+    dataset: str
+    # Every month seen in the polled exports, as "YYYY-MM"
+    periods: List[str] = field(default_factory=list)
+    # UTC timestamps in the ISO format
+    last_check: Optional[str] = None
+    last_change: Optional[str] = None
+    next_check: Optional[str] = None
+    last_error: Optional[str] = None
+    # Number of failed checks in a row, drives the backoff
+    failures: int = 0
+
+    @staticmethod
+    def load(path: Path, dataset: str) -> "WatchStatus":
+        # The snapshot of another dataset is of no use, start over
+        data = json.loads(path.read_text()) if path.exists() else {}
+        if data.get("dataset") != dataset:
+            return WatchStatus(dataset=dataset)
+        return WatchStatus(
+            dataset=dataset,
+            periods=data["periods"],
+            last_check=data["lastCheck"],
+            last_change=data["lastChange"],
+            next_check=data["nextCheck"],
+            last_error=data["lastError"],
+            failures=data["failures"],
+        )
+
+    def write(self, path: Path):
+        import fetch
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with fetch.replace_atomically(path) as tmp_path:
+            tmp_path.write_text(json.dumps({
+                "dataset": self.dataset,
+                "lastCheck": self.last_check,
+                "lastChange": self.last_change,
+                "nextCheck": self.next_check,
+                "lastError": self.last_error,
+                "failures": self.failures,
+                "latestPeriod": self.periods[-1] if self.periods else None,
+                "periods": self.periods,
+            }, indent=2) + "\n")
+
+
+def _next_month(year: int, month: int) -> Tuple[int, int]:
+    return (year, month + 1) if month < 12 else (year + 1, 1)
+
+
+def expected_month(periods: List[str], now: datetime) -> Tuple[int, int]:
+    # The month after the latest one seen, before anything was seen the
+    # previous calendar month, as that is the latest one ČSÚ can have published
+    if not periods:
+        return (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+    year, month = map(int, periods[-1].split("-"))
+    return _next_month(year, month)
+
+
+def next_check_delay(status: WatchStatus, now: datetime, args: argparse.Namespace) -> float:
+    # Seconds until the next check, with exponential backoff after failures
+    if status.failures:
+        delay = min(args.interval * 2 ** status.failures, args.idle_interval)
+    else:
+        # The expected month gets published in the month after it
+        year, month = _next_month(*expected_month(status.periods, now))
+        due = datetime(year, month, args.publication_day)
+        delay = args.interval if now >= due else min((due - now).total_seconds(), args.idle_interval)
+    return delay * random.uniform(1 - args.jitter, 1 + args.jitter)
+
+
+def check_for_new_data(downloader, status: WatchStatus, args: argparse.Namespace, process_argv: List[str]) -> bool:
+    # Polls the export of the year of the expected month and processes it if
+    # it has a month that was not seen before. Returns whether it did. The
+    # first check downloads all the years, so that the store is complete.
+    import process
+    import requests
+
+    dataset = downloader.dataset
+    now = datetime.now()
+    year = min(expected_month(status.periods, now)[0], now.year)
+    try:
+        polled = downloader.fetch_price_data(year, args.version)
+    except requests.HTTPError as e:
+        # Once December was seen, the export of the next year does not exist
+        # until its January gets published, which is no failure
+        new_year = bool(status.periods) and year > int(status.periods[-1][:4])
+        if new_year and e.response is not None and e.response.status_code == 404:
+            logging.info(f"No export of {year} yet")
+            return False
+        raise
+    name = dataset.file_template.format(year=polled.year)
+    periods = {
+        f"{period.year}-{period.month:02d}"
+        for period in process.read_export_periods(io.BytesIO(polled.content), source=name)
+    }
+    new_periods = sorted(periods.difference(status.periods))
+    if status.periods and not new_periods:
+        logging.info(f"No new month in {name}, cache {polled.cache_status}")
+        return False
+
+    logging.info(f"New months in {name}: {', '.join(new_periods) or 'none'}, processing")
+    results = [polled]
+    if not status.periods:
+        results = itertools.chain(downloader.iter_fetch_years(range(START_YEAR, year), args.version), results)
+    try:
+        process.main(process_argv + ["--dataset", dataset.id], input_streams=_iter_streams(results, dataset))
+    except SystemExit as e:
+        # Up to date outputs are no failure, a usage error is fatal
+        if e.code not in (None, 0, process.EXIT_UNCHANGED):
+            raise
+    # Only now, so that a failed processing is retried on the next check
+    status.periods = sorted(periods.union(status.periods))
+    return True
+
+
+def watch(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="pipeline.py watch",
+        description="Poll the export of the current year and process it whenever a new month appears. "
+                    "Arguments not listed here are passed to process.py.",
+        allow_abbrev=False,
+    )
+    _add_download_arguments(parser)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help="Seconds between the checks once a new month is due, also the base delay of the backoff",
+    )
+    parser.add_argument(
+        "--idle-interval",
+        type=float,
+        default=WATCH_IDLE_INTERVAL,
+        help="Longest delay between the checks, while no new month is due and after failures",
+    )
+    parser.add_argument(
+        "--publication-day",
+        type=int,
+        choices=range(1, 29),
+        default=WATCH_PUBLICATION_DAY,
+        metavar="DAY",
+        help="Day of the month from which the previous month is polled for every --interval seconds",
+    )
+    parser.add_argument("--jitter", type=float, default=WATCH_JITTER, help="Fraction by which every delay is randomized")
+    parser.add_argument(
+        "--status-file",
+        type=Path,
+        default=DEFAULT_WATCH_STATUS,
+        help="JSON file with the months seen so far and the time of the last check and of the last change",
+    )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=DEFAULT_WATCH_STORE,
+        help="SQLite store of process.py, which keeps the observations of the years that are no longer polled",
+    )
+    parser.add_argument("--once", action="store_true", help="Check once and exit, with 1 if the check failed")
+    args, process_argv = parser.parse_known_args(argv)
+    process_argv += ["--store", str(args.store)]
+
+    dataset = DATASETS[args.dataset]
+    downloader = _make_downloader(args, dataset)
+    status = WatchStatus.load(args.status_file, dataset.id)
+    try:
+        while True:
+            status.last_check = datetime.now(timezone.utc).isoformat()
+            try:
+                if check_for_new_data(downloader, status, args, process_argv):
+                    status.last_change = status.last_check
+                status.failures = 0
+                status.last_error = None
+            except Exception as e:
+                status.failures += 1
+                status.last_error = str(e)
+                logging.error(f"Check failed ({str(e)}), {status.failures} in a row")
+
+            if args.once:
+                status.next_check = None
+                status.write(args.status_file)
+                sys.exit(1 if status.failures else 0)
+
+            delay = next_check_delay(status, datetime.now(), args)
+            status.next_check = (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat()
+            status.write(args.status_file)
+            logging.info(f"Next check in {timedelta(seconds=round(delay))}")
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        logging.info("Stopped")
+
+
+COMMANDS = {
+    "fetch": run_fetch,
+    "process": run_process,
+    "run": run,
+    "watch": watch,
+}
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print(f"usage: pipeline.py {{{','.join(COMMANDS)}}} [arguments]", file=sys.stderr)
+        print("Run pipeline.py COMMAND --help for the arguments of a command", file=sys.stderr)
+        sys.exit(2)
+    COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    main()
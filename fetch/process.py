@@ -1,15 +1,43 @@
 #! /usr/bin/env python3
 
 import argparse
+import array
+import bisect
 import collections
+import cProfile
 import csv
+import functools
+import hashlib
 import json
-
-from dataclasses import dataclass, field
-from datetime import datetime, timedelta, timezone
-from typing import List, Mapping
+import os
+import pickle
+import re
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, timezone
+from typing import BinaryIO, Collection, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
 from pathlib import Path
-from lxml import etree
+
+import compressed_io
+from datasets import DATASETS, DEFAULT_DATASET, Dataset
+from ecoicop import EcoicopIndex
+from metrics import PipelineMetrics
+from store import ObservationStore, UpsertStats
+
+
+class DataValidationError(ValueError):
+    # The data breaks our assumptions about the exports. Unlike asserts, the
+    # checks raising this also run under python -O.
+
+    def __init__(self, message: str, source: Optional[str] = None, time_id: Optional[str] = None):
+        super().__init__(f"{source}: {message}" if source is not None else message)
+        self.message = message
+        # File or store the data comes from, and the ID of the offending time
+        self.source = source
+        self.time_id = time_id
 
 
 # These classes mirror the CSV structure
@@ -26,11 +54,11 @@ class Element:
     @staticmethod
     def parse(elem):
         return Element(
-            dim=elem.findtext("dim"),
-            dimText=elem.findtext("dimText"),
-            ciselnik=elem.findtext("ciselnik"),
-            kod=elem.findtext("kod"),
-            text=elem.findtext("text")
+            dim=elem.findtext("{*}dim"),
+            dimText=elem.findtext("{*}dimText"),
+            ciselnik=elem.findtext("{*}ciselnik"),
+            kod=elem.findtext("{*}kod"),
+            text=elem.findtext("{*}text")
         )
 
 
@@ -40,11 +68,15 @@ class Time:
     casDo: datetime.date
     bazOd: datetime.date
     bazDo: datetime.date
+    # Precomputed by validate_time, so that the entries only look them up.
+    # period is the calendar month of a monthly time.
+    monthly: bool = field(default=False, compare=False)
+    period: Optional["TimePeriod"] = field(default=None, compare=False)
 
     @staticmethod
     def parse(elem):
         def parse_key(name):
-            return datetime.strptime(elem.findtext(name), "%Y-%m-%d").date()
+            return datetime.strptime(elem.findtext("{*}" + name), "%Y-%m-%d").date()
 
         return Time(
             casOd=parse_key("casOd"),
@@ -59,6 +91,8 @@ class Entry:
     value: float
     time: Time
     element: Element
+    # Code of the region, empty for the national data
+    region: str = ""
 
 
 # These classes should mirror the definitions used in the app
@@ -73,6 +107,18 @@ class TimePeriod:
         if not 1 <= self.month <= 12:
             raise ValueError(f"Month must be between 1 and 12, got {self.month}")
 
+    @staticmethod
+    def from_string(period: str) -> "TimePeriod":
+        # "YYYY-MM", the format of the serialized rates
+        match = re.fullmatch(r"(\d{4})-(\d{2})", period)
+        if match is None:
+            raise ValueError(f"Expected a YYYY-MM period, got {period!r}")
+        return TimePeriod(year=int(match.group(1)), month=int(match.group(2)))
+
+    def ordinal(self) -> int:
+        # Number of months since year 0, consecutive periods differ by 1
+        return self.year * 12 + self.month - 1
+
 
 @dataclass
 class CategoryDefinition:
@@ -206,88 +252,188 @@ CATEGORIES = [
 ]
 
 
-def load_xml(input_file: Path):
-    input_string = input_file.read_text()
-    # Remove xmlns
-    input_string = input_string.replace('xmlns="http://vdb.czso.cz/xml/export"', '')
-    tree = etree.fromstring(input_string.encode())
-    return tree
+# The exports live in the http://vdb.czso.cz/xml/export namespace. All the
+# lookups below use the {*} wildcard, so that they work with and without it.
 
 
-def extract_elements(root):
+def extract_elements(meta_slovnik, dataset: Dataset = DEFAULT_DATASET) -> Tuple[Dict[str, Element], Dict[str, str]]:
+    # The ECOICOP elements and the region codes by their ID, the elements of
+    # the other dimensions are not needed
     elements = {}
-    for elem in root.iterfind('.//metaSlovnik/vecneUpresneni/element'):
+    regions = {}
+    for elem in meta_slovnik.iterfind('{*}vecneUpresneni/{*}element'):
         element = Element.parse(elem)
-        if element.dim != "ECOICOP":
-            continue
-        elements[elem.get("ID")] = element
-    return elements
-
-
-def extract_times(root):
+        if element.dim == dataset.code_dimension:
+            elements[elem.get("ID")] = element
+        elif dataset.region_dimension is not None and element.dim == dataset.region_dimension:
+            regions[elem.get("ID")] = "" if element.kod == dataset.national_region else element.kod
+    return elements, regions
+
+
+def validate_time(time: Time, source: Optional[str] = None, time_id: Optional[str] = None) -> Time:
+    # Runs once per distinct time, not per entry. Times spanning more than
+    # 40 days are aggregates such as the yearly averages, which we skip,
+    # anything shorter has to be a calendar month.
+    if (time.casDo - time.casOd).days > 40:
+        return replace(time, monthly=False, period=None)
+
+    if time.casOd.day != 1:
+        raise DataValidationError(f"Expected first day of month, got {time.casOd}", source, time_id)
+    if time.casDo.day not in (28, 29, 30, 31):
+        raise DataValidationError(f"Expected last day of month, got {time.casDo}", source, time_id)
+    if (time.casOd.year, time.casOd.month) != (time.casDo.year, time.casDo.month):
+        raise DataValidationError(f"Expected the same month, got {time.casOd} and {time.casDo}", source, time_id)
+    return replace(time, monthly=True, period=TimePeriod(year=time.casOd.year, month=time.casOd.month))
+
+
+def extract_times(meta_slovnik, source: Optional[str] = None):
     times = {}
-    for elem in root.iterfind('.//metaSlovnik/obdobi/cas'):
-        time = Time.parse(elem)
-        times[elem.get("ID")] = time
+    for elem in meta_slovnik.iterfind('{*}obdobi/{*}cas'):
+        time_id = elem.get("ID")
+        times[time_id] = validate_time(Time.parse(elem), source, time_id)
     return times
 
 
-def parse_xml(input_file: Path, output_file: Path):
-    root = load_xml(input_file)
-
-    elements = extract_elements(root)
-    times = extract_times(root)
-
-    # And now for the final trick. Extract the data itself
-
+def _free_element(elem):
+    # Drop the already processed nodes, otherwise iterparse would still
+    # build the whole tree in memory
+    elem.clear(keep_tail=False)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def iter_entries(input_file: Union[Path, BinaryIO], stats: Optional[dict] = None,
+                 dataset: Dataset = DEFAULT_DATASET, source: Optional[str] = None) -> Iterator[Entry]:
+    # Streams the entries out of the export, a file or an in-memory stream
+    # named by source. The metaSlovnik dictionary precedes the data, so by
+    # the time we see the first udaj, we already know all the elements and
+    # times.
+    # If stats is given, it receives the wall time spent in lxml, in the
+    # dictionary extraction and in the entry extraction, and the record counts.
+    # Imported here, so that the runs without any input do not load lxml
+    from lxml import etree
+
+    source = source or str(input_file)
+    elements = None
+    regions = None
+    times = None
+    clock = time.perf_counter
+    xml_seconds = 0.0
+    dictionary_seconds = 0.0
+    entry_seconds = 0.0
+    udaj_count = 0
+
+    # The input can be compressed, see compressed_io
+    with compressed_io.open_input(input_file) as f:
+        parser = etree.iterparse(f, events=("end",), tag=("{*}metaSlovnik", "{*}udaj"))
+        while True:
+            start = clock()
+            elem = next(parser, None)
+            now = clock()
+            xml_seconds += now - start
+            if elem is None:
+                break
+            _, elem = elem
+
+            if etree.QName(elem).localname == "metaSlovnik":
+                elements, regions = extract_elements(elem, dataset)
+                times = extract_times(elem, source)
+                _free_element(elem)
+                dictionary_seconds += clock() - now
+                continue
+
+            udaj_count += 1
+            entry = _parse_udaj(source, elem, elements, regions, times)
+            _free_element(elem)
+            entry_seconds += clock() - now
+            if entry is not None:
+                yield entry
+
+    if stats is not None:
+        stats["xmlLoadSeconds"] = xml_seconds
+        stats["elementTimeExtractionSeconds"] = dictionary_seconds
+        stats["entryExtractionSeconds"] = entry_seconds
+        stats["udaj"] = udaj_count
+        stats["elements"] = len(elements or {})
+        stats["regions"] = len(regions or {})
+        stats["times"] = len(times or {})
+
+
+def _parse_udaj(source: str, elem, elements, regions, times) -> Optional[Entry]:
+    if elements is None:
+        raise ValueError(f"{source}: data found before metaSlovnik")
+
+    time = times[elem.findtext("{*}cas")]
+    # We only care about the monthly entries
+    if not time.monthly:
+        return None
+    value = float(elem.findtext("{*}hod"))
+
+    # TODO: Ideally, we would just look for the n-thn <vec> element
+    # The first matching <vec> wins, for the element and the region alike
+    element = None
+    region = None
+    for vec in elem.iterfind("{*}vec"):
+        if element is None and vec.text in elements:
+            element = elements[vec.text]
+        elif region is None and vec.text in regions:
+            region = regions[vec.text]
+        if element is not None and (region is not None or not regions):
+            break
+    if element is None:
+        return None
+    return Entry(value=value, time=time, element=element, region=region or "")
+
+
+def parse_xml(input_file: Union[Path, BinaryIO], stats: Optional[dict] = None,
+              dataset: Dataset = DEFAULT_DATASET, source: Optional[str] = None):
     entries = collections.defaultdict(list)
+    for entry in iter_entries(input_file, stats, dataset, source):
+        entries[entry.element].append(entry)
+    return entries
 
-    for udaj in root.iterfind('.//data/udaj'):
-        value = float(udaj.findtext("hod"))
-        time = times[udaj.findtext("cas")]
-
-        # We only care about the monthly entries
-        if time.casDo - time.casOd > timedelta(days=40):
-            continue
 
-        # TODO: Ideally, we would just look for the n-thn <vec> element
-        element = next(
-            (elements[vec.text] for vec in udaj.iterfind("vec") if vec.text in elements), None
-        )
-        if element is None:
-            continue
-        entry = Entry(value=value, time=time, element=element)
-        entries[element].append(entry)
+def read_export_periods(input_file: Union[Path, BinaryIO], source: Optional[str] = None) -> Set["TimePeriod"]:
+    # The months in the time dictionary of the export. The dictionary
+    # precedes the data, so the data themselves are not parsed at all,
+    # which keeps polling for new months cheap, see pipeline.py watch.
+    from lxml import etree
 
-    return entries
+    source = source or str(input_file)
+    with compressed_io.open_input(input_file) as f:
+        for _, elem in etree.iterparse(f, events=("end",), tag="{*}metaSlovnik"):
+            return {time.period for time in extract_times(elem, source).values() if time.monthly}
+    raise DataValidationError("No metaSlovnik found", source)
 
 
 def check_all_categories_covered(entries: Mapping[Element, List[Entry]]):
     # In this function, we verify that all ECOICOP numbers are covered
     # by the categories we have defined. This is somewhat non-trivial
     # due to the tree structure of the ECOICOP numbers.
-    are_covered = {
-        entry.element.kod: False
+    index = EcoicopIndex(
+        entry.element.kod
         for entry_list in entries.values()
         for entry in entry_list
-    }
+    )
+    are_covered = {key: False for key in index}
 
     for category in CATEGORIES:
         for ecoicop_number in category.ecoicop_numbers:
-            assert ecoicop_number in are_covered, f"ECOICOP number {ecoicop_number} not found in the data"
-            for key in are_covered:
-                if key.startswith(ecoicop_number):
-                    assert not are_covered[key], f"ECOICOP number {key} is covered by multiple categories"
-                    are_covered[key] = True
-
+            if ecoicop_number not in index:
+                raise DataValidationError(f"ECOICOP number {ecoicop_number} not found in the data")
+            for key in index.subtree(ecoicop_number):
+                if are_covered[key]:
+                    raise DataValidationError(f"ECOICOP number {key} is covered by multiple categories")
+                are_covered[key] = True
+
+    @functools.lru_cache(maxsize=None)
     def is_covered(ecoicop_number):
         if are_covered[ecoicop_number]:
             return True
         # Check if all children are covered
-        children_numbers = [
-            key for key in are_covered.keys()
-            if key.startswith(ecoicop_number) and key != ecoicop_number
-        ]
+        children_numbers = index.children(ecoicop_number)
         # Beware of leaf categories
         if children_numbers and all(is_covered(key) for key in children_numbers):
             return True
@@ -295,11 +441,465 @@ def check_all_categories_covered(entries: Mapping[Element, List[Entry]]):
 
     for key in are_covered.keys():
         if not is_covered(key):
-            assert False, f"ECOICOP number {key} is not covered (either fully or partially) by any category"
+            raise DataValidationError(f"ECOICOP number {key} is not covered (either fully or partially) by any category")
 
     return True
 
 
+def _check_file_coverage(entries: Mapping[Element, List[Entry]], source: str):
+    # check_all_categories_covered, with the errors naming the export
+    try:
+        check_all_categories_covered(entries)
+    except DataValidationError as error:
+        raise DataValidationError(error.message, source) from error
+
+
+@dataclass
+class ParsedFile:
+    # Compact form of the entries parsed from a single file. Unlike a dict of
+    # Entry objects, this pickles cheaply, so it can be sent back from the
+    # worker processes.
+    elements: List[Element]
+    times: List[Time]
+    regions: List[str]
+    # One item per entry, the first three index into elements, times and regions
+    element_indices: array.array
+    time_indices: array.array
+    region_indices: array.array
+    values: array.array
+    # Metrics of the parsing, see load_input_file
+    stats: dict = field(default_factory=dict)
+
+    @staticmethod
+    def from_entries(entries: Mapping[Element, List[Entry]]) -> "ParsedFile":
+        element_index = {}
+        time_index = {}
+        region_index = {}
+        parsed = ParsedFile(
+            elements=[],
+            times=[],
+            regions=[],
+            element_indices=array.array("I"),
+            time_indices=array.array("I"),
+            region_indices=array.array("I"),
+            values=array.array("d")
+        )
+        for element, element_entries in entries.items():
+            for entry in element_entries:
+                if entry.element not in element_index:
+                    element_index[entry.element] = len(parsed.elements)
+                    parsed.elements.append(entry.element)
+                if entry.time not in time_index:
+                    time_index[entry.time] = len(parsed.times)
+                    parsed.times.append(entry.time)
+                if entry.region not in region_index:
+                    region_index[entry.region] = len(parsed.regions)
+                    parsed.regions.append(entry.region)
+                parsed.element_indices.append(element_index[entry.element])
+                parsed.time_indices.append(time_index[entry.time])
+                parsed.region_indices.append(region_index[entry.region])
+                parsed.values.append(entry.value)
+        return parsed
+
+    def to_entries(self) -> Dict[Element, List[Entry]]:
+        # Rebuilds the entries in the exact order they were parsed in
+        entries = collections.defaultdict(list)
+        for element_index, time_index, region_index, value in zip(
+            self.element_indices, self.time_indices, self.region_indices, self.values
+        ):
+            element = self.elements[element_index]
+            entries[element].append(
+                Entry(value=value, time=self.times[time_index], element=element, region=self.regions[region_index])
+            )
+        return entries
+
+    def to_state(self) -> tuple:
+        # Only built-in types, the cache must not refer to the classes of
+        # this module, which is __main__ when run as a script, but not when
+        # imported by pipeline.py
+        return (
+            [(element.dim, element.dimText, element.ciselnik, element.kod, element.text) for element in self.elements],
+            [(time.casOd, time.casDo, time.bazOd, time.bazDo) for time in self.times],
+            self.regions,
+            self.element_indices,
+            self.time_indices,
+            self.region_indices,
+            self.values,
+        )
+
+    @staticmethod
+    def from_state(state: tuple, source: Optional[str] = None) -> "ParsedFile":
+        elements, times, regions, element_indices, time_indices, region_indices, values = state
+        return ParsedFile(
+            elements=[
+                Element(dim=dim, dimText=dim_text, ciselnik=ciselnik, kod=kod, text=text)
+                for dim, dim_text, ciselnik, kod, text in elements
+            ],
+            times=[
+                validate_time(Time(casOd=cas_od, casDo=cas_do, bazOd=baz_od, bazDo=baz_do), source)
+                for cas_od, cas_do, baz_od, baz_do in times
+            ],
+            regions=regions,
+            element_indices=element_indices,
+            time_indices=time_indices,
+            region_indices=region_indices,
+            values=values,
+        )
+
+
+# Bump this whenever a change to the parsing changes the parsed entries, so
+# that the stale cache entries get thrown away
+PARSER_VERSION = 7
+
+
+@dataclass
+class ParsedFileCache:
+    # Cache of ParsedFile, pickled as ParsedFile.to_state, keyed by the dataset and the hash of the input
+    # file contents. The entries are only valid for the same parser version
+    # and category definitions (the files are validated against them before
+    # caching).
+    cache_dir: Path
+    # Least recently used entries above this count get evicted
+    max_entries: int = 64
+    dataset: Dataset = DEFAULT_DATASET
+
+    def __post_init__(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _version_prefix() -> str:
+        categories = json.dumps([category.ecoicop_numbers for category in CATEGORIES])
+        categories_hash = hashlib.sha256(categories.encode()).hexdigest()[:12]
+        return f"v{PARSER_VERSION}-{categories_hash}-"
+
+    def _path(self, input_file: Path) -> Path:
+        digest = hashlib.sha256()
+        with input_file.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return self.cache_dir / f"{self._version_prefix()}{self.dataset.id}-{digest.hexdigest()}.pickle"
+
+    def load(self, input_file: Path) -> Optional[ParsedFile]:
+        path = self._path(input_file)
+        try:
+            with path.open("rb") as f:
+                parsed = ParsedFile.from_state(pickle.load(f), str(input_file))
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+            # Unreadable, or written in another format, a miss either way
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return parsed
+
+    def store(self, input_file: Path, parsed: ParsedFile):
+        path = self._path(input_file)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(parsed.to_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        # Entries of other parser versions can never be hit again
+        prefix = self._version_prefix()
+        current = []
+        for path in self.cache_dir.glob("*.pickle"):
+            if path.name.startswith(prefix):
+                current.append(path)
+            else:
+                path.unlink()
+        current.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in current[self.max_entries:]:
+            path.unlink()
+
+
+def load_input_file(input_file: Path, cache: Optional[ParsedFileCache] = None,
+                    dataset: Dataset = DEFAULT_DATASET) -> ParsedFile:
+    # Parses and validates a single file, this is what the worker processes run
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    parsed = cache.load(input_file) if cache is not None else None
+    if parsed is not None:
+        # Same keys as a parse, nothing was parsed or checked this time
+        stats = {
+            "cacheHit": True,
+            "cacheLoadSeconds": time.perf_counter() - wall_start,
+            "xmlLoadSeconds": 0.0,
+            "elementTimeExtractionSeconds": 0.0,
+            "entryExtractionSeconds": 0.0,
+            "coverageCheckSeconds": 0.0,
+            # The sizes of the dictionaries of the XML, not known without it
+            "udaj": None,
+            "elements": None,
+            "regions": None,
+            "times": None,
+        }
+    else:
+        stats = {"cacheHit": False}
+        entries = parse_xml(input_file, stats, dataset)
+        coverage_start = time.perf_counter()
+        _check_file_coverage(entries, str(input_file))
+        stats["coverageCheckSeconds"] = time.perf_counter() - coverage_start
+        parsed = ParsedFile.from_entries(entries)
+        if cache is not None:
+            cache.store(input_file, parsed)
+
+    stats["entries"] = len(parsed.values)
+    stats["wallSeconds"] = time.perf_counter() - wall_start
+    stats["cpuSeconds"] = time.process_time() - cpu_start
+    parsed.stats = stats
+    return parsed
+
+
+def iter_input_files(input_files: List[Path], jobs: int = 1, cache: Optional[ParsedFileCache] = None,
+                     metrics: Optional[PipelineMetrics] = None,
+                     dataset: Dataset = DEFAULT_DATASET) -> Iterator[Tuple[Path, Dict[Element, List[Entry]]]]:
+    # The files are independent, so they can be parsed in parallel. The
+    # results are yielded in the order of input_files, so the output does not
+    # depend on the number of jobs.
+    def loaded(input_file: Path, parsed: ParsedFile):
+        print(f"Processed {input_file}")
+        if metrics is not None:
+            metrics.add_file({"path": str(input_file), **parsed.stats})
+        return input_file, parsed.to_entries()
+
+    load = functools.partial(load_input_file, cache=cache, dataset=dataset)
+    if jobs <= 1:
+        for input_file in input_files:
+            yield loaded(input_file, load(input_file))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for input_file, parsed in zip(input_files, executor.map(load, input_files)):
+                yield loaded(input_file, parsed)
+
+    if cache is not None:
+        cache.evict()
+
+
+def load_input_files(input_files: List[Path], jobs: int = 1, cache: Optional[ParsedFileCache] = None,
+                     metrics: Optional[PipelineMetrics] = None,
+                     dataset: Dataset = DEFAULT_DATASET) -> Dict[Element, List[Entry]]:
+    # Concatenates the entries of all the files, overlapping exports end up
+    # duplicated, see store_input_files
+    all_entries = collections.defaultdict(list)
+    for _, entries in iter_input_files(input_files, jobs, cache, metrics, dataset):
+        for key, value in entries.items():
+            all_entries[key].extend(value)
+    return all_entries
+
+
+def store_input_files(store: ObservationStore, input_files: List[Path], jobs: int = 1,
+                      cache: Optional[ParsedFileCache] = None, metrics: Optional[PipelineMetrics] = None,
+                      dataset: Dataset = DEFAULT_DATASET) -> List[UpsertStats]:
+    # Upserts the entries of the files into the store, in the order of
+    # input_files, so the later exports win. Returns the stats of every file.
+    return [
+        _store_entries(store, entries, input_file.name, str(input_file), dataset)
+        for input_file, entries in iter_input_files(input_files, jobs, cache, metrics, dataset)
+    ]
+
+
+def store_input_streams(store: ObservationStore, streams: Iterable[Tuple[str, BinaryIO]],
+                        metrics: Optional[PipelineMetrics] = None,
+                        dataset: Dataset = DEFAULT_DATASET) -> List[UpsertStats]:
+    # Same as store_input_files for (name, stream) exports already in
+    # memory, such as fresh downloads. They are parsed in this process, in
+    # order, without a round trip through a file.
+    result = []
+    for name, stream in streams:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        stats = {"cacheHit": False}
+        entries = parse_xml(stream, stats, dataset, source=name)
+        coverage_start = time.perf_counter()
+        _check_file_coverage(entries, name)
+        stats["coverageCheckSeconds"] = time.perf_counter() - coverage_start
+        stats["entries"] = sum(len(element_entries) for element_entries in entries.values())
+        stats["wallSeconds"] = time.perf_counter() - wall_start
+        stats["cpuSeconds"] = time.process_time() - cpu_start
+        print(f"Processed {name}")
+        if metrics is not None:
+            metrics.add_file({"path": name, **stats})
+        result.append(_store_entries(store, entries, name, name, dataset))
+    return result
+
+
+def _store_entries(store: ObservationStore, entries: Mapping[Element, List[Entry]], source: str, label: str,
+                   dataset: Dataset) -> UpsertStats:
+    stats = store.upsert(entries, source=source, dataset=dataset.id)
+    print(f"Stored {label}: {stats.inserted} new, {stats.revised} revised, {stats.unchanged} unchanged")
+    return stats
+
+
+def load_store_entries(store: ObservationStore, dataset: Dataset = DEFAULT_DATASET,
+                       periods: Optional[Collection[str]] = None) -> Dict[Element, List[Entry]]:
+    # The entries of the national observations of the dataset, one element
+    # per code, only of the periods starting on the given ISO dates if given.
+    # The categories are national, so the regional observations stay in the
+    # store, averaging them in would skew the national rates.
+    elements = {
+        code: Element(dim=dim, dimText=dim_text, ciselnik=ciselnik, kod=code, text=text)
+        for code, dim, dim_text, ciselnik, text in store.elements(dataset.id)
+    }
+
+    @functools.lru_cache(maxsize=None)
+    def parse_time(period_from: str, period_to: str, base_from: str, base_to: str) -> Time:
+        # The same few times repeat for every code, share the instances
+        return validate_time(Time(
+            casOd=date.fromisoformat(period_from),
+            casDo=date.fromisoformat(period_to),
+            bazOd=date.fromisoformat(base_from),
+            bazDo=date.fromisoformat(base_to),
+        ), source="store")
+
+    all_entries = collections.defaultdict(list)
+    for region, code, period_from, period_to, base_from, base_to, value in store.observations(dataset.id, region="", periods=periods):
+        element = elements[code]
+        all_entries[element].append(Entry(
+            value=value,
+            time=parse_time(period_from, period_to, base_from, base_to),
+            element=element,
+            region=region,
+        ))
+    return all_entries
+
+
+@dataclass(frozen=True, order=True)
+class BasePeriod:
+    # The period whose average is 100 in an index, bazOd and bazDo of a Time
+    start: date
+    end: date
+
+    @staticmethod
+    def of(time: Time) -> "BasePeriod":
+        return BasePeriod(start=time.bazOd, end=time.bazDo)
+
+    @staticmethod
+    def from_string(value: str) -> "BasePeriod":
+        # "YYYY-MM-DD/YYYY-MM-DD", the format of __str__
+        start, separator, end = value.partition("/")
+        if not separator:
+            raise ValueError(f"Expected a FROM/TO base period, got {value!r}")
+        return BasePeriod(start=date.fromisoformat(start), end=date.fromisoformat(end))
+
+    def __str__(self) -> str:
+        return f"{self.start.isoformat()}/{self.end.isoformat()}"
+
+
+def compute_link_factors(entries: Mapping[Element, List[Entry]],
+                         reference: BasePeriod) -> Dict[Tuple[str, str, BasePeriod], float]:
+    # Factor per region, code and base period which puts the values of the
+    # code in that base onto the reference base. Two bases of a series are
+    # linked by the months published in both, whose sums must match once
+    # linked, and the links are chained from the reference outwards. A code
+    # without any such overlap with the reference gets the factors of its
+    # nearest ancestor in the same region.
+    levels = collections.defaultdict(lambda: collections.defaultdict(dict))
+    for element, element_entries in entries.items():
+        for entry in element_entries:
+            levels[(entry.region, element.kod)][BasePeriod.of(entry.time)][entry_period(entry)] = entry.value
+
+    factors = {}
+    unlinked = []
+    for (region, code), base_levels in levels.items():
+        code_factors = {}
+        if reference in base_levels:
+            code_factors[reference] = 1.0
+        linked = list(code_factors)
+        while linked:
+            linked_base = linked.pop()
+            linked_values = base_levels[linked_base]
+            for base, values in base_levels.items():
+                if base in code_factors:
+                    continue
+                overlap = linked_values.keys() & values.keys()
+                if overlap:
+                    code_factors[base] = (
+                        code_factors[linked_base]
+                        * sum(linked_values[period] for period in overlap)
+                        / sum(values[period] for period in overlap)
+                    )
+                    linked.append(base)
+        for base in base_levels:
+            if base in code_factors:
+                factors[(region, code, base)] = code_factors[base]
+            else:
+                unlinked.append((region, code, base))
+
+    # The shorter codes first, so that the ancestors are resolved before
+    # their descendants need them
+    for region, code, base in sorted(unlinked, key=lambda item: len(item[1])):
+        ancestor = next(
+            (code[:length] for length in range(len(code) - 1, 0, -1) if (region, code[:length], base) in factors),
+            None,
+        )
+        if ancestor is None:
+            raise DataValidationError(
+                f"ECOICOP {code} in base {base} does not overlap with any series linked to the reference base {reference}",
+                source=f"region {region}" if region else None,
+            )
+        factors[(region, code, base)] = factors[(region, ancestor, base)]
+    return factors
+
+
+def rebase_entries(entries: Mapping[Element, List[Entry]],
+                   reference: Optional[BasePeriod] = None) -> Tuple[Mapping[Element, List[Entry]], BasePeriod]:
+    """
+    Puts all the entries onto a single base period, so that they can be
+    weighted together.
+
+    The link factors are computed once per region, code and base period, and
+    every series of a code in one region and base is then scaled by its
+    factor as a whole. Where a month is published in several bases, the
+    reference base wins, then the most recent base.
+
+    Args:
+        entries: Entries grouped by their element, in any base periods
+        reference: Base period to link onto, the most recent one in the data if None
+
+    Returns:
+        The rebased entries and the reference base. The entries are returned
+        as they are when they all share the reference base already.
+    """
+    # The times are shared between the entries, so this only looks at a few
+    times = {entry.time for element_entries in entries.values() for entry in element_entries}
+    bases = {BasePeriod.of(time) for time in times}
+    if reference is None:
+        reference = max(bases, default=None)
+    if bases <= {reference}:
+        return entries, reference
+    if reference not in bases:
+        raise DataValidationError(f"Reference base {reference} is not in the data, the bases are "
+                                  f"{', '.join(str(base) for base in sorted(bases))}")
+
+    factors = compute_link_factors(entries, reference)
+    rebased_times = {time: replace(time, bazOd=reference.start, bazDo=reference.end) for time in times}
+    preference = [reference] + sorted(bases - {reference}, reverse=True)
+
+    result = {}
+    for element, element_entries in entries.items():
+        by_base = collections.defaultdict(list)
+        for entry in element_entries:
+            by_base[(entry.region, BasePeriod.of(entry.time))].append(entry)
+        regions = sorted({region for region, _ in by_base})
+
+        rebased = {}
+        for region in regions:
+            for base in preference:
+                base_entries = by_base.get((region, base))
+                if not base_entries:
+                    continue
+                factor = factors[(region, element.kod, base)]
+                for entry in base_entries:
+                    key = (region, entry_period(entry))
+                    if key not in rebased:
+                        rebased[key] = Entry(
+                            value=entry.value * factor, time=rebased_times[entry.time], element=element, region=region
+                        )
+        result[element] = [rebased[key] for key in sorted(rebased, key=lambda key: (key[0], key[1].ordinal()))]
+    return result, reference
+
+
 @dataclass(frozen=True)
 class ConsumerBasketItem:
     ecoicop: str
@@ -311,6 +911,12 @@ class ConsumerBasketItem:
 @dataclass
 class ConsumerBasket:
     items: List[ConsumerBasketItem]
+    index: EcoicopIndex = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.index = EcoicopIndex()
+        for item in self.items:
+            self.index.add(item.ecoicop, weight=item.weight)
 
     @staticmethod
     def _normalize_ecoicop(ecoicop: str) -> str:
@@ -343,36 +949,115 @@ class ConsumerBasket:
     @staticmethod
     def _check_that_ecoicops_are_not_overlapping(ecoicops: List[str]):
         # Check that none of the provided ecoicops are parents of one another
-        for ecoicop in ecoicops:
-            for other_ecoicop in ecoicops:
-                if ecoicop.startswith(other_ecoicop) and ecoicop != other_ecoicop:
-                    raise ValueError(f"ECOICOP {ecoicop} is a parent of {other_ecoicop}")
+        overlap = EcoicopIndex.find_overlap(ecoicops)
+        if overlap is not None:
+            parent, child = overlap
+            raise ValueError(f"ECOICOP {parent} is a parent of {child}")
         return True
 
     def weigh_ecoicops(self, ecoicops: List[str]) -> float:
         # Consumes the ecoicops and returns the total weight of them in the
         # basket
+        if len(ecoicops) == 1:
+            return self.index.weight(ecoicops[0])
         assert self._check_that_ecoicops_are_not_overlapping(ecoicops)
-        total_weight = 0.0
-        for item in self.items:
-            if item.ecoicop in ecoicops:
-                total_weight += item.weight
-        return total_weight
+        return sum(self.index.weight(ecoicop) for ecoicop in dict.fromkeys(ecoicops))
 
 
-def produce_inflation_data(entries: Mapping[Element, List[Entry]], basket: ConsumerBasket) -> List[CategoryInflationData]:
-    result = []
+@dataclass
+class BasketVintage:
+    # The basket is used from effective_from until the next vintage starts,
+    # None means from the beginning of the data
+    effective_from: Optional[TimePeriod]
+    basket: ConsumerBasket
+    # Weight tables computed once, so that the lookups are a single dict access
+    # ECOICOP -> weight
+    code_weights: Dict[str, float] = field(init=False, repr=False, compare=False)
+    # Category id -> total weight of its ECOICOP numbers
+    category_weights: Dict[str, float] = field(init=False, repr=False, compare=False)
 
-    # First, validate that all entries follow our assumptions about dates
-    for element_entries in entries.values():
-        for entry in element_entries:
-            # Verify that casOd is always first day of month
-            assert entry.time.casOd.day == 1, f"Expected first day of month, got {entry.time.casOd}"
-            # Verify that casDo is always last day of month
-            assert entry.time.casDo.day in [28, 29, 30, 31], f"Expected last day of month, got {entry.time.casDo}"
-            # Verify that they are in the same month
-            assert entry.time.casOd.year == entry.time.casDo.year, "Expected same year"
-            assert entry.time.casOd.month == entry.time.casDo.month, "Expected same month"
+    def __post_init__(self):
+        self.code_weights = {ecoicop: self.basket.index.weight(ecoicop) for ecoicop in self.basket.index}
+        self.category_weights = {
+            category.id: self.basket.weigh_ecoicops(category.ecoicop_numbers) for category in CATEGORIES
+        }
+
+
+@dataclass
+class BasketVintages:
+    # ČSÚ revises the basket weights periodically, every period has to be
+    # weighted by the basket that was in effect at that time. The oldest
+    # vintage also covers the periods before it starts.
+    vintages: List[BasketVintage]
+    # Interval index: sorted start ordinals, the vintage of a period is found
+    # by bisecting them. Resolved periods are memoized, so that repeated
+    # lookups stay O(1) no matter how many vintages there are.
+    _starts: List[int] = field(init=False, repr=False, compare=False)
+    _positions: Dict[TimePeriod, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.vintages:
+            raise ValueError("At least one basket vintage is required")
+
+        def start(vintage: BasketVintage) -> float:
+            return vintage.effective_from.ordinal() if vintage.effective_from is not None else float("-inf")
+
+        self.vintages = sorted(self.vintages, key=start)
+        self._starts = [start(vintage) for vintage in self.vintages]
+        for previous, current in zip(self.vintages, self.vintages[1:]):
+            if start(previous) == start(current):
+                raise ValueError(f"Two basket vintages start at {current.effective_from}")
+        self._positions = {}
+
+    @staticmethod
+    def single(basket: ConsumerBasket) -> "BasketVintages":
+        return BasketVintages([BasketVintage(effective_from=None, basket=basket)])
+
+    @staticmethod
+    def load_from_specs(specs: List[str]) -> "BasketVintages":
+        # Every spec is "PATH" or "YYYY-MM=PATH", where YYYY-MM is the first
+        # period the basket applies to. Anything else before the first "="
+        # is part of the path, which may contain "=" too.
+        vintages = []
+        for spec in specs:
+            prefix, separator, path = spec.partition("=")
+            effective_from = None
+            if separator and re.fullmatch(r"\d{4}-\d{2}", prefix):
+                effective_from = TimePeriod.from_string(prefix)
+            else:
+                path = spec
+            vintages.append(BasketVintage(
+                effective_from=effective_from,
+                basket=ConsumerBasket.load_from_path(Path(path)),
+            ))
+        return BasketVintages(vintages)
+
+    @property
+    def latest(self) -> BasketVintage:
+        return self.vintages[-1]
+
+    def position(self, period: TimePeriod) -> int:
+        # Index of the vintage in effect in the period
+        position = self._positions.get(period)
+        if position is None:
+            position = max(bisect.bisect_right(self._starts, period.ordinal()) - 1, 0)
+            self._positions[period] = position
+        return position
+
+    def resolve(self, period: TimePeriod) -> BasketVintage:
+        return self.vintages[self.position(period)]
+
+
+def entry_period(entry: Entry) -> TimePeriod:
+    # The month of the entry, the times are validated once by validate_time
+    period = entry.time.period
+    if period is None:
+        raise DataValidationError(f"Time {entry.time} of ECOICOP {entry.element.kod} is not a validated month")
+    return period
+
+
+def produce_inflation_data(entries: Mapping[Element, List[Entry]], baskets: BasketVintages) -> List[CategoryInflationData]:
+    result = []
 
     # For each category, we need to:
     # 1. Find all relevant entries (based on ECOICOP numbers)
@@ -389,8 +1074,7 @@ def produce_inflation_data(entries: Mapping[Element, List[Entry]], basket: Consu
         # Group entries by time period
         period_entries = collections.defaultdict(list)
         for entry in category_entries:
-            period = TimePeriod(year=entry.time.casOd.year, month=entry.time.casOd.month)
-            period_entries[period].append(entry)
+            period_entries[entry_period(entry)].append(entry)
 
         # For each time period, compute weighted average
         rates = {}
@@ -398,16 +1082,19 @@ def produce_inflation_data(entries: Mapping[Element, List[Entry]], basket: Consu
             # Get weights for each ECOICOP number in this period
             weights = []
             values = []
+            code_weights = baskets.resolve(period).code_weights
 
             for entry in period_entry_list:
-                weight = basket.weigh_ecoicops([entry.element.kod])
-                assert weight > 0, f"Expected positive weight for ECOICOP {entry.element.kod}"
+                weight = code_weights.get(entry.element.kod, 0.0)
+                if weight <= 0:
+                    raise DataValidationError(f"Expected positive weight for ECOICOP {entry.element.kod} in period {period}")
                 weights.append(weight)
                 values.append(entry.value)
 
             # Normalize weights
             total_weight = sum(weights)
-            assert total_weight > 0, f"Expected positive total weight for category {category.id} in period {period}"
+            if total_weight <= 0:
+                raise DataValidationError(f"Expected positive total weight for category {category.id} in period {period}")
             normalized_weights = [w / total_weight for w in weights]
             # Compute weighted average
             weighted_value = sum(v * w for v, w in zip(values, normalized_weights))
@@ -423,6 +1110,49 @@ def produce_inflation_data(entries: Mapping[Element, List[Entry]], basket: Consu
     return result
 
 
+def produce_inflation_data_numpy(entries: Mapping[Element, List[Entry]], baskets: BasketVintages) -> List[CategoryInflationData]:
+    # Same as produce_inflation_data, but computed on columns by NumPy. The
+    # results match up to floating point rounding.
+    import columnar
+
+    rates = columnar.compute_category_rates(
+        entries,
+        CATEGORIES,
+        [vintage.code_weights for vintage in baskets.vintages],
+        lambda period: baskets.position(TimePeriod(year=period[0], month=period[1])),
+    )
+    return [
+        CategoryInflationData(
+            category=category,
+            rates={
+                TimePeriod(year=year, month=month): rate
+                for (year, month), rate in rates[category.id].items()
+            }
+        )
+        for category in CATEGORIES
+    ]
+
+
+def cross_check_inflation_data(expected: List[CategoryInflationData], actual: List[CategoryInflationData]):
+    import columnar
+
+    def to_plain(inflation_data: List[CategoryInflationData]):
+        return {
+            category_data.category.id: {
+                (period.year, period.month): rate for period, rate in category_data.rates.items()
+            }
+            for category_data in inflation_data
+        }
+
+    differences = columnar.compare_rates(to_plain(expected), to_plain(actual))
+    for difference in differences:
+        print(f"Cross-check mismatch: {difference}")
+    # Not an assert, the check also has to run under python -O
+    if differences:
+        raise RuntimeError(f"The engines disagree in {len(differences)} values")
+    print("Cross-check passed")
+
+
 def serialize_inflation_data(inflation_data: List[CategoryInflationData]):
     # Serialize into a JSON-serializable dict
     result = []
@@ -439,25 +1169,542 @@ def serialize_inflation_data(inflation_data: List[CategoryInflationData]):
     return result
 
 
+def encode_inflation_series(serialized_data: List[dict], decimals: Optional[int] = None, delta: bool = False) -> dict:
+    # Columnar form of the serialized data. All the categories share one
+    # period axis and every category has a dense array of values, None where
+    # the period is missing. With decimals, the values are stored as integers
+    # scaled by 10**decimals, delta additionally stores every value as the
+    # difference from the previous one.
+    if delta and decimals is None:
+        raise ValueError("Delta encoding requires quantized values")
+
+    periods = sorted({period for category_data in serialized_data for period in category_data["rates"]})
+    scale = 10 ** decimals if decimals is not None else None
+
+    categories = []
+    for category_data in serialized_data:
+        values = [category_data["rates"].get(period) for period in periods]
+        if scale is not None:
+            values = [round(value * scale) if value is not None else None for value in values]
+        if delta:
+            previous = 0
+            deltas = []
+            for value in values:
+                if value is None:
+                    deltas.append(None)
+                    continue
+                deltas.append(value - previous)
+                previous = value
+            values = deltas
+        categories.append({
+            "id": category_data["id"],
+            "name": category_data["name"],
+            "description": category_data["description"],
+            "values": values
+        })
+
+    return {
+        "periods": periods,
+        "scale": scale,
+        "delta": delta,
+        "categories": categories
+    }
+
+
+def decode_inflation_series(series: dict) -> List[dict]:
+    # Inverse of encode_inflation_series, up to the quantization
+    result = []
+    for category_data in series["categories"]:
+        values = category_data["values"]
+        if series["delta"]:
+            previous = 0
+            absolute = []
+            for value in values:
+                if value is None:
+                    absolute.append(None)
+                    continue
+                previous += value
+                absolute.append(previous)
+            values = absolute
+        if series["scale"] is not None:
+            values = [value / series["scale"] if value is not None else None for value in values]
+        result.append({
+            "id": category_data["id"],
+            "name": category_data["name"],
+            "description": category_data["description"],
+            "rates": {
+                period: value for period, value in zip(series["periods"], values) if value is not None
+            }
+        })
+    return result
+
+
+def build_inflation_index(serialized_data: List[dict]) -> dict:
+    # Precomputed lookups for the calculator: the sorted period axis, the
+    # complete years and, for every year, the months with data and the sum
+    # of every category's values over those months (aligned with
+    # "categories"). The average spend for a year is then a dot product of
+    # the amounts with the sums, divided by the number of months.
+    periods = sorted({period for category_data in serialized_data for period in category_data["rates"]})
+
+    months_by_year = collections.defaultdict(list)
+    for period in periods:
+        year, month = period.split("-")
+        months_by_year[int(year)].append(int(month))
+
+    years = []
+    for year, months in sorted(months_by_year.items()):
+        keys = [f"{year}-{month:02d}" for month in months]
+        sums = []
+        for category_data in serialized_data:
+            values = [category_data["rates"].get(key) for key in keys]
+            # A category missing a month makes the whole year unusable for it
+            sums.append(sum(values) if None not in values else None)
+        years.append({
+            "year": year,
+            "months": months,
+            "sums": sums
+        })
+
+    complete_years = [year["year"] for year in years if len(year["months"]) == 12]
+    return {
+        "periods": periods,
+        "categories": [category_data["id"] for category_data in serialized_data],
+        "completeYears": complete_years,
+        # Same fallback as the calculator used, the earliest year
+        "lastCompleteYear": max(complete_years) if complete_years else (years[0]["year"] if years else None),
+        "years": years
+    }
+
+
+# Changes in percent derived from the index levels, see compute_derived_series
+DERIVED_SERIES = ("mom", "yoy", "rolling12")
+
+
+def _percent_change(value: Optional[float], previous: Optional[float]) -> Optional[float]:
+    if value is None or not previous:
+        return None
+    return (value / previous - 1) * 100
+
+
+def compute_derived_series(rates: Mapping[str, float]) -> Dict[str, Dict[str, float]]:
+    # Derived series of one category, keyed by "YYYY-MM" like the rates. mom
+    # and yoy compare the month with the previous month and with the same
+    # month a year earlier. rolling12 compares the average of the last 12
+    # months with the average of the 12 months before, the average annual
+    # inflation rate as ČSÚ reports it. A period is left out when its window
+    # misses a month.
+    derived = {name: {} for name in DERIVED_SERIES}
+    if not rates:
+        return derived
+
+    ordinals = {period: TimePeriod.from_string(period).ordinal() for period in rates}
+    first = min(ordinals.values())
+    # Dense month axis with None in the gaps, so that every window is a
+    # fixed offset into it
+    values: List[Optional[float]] = [None] * (max(ordinals.values()) - first + 1)
+    for period, ordinal in ordinals.items():
+        values[ordinal - first] = rates[period]
+
+    # The 12 month sum is updated as the window slides, so that the whole
+    # series takes a single pass
+    averages: List[Optional[float]] = [None] * len(values)
+    window_sum = 0.0
+    window_missing = 0
+    for position, value in enumerate(values):
+        if value is None:
+            window_missing += 1
+        else:
+            window_sum += value
+        if position >= 12:
+            dropped = values[position - 12]
+            if dropped is None:
+                window_missing -= 1
+            else:
+                window_sum -= dropped
+        if position >= 11 and window_missing == 0:
+            averages[position] = window_sum / 12
+
+        if value is None:
+            continue
+        ordinal = first + position
+        period = f"{ordinal // 12}-{ordinal % 12 + 1:02d}"
+        changes = {
+            "mom": _percent_change(value, values[position - 1]) if position >= 1 else None,
+            "yoy": _percent_change(value, values[position - 12]) if position >= 12 else None,
+            "rolling12": _percent_change(averages[position], averages[position - 12]) if position >= 12 else None,
+        }
+        for name, change in changes.items():
+            if change is not None:
+                derived[name][period] = change
+    return derived
+
+
+def build_derived_series(serialized_data: List[dict]) -> List[dict]:
+    # The derived series of every category, in the order of serialized_data
+    return [
+        {"id": category_data["id"], **compute_derived_series(category_data["rates"])}
+        for category_data in serialized_data
+    ]
+
+
+def _round_derived(value: Optional[float], decimals: Optional[int]) -> Optional[float]:
+    return round(value, decimals) if value is not None and decimals is not None else value
+
+
+def encode_derived_series(derived_data: List[dict], periods: List[str], decimals: Optional[int] = None) -> dict:
+    # Arrays aligned with the periods, None where a series has no value. The
+    # changes are small numbers, so decimals only rounds them.
+    return {
+        "periods": periods,
+        "series": list(DERIVED_SERIES),
+        "categories": [
+            {
+                "id": category_data["id"],
+                **{
+                    name: [_round_derived(category_data[name].get(period), decimals) for period in periods]
+                    for name in DERIVED_SERIES
+                },
+            }
+            for category_data in derived_data
+        ],
+    }
+
+
+def build_year_chunks(serialized_data: List[dict], decimals: Optional[int] = None, delta: bool = False,
+                      derived_data: Optional[List[dict]] = None) -> List[dict]:
+    # One chunk per year with the values of every category in the months of
+    # the year, encoded like encode_inflation_series, and the yearly sums of
+    # build_inflation_index. The categories follow serialized_data. With
+    # derived_data, the chunk also has the derived series per category,
+    # aligned with the months.
+    chunks = []
+    for summary in build_inflation_index(serialized_data)["years"]:
+        prefix = f"{summary['year']}-"
+        year_data = [
+            {**category_data, "rates": {
+                period: rate for period, rate in category_data["rates"].items() if period.startswith(prefix)
+            }}
+            for category_data in serialized_data
+        ]
+        series = encode_inflation_series(year_data, decimals, delta)
+        chunk = {
+            "year": summary["year"],
+            "months": summary["months"],
+            "scale": series["scale"],
+            "delta": series["delta"],
+            "values": [category_data["values"] for category_data in series["categories"]],
+            "sums": summary["sums"],
+        }
+        if derived_data is not None:
+            derived = encode_derived_series(derived_data, [f"{prefix}{month:02d}" for month in summary["months"]], decimals)
+            chunk["derived"] = {
+                name: [category_data[name] for category_data in derived["categories"]] for name in DERIVED_SERIES
+            }
+        chunks.append(chunk)
+    return chunks
+
+
+def write_year_chunks(output_dir: Path, serialized_data: List[dict], chunks: List[dict]) -> dict:
+    # Writes the chunks of build_year_chunks and manifest.json, and returns
+    # the manifest. The manifest has everything but the values, so that the
+    # app can show the categories and periods before any chunk is loaded.
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = build_inflation_index(serialized_data)
+    years = []
+    for chunk in chunks:
+        file_name, size = write_chunk_file(output_dir, str(chunk["year"]), chunk)
+        years.append({"year": chunk["year"], "months": chunk["months"], "file": file_name, "bytes": size})
+
+    manifest = {
+        "categories": [
+            {
+                "id": category_data["id"],
+                "name": category_data["name"],
+                "description": category_data["description"],
+            }
+            for category_data in serialized_data
+        ],
+        "completeYears": index["completeYears"],
+        "lastCompleteYear": index["lastCompleteYear"],
+        "derivedSeries": any("derived" in chunk for chunk in chunks),
+        "years": years,
+    }
+    write_chunk_manifest(output_dir, manifest)
+    return manifest
+
+
+def read_year_chunks(chunks_dir: Path) -> List[dict]:
+    # Inverse of write_year_chunks, up to the quantization
+    manifest = json.loads((chunks_dir / "manifest.json").read_text())
+    result = [{**category, "rates": {}} for category in manifest["categories"]]
+    for year in manifest["years"]:
+        chunk = json.loads((chunks_dir / year["file"]).read_text())
+        series = decode_inflation_series({
+            "periods": [f"{chunk['year']}-{month:02d}" for month in chunk["months"]],
+            "scale": chunk["scale"],
+            "delta": chunk["delta"],
+            "categories": [
+                {**category, "values": values} for category, values in zip(manifest["categories"], chunk["values"])
+            ],
+        })
+        for category_data, year_data in zip(result, series):
+            category_data["rates"].update(year_data["rates"])
+    return result
+
+
+def merge_serialized_inflation_data(previous: List[dict], fresh: List[dict]) -> Tuple[List[dict], Dict[str, List[str]], Dict[str, List[str]]]:
+    # Merges freshly computed rates into a previously generated dataset. The
+    # categories follow CATEGORIES, cells missing from fresh are kept as they
+    # were.
+    # Returns the merged data, and new and revised periods, each mapped to
+    # the ids of the affected categories.
+    previous_by_id = {category_data["id"]: category_data for category_data in previous}
+    fresh_by_id = {category_data["id"]: category_data for category_data in fresh}
+    new_periods = collections.defaultdict(list)
+    revised_periods = collections.defaultdict(list)
+
+    merged = []
+    for category in CATEGORIES:
+        rates = dict(previous_by_id.get(category.id, {}).get("rates", {}))
+        for period, rate in fresh_by_id.get(category.id, {}).get("rates", {}).items():
+            if period not in rates:
+                new_periods[period].append(category.id)
+            elif rates[period] != rate:
+                revised_periods[period].append(category.id)
+            rates[period] = rate
+        merged.append({
+            "id": category.id,
+            "name": category.name,
+            "description": category.description,
+            # The keys are YYYY-MM, so this is chronological
+            "rates": dict(sorted(rates.items()))
+        })
+
+    return merged, dict(sorted(new_periods.items())), dict(sorted(revised_periods.items()))
+
+
+def quantize_rates(data: List[dict], decimals: Optional[int]) -> List[dict]:
+    # The rates of the categories or ECOICOP nodes as they read back from an
+    # output quantized to the decimals, the other keys are kept
+    if decimals is None:
+        return data
+    quantized = decode_inflation_series(encode_inflation_series(data, decimals))
+    return [{**item, "rates": item_data["rates"]} for item, item_data in zip(data, quantized)]
+
+
+def print_changed_periods(new_periods: Mapping[str, List[str]], revised_periods: Mapping[str, List[str]]):
+    for period, category_ids in new_periods.items():
+        print(f"New period {period} ({len(category_ids)} categories)")
+    for period, category_ids in revised_periods.items():
+        print(f"Revised period {period}: {', '.join(category_ids)}")
+    if not new_periods and not revised_periods:
+        print("No new or revised periods")
+
+
+def read_generated_ts(ts_file: Path) -> Dict[str, object]:
+    # Reads back the exports of a file written by write_generated_ts
+    text = ts_file.read_text()
+    decoder = json.JSONDecoder()
+    exports = {}
+    for match in re.finditer(r"^export const (\w+) = ", text, re.MULTILINE):
+        exports[match.group(1)], _ = decoder.raw_decode(text, match.end())
+    return exports
+
+
+def read_serialized_inflation_data(ts_file: Path, chunks_dir: Optional[Path] = None) -> List[dict]:
+    # Reads the rates back from a file in any of the output formats, the
+    # chunked one also needs the directory with the chunks
+    exports = read_generated_ts(ts_file)
+    if "inflationChunks" in exports:
+        if chunks_dir is None:
+            raise ValueError(f"{ts_file} only has the manifest of the year chunks, their directory is needed")
+        return read_year_chunks(chunks_dir)
+    if "inflationSeries" in exports:
+        return decode_inflation_series(exports["inflationSeries"])
+    return exports["inflationRates"]
+
+
+def write_generated_ts(ts_file: Path, exports: Mapping[str, object], compact: bool = False):
+    with ts_file.open("w") as f:
+        f.write("// This file is regenerated by process.py\n")
+        for name, value in exports.items():
+            f.write(f"export const {name} = ")
+            if compact:
+                json.dump(value, f, separators=(",", ":"))
+            else:
+                json.dump(value, f, indent=2)
+            f.write(";\n")
+
+
 def print_category_to_ecoicop_mapping(all_entries: Mapping[Element, List[Entry]]):
     # Unfortunately, we do not have the ecoicop descriptions anywhere else
-    all_ecoicops = {}
+    index = EcoicopIndex()
     for element in all_entries.keys():
-        all_ecoicops[element.kod] = element
+        index.add(element.kod, element=element)
 
     def print_it_and_children(entry: Element, level: int):
         print(f"{' ' * level}{entry.kod}: {entry.text}")
-        for child_key in all_ecoicops.keys():
-            if child_key.startswith(entry.kod) and child_key != entry.kod:
-                print_it_and_children(all_ecoicops[child_key], level + 2)
+        for child_key in index.children(entry.kod):
+            print_it_and_children(index.element(child_key), level + 2)
 
     for category in CATEGORIES:
         print(f"Category {category.name}")
         for ecoicop in category.ecoicop_numbers:
-            print_it_and_children(all_ecoicops[ecoicop], 2)
+            print_it_and_children(index.element(ecoicop), 2)
+
+
+def produce_ecoicop_data(entries: Mapping[Element, List[Entry]], baskets: BasketVintages) -> List[dict]:
+    # Series of every ECOICOP node in the data, at full depth, serialized like
+    # serialize_inflation_data. All the entries of a node share its basket
+    # weight, so their weighted average (there is one entry per region in
+    # regional exports) is the plain mean.
+    names = {}
+    period_values = collections.defaultdict(lambda: collections.defaultdict(list))
+    for element, element_entries in entries.items():
+        # The element text can differ between the years, the later wins
+        names[element.kod] = element.text
+        for entry in element_entries:
+            period_values[element.kod][entry_period(entry)].append(entry.value)
+
+    rates = {
+        code: {
+            f"{period.year}-{period.month:02d}": sum(values) / len(values)
+            for period, values in sorted(code_values.items(), key=lambda item: item[0].ordinal())
+        }
+        for code, code_values in period_values.items()
+    }
+    return _ecoicop_nodes(names, rates, baskets.latest.code_weights)
+
+
+def merge_ecoicop_data(previous: List[dict], fresh: List[dict], baskets: BasketVintages) -> List[dict]:
+    # Merges the nodes of produce_ecoicop_data over the changed periods into
+    # a previous export, like merge_serialized_inflation_data
+    names = {node["id"]: node["name"] for node in previous}
+    rates = {node["id"]: dict(node["rates"]) for node in previous}
+    for node in fresh:
+        names[node["id"]] = node["name"]
+        rates.setdefault(node["id"], {}).update(node["rates"])
+    # The keys are YYYY-MM, so this is chronological
+    return _ecoicop_nodes(names, {code: dict(sorted(code_rates.items())) for code, code_rates in rates.items()},
+                          baskets.latest.code_weights)
+
 
+def _ecoicop_nodes(names: Mapping[str, str], rates: Mapping[str, Dict[str, float]],
+                   weights: Mapping[str, float]) -> List[dict]:
+    index = EcoicopIndex(names)
+    result = []
+    for code in index:
+        parent = next((code[:length] for length in range(len(code) - 1, 0, -1) if code[:length] in index), None)
+        result.append({
+            "id": code,
+            "name": names[code],
+            "description": "",
+            "parent": parent,
+            "weight": weights.get(code),
+            "rates": rates.get(code, {}),
+        })
+    return result
 
-def make_csu_profile_preset(basket: ConsumerBasket):
+
+# Chunk files are named <key>.<content hash>.json, see write_chunk_file
+CHUNK_FILE_PATTERN = re.compile(r"^\w+\.[0-9a-f]{12}\.json$")
+
+
+def write_chunk_file(output_dir: Path, key: str, chunk: dict) -> Tuple[str, int]:
+    # The name contains a hash of the content, so that the file can be cached
+    # forever. Returns the file name and size.
+    content = json.dumps(chunk, separators=(",", ":"), ensure_ascii=False).encode()
+    file_name = f"{key}.{hashlib.sha256(content).hexdigest()[:12]}.json"
+    (output_dir / file_name).write_bytes(content)
+    return file_name, len(content)
+
+
+def write_chunk_manifest(output_dir: Path, manifest: dict):
+    # Written after the chunks, so that it never points to a missing chunk.
+    # The chunks it does not reference are left over from previous runs.
+    with (output_dir / "manifest.json").open("w") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    referenced = {entry["file"] for entry in manifest.get("subtrees", manifest.get("years", []))}
+    for path in output_dir.iterdir():
+        if CHUNK_FILE_PATTERN.match(path.name) and path.name not in referenced:
+            path.unlink()
+
+
+def write_ecoicop_chunks(output_dir: Path, ecoicop_data: List[dict], metadata: dict,
+                         decimals: Optional[int] = None, delta: bool = False):
+    # Splits the full-depth data into one chunk per top-level ECOICOP
+    # division, so that the app loads a subtree only when it is opened.
+    # manifest.json lists the divisions with their chunk files.
+    output_dir.mkdir(parents=True, exist_ok=True)
+    subtrees = collections.defaultdict(list)
+    for node in ecoicop_data:
+        subtrees[node["id"][:2]].append(node)
+
+    nodes_by_id = {node["id"]: node for node in ecoicop_data}
+    manifest_subtrees = []
+    for code, nodes in sorted(subtrees.items()):
+        series = encode_inflation_series(nodes, decimals, delta)
+        chunk = {
+            "code": code,
+            "periods": series["periods"],
+            "scale": series["scale"],
+            "delta": series["delta"],
+            "nodes": [
+                {
+                    "code": node["id"],
+                    "name": node["name"],
+                    "parent": node["parent"],
+                    "weight": node["weight"],
+                    "values": encoded["values"],
+                }
+                for node, encoded in zip(nodes, series["categories"])
+            ]
+        }
+        file_name, size = write_chunk_file(output_dir, code, chunk)
+
+        root = nodes_by_id.get(code)
+        manifest_subtrees.append({
+            "code": code,
+            "name": root["name"] if root is not None else None,
+            "weight": root["weight"] if root is not None else None,
+            "file": file_name,
+            "nodes": len(nodes),
+            "bytes": size,
+        })
+
+    periods = sorted({period for node in ecoicop_data for period in node["rates"]})
+    manifest = {
+        **metadata,
+        "firstPeriod": periods[0] if periods else None,
+        "lastPeriod": periods[-1] if periods else None,
+        "subtrees": manifest_subtrees,
+    }
+    write_chunk_manifest(output_dir, manifest)
+
+
+def read_ecoicop_chunks(output_dir: Path) -> List[dict]:
+    # Inverse of write_ecoicop_chunks, up to the quantization
+    manifest = json.loads((output_dir / "manifest.json").read_text())
+    result = []
+    for subtree in manifest["subtrees"]:
+        chunk = json.loads((output_dir / subtree["file"]).read_text())
+        series = decode_inflation_series({
+            "periods": chunk["periods"],
+            "scale": chunk["scale"],
+            "delta": chunk["delta"],
+            "categories": [
+                {"id": node["code"], "name": node["name"], "description": "", "values": node["values"]}
+                for node in chunk["nodes"]
+            ],
+        })
+        for node, node_data in zip(chunk["nodes"], series):
+            result.append({**node_data, "parent": node["parent"], "weight": node["weight"]})
+    return result
+
+
+def make_csu_profile_preset(vintage: BasketVintage):
     # The absolute amount is not very relevant here
     total_spend = 50000
     categories = []
@@ -465,7 +1712,7 @@ def make_csu_profile_preset(basket: ConsumerBasket):
         category_data = {
             "categoryId": category.id,
             "amount": round(
-                basket.weigh_ecoicops(category.ecoicop_numbers) * total_spend,
+                vintage.category_weights[category.id] * total_spend,
                 ndigits=-1
             )
         }
@@ -473,20 +1720,167 @@ def make_csu_profile_preset(basket: ConsumerBasket):
         categories.append(category_data)
 
     total_weight = sum(category_data["amount"] for category_data in categories)
-    assert abs(total_weight - total_spend) < 100, f"Expected total weight to be {total_spend}, got {total_weight}"
+    if abs(total_weight - total_spend) >= 100:
+        raise DataValidationError(
+            f"Expected the categories to add up to {total_spend}, got {total_weight}",
+            source=f"basket effective from {vintage.effective_from or 'the start'}",
+        )
 
     return categories
 
 
-def main():
+# Exit code of a run that left the outputs untouched, as the content they
+# would be generated from did not change since the last run
+EXIT_UNCHANGED = 3
+
+
+def compute_content_hash(content: dict) -> str:
+    # Canonical JSON, so that equal content hashes equally between the runs
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def read_output_manifest(manifest_file: Path) -> Optional[dict]:
+    # None if there was no previous run, or its manifest is unreadable
+    try:
+        return json.loads(manifest_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def are_outputs_unchanged(manifest: Optional[dict], content_hash: str, outputs: List[Path],
+                          require_outputs: bool = True) -> bool:
+    # The outputs are also regenerated when they moved, or unless
+    # require_outputs is False, when some went missing. Without it, only the
+    # content hash counts, for outputs that are not kept between the runs.
+    return (
+        manifest is not None
+        and manifest.get("contentHash") == content_hash
+        and manifest.get("outputs") == [str(path) for path in outputs]
+        and (not require_outputs or all(path.exists() for path in outputs))
+    )
+
+
+def write_output_manifest(manifest_file: Path, content_hash: str, outputs: List[Path], fetched_at: str,
+                          settings: dict, reference_base: BasePeriod):
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "contentHash": content_hash,
+        "fetchedAt": fetched_at,
+        "outputs": [str(path) for path in outputs],
+        "settings": settings,
+        "referenceBase": str(reference_base),
+    }
+    manifest_file.write_text(json.dumps(manifest, indent=2) + "\n")
+
+
+def compute_output_settings(args, dataset: Dataset, baskets: BasketVintages) -> dict:
+    # Everything the cells depend on besides the observations, an
+    # incremental run can only build on outputs generated with the same
+    vintages = [
+        [
+            f"{vintage.effective_from.year}-{vintage.effective_from.month:02d}" if vintage.effective_from else None,
+            vintage.code_weights,
+        ]
+        for vintage in baskets.vintages
+    ]
+    return {
+        "dataset": dataset.id,
+        "store": str(args.store) if str(args.store) == ":memory:" else str(args.store.absolute()),
+        "quantize": args.quantize,
+        "categoriesHash": compute_content_hash({"categories": [category.ecoicop_numbers for category in CATEGORIES]}),
+        "basketsHash": compute_content_hash({"vintages": vintages}),
+    }
+
+
+@dataclass
+class PreviousOutputs:
+    # What an incremental run merges the changed cells into
+    rates: List[dict]
+    ecoicop: Optional[List[dict]]
+    reference_base: BasePeriod
+
+
+def load_previous_outputs(args, manifest: Optional[dict], settings: dict,
+                          outputs: List[Path]) -> Optional[PreviousOutputs]:
+    # The outputs of the last run if an incremental run can build on them,
+    # otherwise prints why not and returns None. They have to be generated
+    # from the same store with the same settings, or the cells the run does
+    # not recompute would be stale.
+    reason = None
+    if manifest is None or manifest.get("settings") != settings:
+        reason = "the last outputs were generated with other settings"
+    elif manifest.get("outputs") != [str(path) for path in outputs] or not all(path.exists() for path in outputs):
+        reason = "the last outputs are elsewhere or missing"
+    elif args.reference_base is not None and str(args.reference_base) != manifest["referenceBase"]:
+        reason = f"the last outputs are linked onto the base period {manifest['referenceBase']}"
+    if reason is not None:
+        print(f"No incremental update, {reason}")
+        return None
+
+    return PreviousOutputs(
+        rates=read_serialized_inflation_data(args.output_file, args.chunks_dir),
+        ecoicop=read_ecoicop_chunks(args.ecoicop_dir) if args.ecoicop_dir is not None else None,
+        reference_base=BasePeriod.from_string(manifest["referenceBase"]),
+    )
+
+
+def write_outputs(args, exports: dict, serialized_data: List[dict], year_chunks: Optional[List[dict]],
+                  profile_preset: Optional[List[dict]], ecoicop_data: Optional[List[dict]], metadata_data: dict):
+    if args.output_format == "chunked":
+        exports["inflationChunks"] = write_year_chunks(args.chunks_dir, serialized_data, year_chunks)
+        print(f"{len(year_chunks)} year chunks written to {args.chunks_dir}")
+    write_generated_ts(args.output_file, exports, compact=args.output_format == "columnar")
+    print(f"Data written to {args.output_file}")
+
+    if profile_preset is not None:
+        with args.profile_file.open("w") as f:
+            json.dump(profile_preset, f, indent=2)
+
+    if ecoicop_data is not None:
+        write_ecoicop_chunks(args.ecoicop_dir, ecoicop_data, metadata_data, args.quantize, args.delta)
+        print(f"ECOICOP data of {len(ecoicop_data)} nodes written to {args.ecoicop_dir}")
+
+
+def main(argv: Optional[List[str]] = None, input_streams: Optional[Iterable[Tuple[str, BinaryIO]]] = None):
+    # input_streams are (name, stream) exports already in memory, ingested
+    # after the input files, see pipeline.py
     parser = argparse.ArgumentParser(description="Parse an XML file.")
     parser.add_argument(
         "-b", "--basket-csv",
+        action="append",
+        metavar="[YYYY-MM=]PATH",
+        help="Path to the basket CSV file, optionally prefixed with the first period it applies to. "
+             "Repeat for every basket vintage, the oldest one also applies to all the earlier periods. "
+             "Defaults to spot_kos2024.csv for all periods",
+    )
+    parser.add_argument(
+        'input_file',
+        nargs="*",
         type=Path,
-        help="Path to the basket CSV file",
-        default=(Path(__file__).absolute().parent / "spot_kos2024.csv")
+        help='Paths to the input XML files, upserted into the store in this order. '
+             'Without any, the outputs are regenerated from the store alone',
+    )
+    parser.add_argument(
+        "-d", "--dataset",
+        choices=list(DATASETS),
+        default=DEFAULT_DATASET.id,
+        help='Table the input files were exported from, see datasets.py',
+    )
+    parser.add_argument(
+        "--reference-base",
+        type=BasePeriod.from_string,
+        metavar="FROM/TO",
+        help='Base period all the series are chain-linked onto, e.g. 2015-01-01/2015-12-31. '
+             'Defaults to the most recent base period in the data',
+    )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        help='SQLite file the observations are upserted into and kept in between the runs, e.g. observations.sqlite. '
+             'Defaults to a throwaway one in memory, so that the outputs reflect only the input files',
+        default=":memory:",
     )
-    parser.add_argument('input_file', nargs="+", type=Path, help='Path to the input XML file')
     parser.add_argument(
         "-o", "--output-file",
         type=Path,
@@ -498,44 +1892,296 @@ def main():
         type=Path,
         help='Path to the profile file with the default consumer basket',
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help='Number of processes used to parse the input files',
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help='Recompute only the periods the input files added or revised in the store and merge them into the '
+             'existing outputs, which are then reported. Regenerates everything when the outputs are missing or '
+             'were generated with other settings, or when a changed period is published in another base period',
+    )
+    parser.add_argument(
+        "--report-changes",
+        action="store_true",
+        help='Report the periods that are new or revised compared to the existing output file. '
+             'The previous output is assumed to have the same format and --quantize',
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["json", "columnar", "chunked"],
+        default="json",
+        help='json writes a dict of rates per category, columnar a shared period axis '
+             'and a compact array of values per category. chunked writes one file per year into '
+             '--chunks-dir and only their manifest into the output file, so that the app loads '
+             'the years on demand',
+    )
+    parser.add_argument(
+        "--chunks-dir",
+        type=Path,
+        help='Directory for the year chunks of the chunked format',
+        default=(Path(__file__).absolute().parent.parent / "public" / "data" / "rates"),
+    )
+    parser.add_argument(
+        "--quantize",
+        type=int,
+        metavar="DECIMALS",
+        help='Columnar format and --ecoicop-dir only, store the values as integers rounded to this many decimals',
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help='Columnar format and --ecoicop-dir only, store the differences between consecutive (quantized) values',
+    )
+    parser.add_argument(
+        "--derived-series",
+        action="store_true",
+        help='Also export the month-over-month, year-over-year and rolling 12-month changes of every category, '
+             'rounded to --quantize decimals if given',
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["python", "numpy"],
+        default="python",
+        help='Implementation used to aggregate the categories, numpy requires NumPy',
+    )
+    parser.add_argument(
+        "--cross-check",
+        action="store_true",
+        help='Run both engines and verify that their results match',
+    )
+    parser.add_argument(
+        "--ecoicop-dir",
+        type=Path,
+        help='Also export the series of every ECOICOP node into this directory, one chunk file per division '
+             'plus manifest.json. Honors --quantize and --delta',
+    )
+    parser.add_argument(
+        "--metrics-out",
+        type=Path,
+        help='Write wall time, CPU time and memory of every stage and per-file record counts to this JSON file',
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help='Also record the peak of Python allocations per stage with tracemalloc (slow)',
+    )
+    parser.add_argument(
+        "--cprofile-out",
+        type=Path,
+        help='Profile the run with cProfile and write the stats to this file',
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help='Directory of the cache of parsed input files',
+        default=(Path(__file__).absolute().parent / ".cache" / "parsed"),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help='Parse all the input files from scratch, bypassing the cache',
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help='File with the content hash of the last written outputs. When the rates and profile data hash '
+             f'the same, the outputs are left untouched and the exit code is {EXIT_UNCHANGED}',
+        default=(Path(__file__).absolute().parent / ".cache" / "outputs.json"),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help='Write the outputs even when the content did not change',
+    )
+    parser.add_argument(
+        "--ignore-missing-outputs",
+        action="store_true",
+        help='Decide whether the outputs are up to date from the content hash alone, even when they do not exist. '
+             'For CI, where the outputs are not kept between the runs and an unchanged run skips the deployment',
+    )
 
-    args = parser.parse_args()
-
-    print(f"Loading basket from {args.basket_csv}")
-    basket = ConsumerBasket.load_from_path(args.basket_csv)
-
-    all_entries = collections.defaultdict(list)
-    for input_file in args.input_file:
-        print(f"Processing {input_file}")
-        entries = parse_xml(input_file, args.output_file)
-        assert check_all_categories_covered(entries), "Not all ECOICOP numbers are covered by the categories"
-
-        for key, value in entries.items():
-            all_entries[key].extend(value)
-
-    print_category_to_ecoicop_mapping(all_entries)
+    args = parser.parse_args(argv)
+    if args.output_format == "json" and args.ecoicop_dir is None and (args.quantize is not None or args.delta):
+        parser.error("--quantize and --delta require --output-format columnar or chunked, or --ecoicop-dir")
+    if args.delta and args.quantize is None:
+        parser.error("--delta requires --quantize")
+    if args.incremental and str(args.store) == ":memory:":
+        parser.error("--incremental requires a persistent --store")
+
+    metrics = PipelineMetrics(trace_memory=args.trace_memory)
+    profiler = cProfile.Profile() if args.cprofile_out is not None else None
+    if profiler is not None:
+        profiler.enable()
+
+    with metrics.stage("basketLoad"):
+        basket_specs = args.basket_csv or [str(Path(__file__).absolute().parent / "spot_kos2024.csv")]
+        print(f"Loading baskets from {', '.join(basket_specs)}")
+        baskets = BasketVintages.load_from_specs(basket_specs)
+
+    store = ObservationStore(args.store)
+    with metrics.stage("inputFiles"):
+        print(f"Processing {len(args.input_file)} files using {args.jobs} jobs")
+        dataset = DATASETS[args.dataset]
+        cache = None if args.no_cache else ParsedFileCache(args.cache_dir, dataset=dataset)
+        upsert_stats = store_input_files(store, args.input_file, args.jobs, cache, metrics, dataset)
+        if input_streams is not None:
+            upsert_stats += store_input_streams(store, input_streams, metrics, dataset)
+
+    outputs = [
+        path.absolute()
+        for path in (
+            args.output_file,
+            args.chunks_dir if args.output_format == "chunked" else None,
+            args.profile_file,
+            args.ecoicop_dir,
+        )
+        if path is not None
+    ]
+    settings = compute_output_settings(args, dataset, baskets)
+    manifest = read_output_manifest(args.manifest)
+    previous = load_previous_outputs(args, manifest, settings, outputs) if args.incremental else None
+
+    with metrics.stage("storeLoad"):
+        if previous is not None:
+            # Only the national periods the input changed, in the reference
+            # base their values need no linking
+            changed_periods = sorted({
+                period_from for stats in upsert_stats for region, _, period_from, _ in stats.changed if region == ""
+            })
+            all_entries = load_store_entries(store, dataset, changed_periods)
+            bases = {BasePeriod.of(entry.time) for element_entries in all_entries.values() for entry in element_entries}
+            if bases <= {previous.reference_base}:
+                print(f"Recomputing the {len(changed_periods)} changed periods")
+            else:
+                print("No incremental update, the changed periods are published in other base periods too")
+                previous = None
+        if previous is None:
+            all_entries = load_store_entries(store, dataset)
+        store.close()
+    entry_count = sum(len(element_entries) for element_entries in all_entries.values())
+    if entry_count == 0 and previous is None:
+        parser.error(
+            f"The store {args.store} has no national observations of {dataset.id}, pass the XML files to ingest"
+        )
+    print(f"Loaded {entry_count} observations from {args.store}")
+
+    with metrics.stage("rebasing"):
+        reference_base = previous.reference_base if previous is not None else args.reference_base
+        all_entries, reference_base = rebase_entries(all_entries, reference_base)
+    print(f"Series linked onto the base period {reference_base}")
+    metrics.count("inputFiles", len(upsert_stats))
+    metrics.count("elements", len(all_entries))
+    metrics.count("regions", len({entry.region for element_entries in all_entries.values() for entry in element_entries}))
+    metrics.count("entries", entry_count)
+    metrics.count("incremental", int(previous is not None))
+
+    if previous is None:
+        print_category_to_ecoicop_mapping(all_entries)
+
+    with metrics.stage("aggregation"):
+        if args.engine == "numpy":
+            inflation_data = produce_inflation_data_numpy(all_entries, baskets)
+        else:
+            inflation_data = produce_inflation_data(all_entries, baskets)
+        if args.cross_check:
+            other_engine = produce_inflation_data if args.engine == "numpy" else produce_inflation_data_numpy
+            cross_check_inflation_data(inflation_data, other_engine(all_entries, baskets))
+
+    with metrics.stage("serialization"):
+        # Everything else is derived from the rates as they are written, as
+        # that is all an incremental run has of the periods it does not
+        # recompute. So it produces the same outputs as a full run.
+        decimals = args.quantize if args.output_format != "json" else None
+        serialized_data = quantize_rates(serialize_inflation_data(inflation_data), decimals)
+        if previous is not None:
+            serialized_data, new_periods, revised_periods = merge_serialized_inflation_data(previous.rates, serialized_data)
+            print_changed_periods(new_periods, revised_periods)
+        elif args.report_changes and args.output_file.exists():
+            previous_data = read_serialized_inflation_data(args.output_file, args.chunks_dir)
+            print_changed_periods(*merge_serialized_inflation_data(previous_data, serialized_data)[1:])
+
+        derived_data = build_derived_series(serialized_data) if args.derived_series else None
+
+        # The preset describes today's spending, so it uses the latest basket
+        profile_preset = make_csu_profile_preset(baskets.latest) if args.profile_file is not None else None
+        ecoicop_data = None
+        if args.ecoicop_dir is not None:
+            ecoicop_data = quantize_rates(produce_ecoicop_data(all_entries, baskets), args.quantize)
+            if previous is not None:
+                ecoicop_data = merge_ecoicop_data(previous.ecoicop, ecoicop_data, baskets)
+
+        # fetchedAt changes every run, so it is left out of the hash along
+        # with everything else derived from the hashed content
+        content_hash = compute_content_hash({
+            "outputFormat": args.output_format,
+            "quantize": args.quantize,
+            "delta": args.delta,
+            "derivedSeries": args.derived_series,
+            "rates": serialized_data,
+            "profile": profile_preset,
+            "ecoicop": ecoicop_data,
+        })
+        unchanged = not args.force and are_outputs_unchanged(
+            manifest, content_hash, outputs, require_outputs=not args.ignore_missing_outputs
+        )
 
-    inflation_data = produce_inflation_data(all_entries, basket)
-    serialized_data = serialize_inflation_data(inflation_data)
-    metadata_data = {
-        "fetchedAt": datetime.now(timezone.utc).isoformat()
-    }
-    with args.output_file.open("w") as f:
-        f.write("// This file is regenerated by process.py\n")
-        # Add metadata
-        f.write("export const inflationMetadata = ")
-        json.dump(metadata_data, f, indent=2)
-        f.write(";\n")
-        # Write inflation rates
-        f.write("export const inflationRates = ")
-        json.dump(serialized_data, f, indent=2)
-        f.write(";\n")
-        print(f"Data written to {args.output_file}")
-
-    if args.profile_file is not None:
-        cats = make_csu_profile_preset(basket)
-        with args.profile_file.open("w") as f:
-            json.dump(cats, f, indent=2)
+        metadata_data = {
+            "fetchedAt": datetime.now(timezone.utc).isoformat()
+        }
+        year_chunks = None
+        if args.output_format == "chunked":
+            year_chunks = build_year_chunks(serialized_data, args.quantize, args.delta, derived_data)
+            # inflationChunks is added once the chunks are written
+            exports = {
+                "inflationMetadata": metadata_data,
+            }
+        elif args.output_format == "columnar":
+            exports = {
+                "inflationMetadata": metadata_data,
+                "inflationSeries": encode_inflation_series(serialized_data, args.quantize, args.delta),
+                "inflationIndex": build_inflation_index(serialized_data),
+            }
+        else:
+            exports = {
+                "inflationMetadata": metadata_data,
+                "inflationRates": serialized_data,
+                "inflationIndex": build_inflation_index(serialized_data),
+            }
+        if derived_data is not None and args.output_format != "chunked":
+            exports["inflationDerived"] = encode_derived_series(
+                derived_data,
+                exports["inflationIndex"]["periods"],
+                args.quantize if args.output_format == "columnar" else None,
+            )
+    metrics.count("categories", len(serialized_data))
+    metrics.count("outputsChanged", int(not unchanged))
+
+    if unchanged:
+        print(f"Content hash {content_hash[:12]} unchanged, the outputs are up to date")
+        fetched_at = manifest["fetchedAt"]
+    else:
+        with metrics.stage("write"):
+            write_outputs(args, exports, serialized_data, year_chunks, profile_preset, ecoicop_data, metadata_data)
+        fetched_at = metadata_data["fetchedAt"]
+    # Also when unchanged, as the outputs now match the current settings
+    write_output_manifest(args.manifest, content_hash, outputs, fetched_at, settings, reference_base)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile_out)
+        print(f"Profile written to {args.cprofile_out}")
+
+    if args.metrics_out is not None:
+        metrics.write(args.metrics_out)
+        print(f"Metrics written to {args.metrics_out}")
+
+    if unchanged:
+        sys.exit(EXIT_UNCHANGED)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+"""
+SQLite store of the parsed ČSÚ observations.
+
+Every observation is keyed by its dataset, region, ECOICOP code, period and
+base period (the region is empty for the national data), so
+ingesting overlapping exports upserts instead of duplicating, and a value
+published again with a different number is recorded as a revision. The
+outputs of process.py are generated from the store, so they can be
+regenerated without the XML exports.
+
+This module deliberately does not import process.py (which is usually run
+as __main__), it works with anything that looks like its elements and
+entries.
+"""
+
+import sqlite3
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Collection, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS elements (
+    dataset TEXT NOT NULL,
+    code TEXT NOT NULL,
+    dim TEXT,
+    dim_text TEXT,
+    ciselnik TEXT,
+    text TEXT,
+    PRIMARY KEY (dataset, code)
+);
+-- The primary key also serves the lookups by dataset, region and code
+CREATE TABLE IF NOT EXISTS observations (
+    dataset TEXT NOT NULL,
+    region TEXT NOT NULL DEFAULT '',
+    code TEXT NOT NULL,
+    period_from TEXT NOT NULL,
+    period_to TEXT NOT NULL,
+    base_from TEXT NOT NULL,
+    base_to TEXT NOT NULL,
+    value REAL NOT NULL,
+    source TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (dataset, region, code, period_from, period_to, base_from, base_to)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS observations_period ON observations (period_from, period_to);
+"""
+
+# The rows of a single upsert, compared with the stored ones before they are
+# written. Later rows with the same key replace the earlier ones.
+INCOMING_SCHEMA = """
+CREATE TEMP TABLE IF NOT EXISTS incoming (
+    region TEXT NOT NULL,
+    code TEXT NOT NULL,
+    period_from TEXT NOT NULL,
+    period_to TEXT NOT NULL,
+    base_from TEXT NOT NULL,
+    base_to TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (region, code, period_from, period_to, base_from, base_to)
+) WITHOUT ROWID;
+"""
+
+# The stores before version 3 only held the national CPI
+LEGACY_DATASET = "cpi-ecoicop"
+
+# The primary keys cannot be altered, so the tables are rebuilt. Version 1
+# had no regions, its observations are all national.
+MIGRATIONS = {
+    version: f"""
+ALTER TABLE elements RENAME TO elements_v{version};
+ALTER TABLE observations RENAME TO observations_v{version};
+DROP INDEX IF EXISTS observations_period;
+{SCHEMA}
+INSERT INTO elements (dataset, code, dim, dim_text, ciselnik, text)
+SELECT '{LEGACY_DATASET}', code, dim, dim_text, ciselnik, text FROM elements_v{version};
+INSERT INTO observations
+    (dataset, region, code, period_from, period_to, base_from, base_to, value, source, updated_at)
+SELECT '{LEGACY_DATASET}', {region}, code, period_from, period_to, base_from, base_to, value, source, updated_at
+FROM observations_v{version};
+DROP TABLE elements_v{version};
+DROP TABLE observations_v{version};
+"""
+    for version, region in ((1, "''"), (2, "region"))
+}
+
+# (region, code, period_from, period_to, base_from, base_to, value), the
+# dates are ISO strings, as the same few dates repeat for every code
+ObservationRow = Tuple[str, str, str, str, str, str, float]
+
+# (region, code, period_from, period_to) of an observation
+ObservationKey = Tuple[str, str, str, str]
+
+
+@dataclass
+class UpsertStats:
+    inserted: int = 0
+    revised: int = 0
+    unchanged: int = 0
+    # The inserted and revised observations, sorted
+    changed: List[ObservationKey] = field(default_factory=list)
+
+
+class ObservationStore:
+
+    def __init__(self, path: Path):
+        # ":memory:" keeps the store for the lifetime of the object only
+        if str(path) != ":memory:":
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION) and version not in MIGRATIONS:
+            raise ValueError(f"{path} has schema version {version}, expected {SCHEMA_VERSION}")
+        # executescript commits on its own, so the migration is wrapped in an
+        # explicit transaction
+        script = MIGRATIONS.get(version, SCHEMA)
+        self.connection.executescript(
+            f"BEGIN; {script}; PRAGMA user_version = {SCHEMA_VERSION}; COMMIT;"
+        )
+
+    def __enter__(self) -> "ObservationStore":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def upsert(self, entries: Mapping[object, Sequence[object]], source: str, dataset: str) -> UpsertStats:
+        # Entries grouped by their element, as produced by process.py, of the
+        # dataset with the given id. Later calls win, so the exports should
+        # be upserted oldest first. The rows are compared with the stored
+        # ones by their primary key, so the cost does not grow with the store.
+        updated_at = datetime.now(timezone.utc).isoformat()
+        count = sum(len(element_entries) for element_entries in entries.values())
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO elements (dataset, code, dim, dim_text, ciselnik, text) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dataset, code) DO UPDATE SET "
+                "dim = excluded.dim, dim_text = excluded.dim_text, ciselnik = excluded.ciselnik, text = excluded.text",
+                [
+                    (dataset, element.kod, element.dim, element.dimText, element.ciselnik, element.text)
+                    for element in entries
+                ],
+            )
+
+            self.connection.execute(INCOMING_SCHEMA)
+            self.connection.execute("DELETE FROM incoming")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO incoming VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        entry.region,
+                        element.kod,
+                        entry.time.casOd.isoformat(),
+                        entry.time.casDo.isoformat(),
+                        entry.time.bazOd.isoformat(),
+                        entry.time.bazDo.isoformat(),
+                        entry.value,
+                    )
+                    for element, element_entries in entries.items()
+                    for entry in element_entries
+                ),
+            )
+            changed = self.connection.execute(
+                "SELECT i.region, i.code, i.period_from, i.period_to, o.value IS NULL FROM incoming AS i "
+                "LEFT JOIN observations AS o ON o.dataset = ? AND o.region = i.region AND o.code = i.code "
+                "AND o.period_from = i.period_from AND o.period_to = i.period_to "
+                "AND o.base_from = i.base_from AND o.base_to = i.base_to "
+                "WHERE o.value IS NULL OR o.value != i.value "
+                "ORDER BY i.region, i.code, i.period_from, i.period_to",
+                (dataset,),
+            ).fetchall()
+            # WHERE true keeps the ON CONFLICT from being parsed as a join
+            # constraint
+            self.connection.execute(
+                "INSERT INTO observations "
+                "(dataset, region, code, period_from, period_to, base_from, base_to, value, source, updated_at) "
+                "SELECT ?, region, code, period_from, period_to, base_from, base_to, value, ?, ? "
+                "FROM incoming WHERE true "
+                "ON CONFLICT (dataset, region, code, period_from, period_to, base_from, base_to) DO UPDATE SET "
+                "value = excluded.value, source = excluded.source, updated_at = excluded.updated_at "
+                "WHERE value != excluded.value",
+                (dataset, source, updated_at),
+            )
+            self.connection.execute("DELETE FROM incoming")
+        inserted = sum(is_new for *_, is_new in changed)
+        return UpsertStats(
+            inserted=inserted,
+            revised=len(changed) - inserted,
+            unchanged=count - len(changed),
+            changed=list(dict.fromkeys(tuple(row[:4]) for row in changed)),
+        )
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+
+    def elements(self, dataset: str) -> Iterator[Tuple[str, str, str, str, str]]:
+        # (code, dim, dimText, ciselnik, text) of the dataset sorted by code
+        return self.connection.execute(
+            "SELECT code, dim, dim_text, ciselnik, text FROM elements WHERE dataset = ? ORDER BY code", (dataset,)
+        )
+
+    def observations(self, dataset: str, region: Optional[str] = None,
+                     periods: Optional[Collection[str]] = None) -> Iterator[ObservationRow]:
+        # Of the dataset, only of the region if given ("" is national) and
+        # only of the periods starting on the given ISO dates if given,
+        # sorted by region, code, period and base period
+        query = (
+            "SELECT region, code, period_from, period_to, base_from, base_to, value FROM observations "
+            "WHERE dataset = ?"
+        )
+        parameters = [dataset]
+        if region is not None:
+            query += " AND region = ?"
+            parameters.append(region)
+        if periods is not None:
+            query += f" AND period_from IN ({', '.join('?' * len(periods))})"
+            parameters.extend(periods)
+        return self.connection.execute(
+            query + " ORDER BY region, code, period_from, period_to, base_from, base_to", parameters
+        )
@@ -0,0 +1,192 @@
+#! /usr/bin/env python3
+"""
+Generates synthetic ČSÚ-like exports and a matching consumer basket.
+
+The exports follow the structure of the real ones (metaSlovnik with
+vecneUpresneni/element and obdobi/cas, then data/udaj), so they go through
+the same code paths in process.py. The ECOICOP levels used by the
+categories are taken from the real basket, so that the coverage check
+passes. Deeper levels and regions are synthesized to reach the requested
+size.
+"""
+
+import argparse
+import calendar
+import csv
+import random
+
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, List
+from xml.sax.saxutils import escape
+
+from datasets import CPI_ECOICOP
+
+XML_NAMESPACE = "http://vdb.czso.cz/xml/export"
+
+DEFAULT_BASKET = Path(__file__).absolute().parent / "spot_kos2024.csv"
+
+# The exports have the structure of CEN082A, but with a region dimension
+DATASET = replace(CPI_ECOICOP, id="synthetic", region_dimension="UZEMI")
+
+
+@dataclass
+class SyntheticConfig:
+    start_year: int = 2018
+    years: int = 7
+    # Number of ECOICOP levels below the three-digit groups
+    extra_depth: int = 0
+    # Number of children of every synthesized node
+    branching: int = 3
+    # Number of territories, the first one is the whole country
+    regions: int = 1
+    seed: int = 0
+
+
+def _synthesize_codes(config: SyntheticConfig) -> Dict[str, str]:
+    # ECOICOP code -> name. The two and three digit codes are real, the
+    # deeper ones are made up.
+    codes = {}
+    with DEFAULT_BASKET.open() as f:
+        f.readline()  # Skip the header
+        for row in csv.reader(f):
+            code = row[0].replace(".", "").replace("E", "")
+            if code != "00" and len(code) <= 3:
+                codes[code] = row[1]
+
+    level = [code for code in codes if len(code) == 3]
+    for _ in range(config.extra_depth):
+        next_level = []
+        for parent in level:
+            for i in range(1, config.branching + 1):
+                code = f"{parent}{i}"
+                codes[code] = f"Synthetic {code}"
+                next_level.append(code)
+        level = next_level
+    return codes
+
+
+def _synthesize_weights(codes: List[str], rng: random.Random) -> Dict[str, float]:
+    # Weights in per mille, every parent is split randomly among its
+    # children, so that the weights are consistent across the levels
+    weights = {"00": 1000.0}
+    children = {}
+    for code in sorted(codes, key=len):
+        parent = "00" if len(code) == 2 else code[:-1]
+        children.setdefault(parent, []).append(code)
+
+    def split(parent: str):
+        shares = [rng.uniform(0.5, 1.5) for _ in children.get(parent, [])]
+        for child, share in zip(children.get(parent, []), shares):
+            weights[child] = weights[parent] * share / sum(shares)
+            split(child)
+
+    split("00")
+    return weights
+
+
+def write_basket(path: Path, codes: Dict[str, str], weights: Dict[str, float]):
+    with path.open("w", newline="") as f:
+        f.write("ECOICOP,NAZEV,MĚRNÁ JEDNOTKA,,VÁHA v ‰\n")
+        writer = csv.writer(f)
+        writer.writerow(["E00", "ÚHRN", " ", " ", f"{weights['00']:.6f}"])
+        for code in sorted(codes):
+            formatted = f"E{code[:2]}" if len(code) == 2 else f"E{code[:2]}.{code[2:]}"
+            writer.writerow([formatted, codes[code], " ", " ", f"{weights[code]:.6f}"])
+
+
+def write_export(path: Path, year: int, codes: Dict[str, str], config: SyntheticConfig, rng: random.Random):
+    # Written line by line, so that even huge exports do not need much memory
+    with path.open("w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<vdbexport xmlns="{XML_NAMESPACE}">\n<metaSlovnik>\n<vecneUpresneni>\n')
+        # The first territory is the whole country, like in the real
+        # regional tables
+        f.write(
+            f'<element ID="R0"><dim>UZEMI</dim><dimText>Území</dimText><ciselnik>97</ciselnik>'
+            f'<kod>{DATASET.national_region}</kod><text>Česko</text></element>\n'
+        )
+        for region in range(1, config.regions):
+            f.write(
+                f'<element ID="R{region}"><dim>UZEMI</dim><dimText>Území</dimText><ciselnik>100</ciselnik>'
+                f'<kod>R{region}</kod><text>Region {region}</text></element>\n'
+            )
+        code_ids = {}
+        for i, (code, name) in enumerate(sorted(codes.items())):
+            code_ids[code] = f"E{i}"
+            f.write(
+                f'<element ID="E{i}"><dim>ECOICOP</dim><dimText>ECOICOP</dimText><ciselnik>5801</ciselnik>'
+                f'<kod>{code}</kod><text>{escape(name)}</text></element>\n'
+            )
+        f.write('</vecneUpresneni>\n<obdobi>\n')
+        time_ids = []
+        for month in range(1, 13):
+            last_day = calendar.monthrange(year, month)[1]
+            time_ids.append(f"T{month}")
+            f.write(
+                f'<cas ID="T{month}"><casOd>{year}-{month:02d}-01</casOd><casDo>{year}-{month:02d}-{last_day}</casDo>'
+                f'<bazOd>2015-01-01</bazOd><bazDo>2015-12-31</bazDo></cas>\n'
+            )
+        # The real exports also contain yearly averages, which process.py skips
+        time_ids.append("TY")
+        f.write(
+            f'<cas ID="TY"><casOd>{year}-01-01</casOd><casDo>{year}-12-31</casDo>'
+            f'<bazOd>2015-01-01</bazOd><bazDo>2015-12-31</bazDo></cas>\n'
+        )
+        f.write('</obdobi>\n</metaSlovnik>\n<data>\n')
+        for region in range(config.regions):
+            for code in sorted(codes):
+                level = 100 + (year - 2015) * 2.5
+                for time_id in time_ids:
+                    value = round(level + rng.uniform(-5, 5), 1)
+                    f.write(
+                        f'<udaj><hod>{value}</hod><cas>{time_id}</cas>'
+                        f'<vec>R{region}</vec><vec>{code_ids[code]}</vec></udaj>\n'
+                    )
+        f.write('</data>\n</vdbexport>\n')
+
+
+def generate(output_dir: Path, config: SyntheticConfig) -> List[Path]:
+    # Returns the paths of the exports, the basket is written to basket.csv
+    rng = random.Random(config.seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    codes = _synthesize_codes(config)
+    write_basket(output_dir / "basket.csv", codes, _synthesize_weights(list(codes), rng))
+
+    exports = []
+    for year in range(config.start_year, config.start_year + config.years):
+        path = output_dir / f"eucoicop_{year}.xml"
+        write_export(path, year, codes, config, rng)
+        exports.append(path)
+    return exports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic ČSÚ exports and a matching basket.")
+    parser.add_argument("output_dir", type=Path, help="Directory to write the files to")
+    parser.add_argument("--start-year", type=int, default=SyntheticConfig.start_year)
+    parser.add_argument("--years", type=int, default=SyntheticConfig.years, help="Number of years, one export each")
+    parser.add_argument(
+        "--extra-depth", type=int, default=SyntheticConfig.extra_depth,
+        help="Number of synthesized ECOICOP levels below the three-digit groups"
+    )
+    parser.add_argument("--branching", type=int, default=SyntheticConfig.branching)
+    parser.add_argument("--regions", type=int, default=SyntheticConfig.regions)
+    parser.add_argument("--seed", type=int, default=SyntheticConfig.seed)
+    args = parser.parse_args()
+
+    config = SyntheticConfig(
+        start_year=args.start_year,
+        years=args.years,
+        extra_depth=args.extra_depth,
+        branching=args.branching,
+        regions=args.regions,
+        seed=args.seed,
+    )
+    for path in generate(args.output_dir, config):
+        print(f"Written {path}")
+
+
+if __name__ == "__main__":
+    main()
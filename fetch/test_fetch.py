@@ -0,0 +1,262 @@
+import http.server
+import re
+import threading
+import time
+import types
+import urllib.parse
+
+import pytest
+import requests
+
+import fetch
+
+YEARS = list(range(2018, 2024))
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    # Serves every year of the export endpoint, see StandInServer
+
+    def do_GET(self):
+        server = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        year = int(re.search(r"-(\d{4})_", query["evo"][0]).group(1))
+        with server.lock:
+            server.requests.append((year, dict(self.headers)))
+            failures = server.failures.get(year)
+            failure = failures.pop(0) if failures else None
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            self._respond(year, failure)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _respond(self, year, failure):
+        body = self.server.body(year)
+        etag = f'"{len(body)}-{hash(body)}"'
+        if isinstance(failure, int):
+            self.send_error(failure)
+            return
+        if self.server.etags and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.etags:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if failure == "truncate":
+            # The connection closes before the announced length
+            self.wfile.write(body[:len(body) // 2])
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    # Local stand-in for the ČSÚ export endpoint. failures maps a year to the
+    # outcomes of its next requests, an HTTP status or "truncate" for a body
+    # cut short, after them the year is served normally.
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.failures = {}
+        self.bodies = {}
+        self.etags = True
+        self.delay = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/xmlexp"
+
+    def body(self, year: int) -> bytes:
+        return self.bodies.get(year, f"<export year='{year}'/>\n".encode() * 10000)
+
+    def requested_years(self):
+        return [year for year, _ in self.requests]
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # The backoff delays, recorded instead of slept
+    sleeps = []
+    monkeypatch.setattr(fetch, "time", types.SimpleNamespace(sleep=sleeps.append))
+    return sleeps
+
+
+def _downloader(server, **kwargs):
+    return fetch.CSUDownloader(base_url=server.url, backoff=0.5, timeout=10, **kwargs)
+
+
+def test_downloads_years_concurrently(server, tmp_path):
+    server.delay = 0.2
+    downloader = _downloader(server, max_workers=3)
+
+    results = downloader.download_years(YEARS, str(tmp_path / "eucoicop_{year}.xml"))
+
+    assert [result.year for result in results] == YEARS
+    assert all(result.ok for result in results)
+    assert server.max_in_flight == 3
+    for year in YEARS:
+        assert (tmp_path / f"eucoicop_{year}.xml").read_bytes() == server.body(year)
+
+
+def test_retries_transient_failures_with_backoff(server, sleeps):
+    server.failures = {2019: [503, 429], 2020: ["truncate", 500]}
+    downloader = _downloader(server, max_workers=2, retries=3)
+
+    results = downloader.fetch_years([2019, 2020])
+
+    assert [result.content for result in results] == [server.body(2019), server.body(2020)]
+    assert sorted(server.requested_years()) == [2019] * 3 + [2020] * 3
+    assert sorted(sleeps) == [0.5, 0.5, 1.0, 1.0]
+
+
+def test_gives_up_after_the_retries(server, sleeps):
+    server.failures = {2019: [503] * 3}
+    downloader = _downloader(server, retries=2)
+
+    [result] = downloader.fetch_years([2019])
+
+    assert isinstance(result.error, requests.HTTPError)
+    assert result.error.response.status_code == 503
+    assert server.requested_years() == [2019] * 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_reports_a_missing_year_without_retrying(server, tmp_path, sleeps):
+    server.failures = {2020: [404]}
+    downloader = _downloader(server, max_workers=2)
+
+    results = downloader.download_years([2019, 2020, 2021], str(tmp_path / "eucoicop_{year}.xml"))
+
+    assert [result.ok for result in results] == [True, False, True]
+    assert results[1].error.response.status_code == 404
+    assert server.requested_years().count(2020) == 1
+    assert not (tmp_path / "eucoicop_2020.xml").exists()
+    assert sleeps == []
+
+
+def test_closes_the_failed_responses(server, sleeps, monkeypatch):
+    server.failures = {2019: [503, "truncate", 404]}
+    downloader = _downloader(server)
+    responses = []
+    get = downloader.session.get
+
+    def recording_get(*args, **kwargs):
+        response = get(*args, **kwargs)
+        responses.append(response)
+        return response
+
+    monkeypatch.setattr(downloader.session, "get", recording_get)
+
+    [result] = downloader.fetch_years([2019])
+
+    assert result.error.response.status_code == 404
+    assert len(responses) == 3
+    assert all(response.raw.closed for response in responses)
+
+
+def _cached_objects(cache):
+    return sorted(path.name for path in cache.objects_dir.iterdir() if not path.name.startswith("."))
+
+
+def test_serves_a_closed_year_from_the_cache(server, tmp_path):
+    cache = fetch.DownloadCache(tmp_path / "cache")
+    first = _downloader(server, cache=cache).fetch_price_data(2018)
+    second = _downloader(server, cache=cache).fetch_price_data(2018)
+
+    assert first.cache_status == fetch.DownloadCache.STATUS_MISS
+    assert second.cache_status == fetch.DownloadCache.STATUS_HIT
+    assert second.content == first.content == server.body(2018)
+    assert server.requested_years() == [2018]
+
+
+def test_refresh_revalidates_a_closed_year(server, tmp_path):
+    cache = fetch.DownloadCache(tmp_path / "cache")
+    _downloader(server, cache=cache).fetch_price_data(2018)
+    result = _downloader(server, cache=cache, refresh=True).fetch_price_data(2018)
+
+    assert result.cache_status == fetch.DownloadCache.STATUS_REVALIDATED
+    assert result.content == server.body(2018)
+    assert "If-None-Match" in server.requests[-1][1]
+
+    # Without validators, the hash of the new body tells it did not change
+    server.etags = False
+    result = _downloader(server, cache=cache, refresh=True).fetch_price_data(2018)
+    assert result.cache_status == fetch.DownloadCache.STATUS_UNCHANGED
+
+
+def test_a_changed_body_replaces_the_cached_one(server, tmp_path):
+    cache = fetch.DownloadCache(tmp_path / "cache")
+    _downloader(server, cache=cache).download_years([2018, 2019], str(tmp_path / "eucoicop_{year}.xml"))
+    objects = _cached_objects(cache)
+    assert len(objects) == 2
+
+    server.bodies[2019] = b"<export revised='1'/>\n" * 10000
+    [result] = _downloader(server, cache=cache, refresh=True).download_years(
+        [2019], str(tmp_path / "eucoicop_{year}.xml")
+    )
+
+    assert result.cache_status == fetch.DownloadCache.STATUS_MISS
+    assert (tmp_path / "eucoicop_2019.xml").read_bytes() == server.bodies[2019]
+    # put deleted the superseded body, the one of 2018 stays
+    new_objects = _cached_objects(cache)
+    assert len(new_objects) == 2
+    assert len(set(objects) & set(new_objects)) == 1
+
+
+def test_put_keeps_the_objects_other_entries_use(tmp_path):
+    cache = fetch.DownloadCache(tmp_path / "cache")
+    for sha256 in ("a" * 64, "b" * 64):
+        (cache.objects_dir / sha256).write_bytes(sha256.encode())
+
+    def entry(sha256):
+        return fetch.CacheEntry(year=2018, version="v", sha256=sha256, fetched_at="2025-01-01T00:00:00+00:00")
+
+    cache.put("first", entry("a" * 64))
+    cache.put("second", entry("a" * 64))
+    cache.put("first", entry("b" * 64))
+    assert _cached_objects(cache) == ["a" * 64, "b" * 64]
+
+    cache.put("second", entry("b" * 64))
+    assert _cached_objects(cache) == ["b" * 64]
+
+
+def test_deletes_objects_only_while_no_other_process_uses_the_cache(tmp_path):
+    cache = fetch.DownloadCache(tmp_path / "cache")
+    for sha256 in ("a" * 64, "b" * 64):
+        (cache.objects_dir / sha256).write_bytes(sha256.encode())
+    cache.put("key", fetch.CacheEntry(year=2018, version="v", sha256="a" * 64, fetched_at="2025-01-01T00:00:00+00:00"))
+
+    # Another process, e.g. the watch daemon, may be downloading into it
+    other = fetch.DownloadCache(tmp_path / "cache")
+    cache.put("key", fetch.CacheEntry(year=2018, version="v", sha256="b" * 64, fetched_at="2025-01-02T00:00:00+00:00"))
+    assert cache.prune() is None
+    assert _cached_objects(cache) == ["a" * 64, "b" * 64]
+
+    other.close()
+    assert cache.prune() == 1
+    assert _cached_objects(cache) == ["b" * 64]
@@ -0,0 +1,83 @@
+import math
+import random
+
+import numpy as np
+
+import process
+from personal_inflation import PersonalInflationEngine, Profile
+
+YEARS = [2019, 2020, 2021, 2022]
+
+
+def _serialized_data():
+    # Index levels from 2019-01 to 2021-05, so that 2021 is a partial year.
+    # "services" misses 2020-03, which spoils its 2020.
+    rng = random.Random(1)
+    periods = [f"{year}-{month:02d}" for year in (2019, 2020, 2021) for month in range(1, 13)][:29]
+    data = []
+    for category_id in ("food", "energy", "services"):
+        level = 100.0
+        rates = {}
+        for period in periods:
+            level *= 1 + rng.uniform(-0.01, 0.03)
+            rates[period] = level
+        data.append({"id": category_id, "name": category_id, "description": "", "rates": rates})
+    del data[2]["rates"]["2020-03"]
+    return data
+
+
+def _front_end_rate(data, profile, year):
+    # useInflationCalculator evaluated straight from the rates, see the
+    # formula in personal_inflation.py
+    rates = {category["id"]: category["rates"] for category in data}
+    if any(category_id not in rates for category_id, _ in profile.categories):
+        return math.nan
+
+    def average_spend(year):
+        months = sorted({period for category in data for period in category["rates"] if period.startswith(f"{year}-")})
+        total = 0.0
+        for category_id, amount in profile.categories:
+            values = [rates[category_id].get(month) for month in months]
+            if None in values:
+                return math.nan, len(months)
+            total += amount * sum(values)
+        return (total / len(months) if months else math.nan), len(months)
+
+    average, months = average_spend(year)
+    previous_average, previous_months = average_spend(year - 1)
+    if previous_months != 12 or months == 0:
+        return math.nan
+    return ((average / previous_average) ** (12 / months) - 1) * 100
+
+
+def test_engine_matches_the_front_end_formula():
+    data = _serialized_data()
+    profiles = [
+        Profile("basic", [("food", 5000.0), ("energy", 2000.0)]),
+        Profile("repeated", [("food", 1000.0), ("energy", 500.0), ("food", 1500.0)]),
+        Profile("services", [("services", 3000.0), ("food", 1000.0)]),
+        # Listed with nothing spent still spoils the year, as in the calculator
+        Profile("unused services", [("food", 1000.0), ("services", 0.0)]),
+        Profile("unknown", [("food", 1000.0), ("travel", 100.0)]),
+    ]
+    engine = PersonalInflationEngine(process.build_inflation_index(data))
+
+    rates = engine.compute(engine.profile_matrix(profiles), YEARS)
+
+    expected = np.array([[_front_end_rate(data, profile, year) for year in YEARS] for profile in profiles])
+    np.testing.assert_allclose(rates, expected, rtol=1e-12, equal_nan=True)
+    # Only the complete 2020 and the partial 2021 after it have a rate
+    assert np.isfinite(rates[0]).tolist() == [False, True, True, False]
+    assert np.isnan(rates[2:]).all()
+
+
+def test_partial_years_are_reported_as_such():
+    engine = PersonalInflationEngine(process.build_inflation_index(_serialized_data()))
+
+    periods = engine.year_periods(YEARS)
+
+    assert [(period.from_period, period.to_period) for period in periods] == [
+        ("2018-12", "2019-12"), ("2020-01", "2020-12"), ("2021-01", "2021-05"), ("2021-12", "2022-12"),
+    ]
+    assert [period.is_complete for period in periods] == [False, True, False, False]
+    assert [period.is_last_complete for period in periods] == [False, True, False, False]
@@ -0,0 +1,76 @@
+import argparse
+from datetime import datetime
+
+import pytest
+import requests
+
+import pipeline
+from datasets import CPI_ECOICOP
+
+
+def _args(**kwargs):
+    return argparse.Namespace(**{
+        "interval": 600.0,
+        "idle_interval": 6 * 3600.0,
+        "publication_day": 8,
+        "jitter": 0.0,
+        "version": None,
+        **kwargs,
+    })
+
+
+def test_expected_month_crosses_the_year_boundary():
+    assert pipeline.expected_month([], datetime(2026, 1, 5)) == (2025, 12)
+    assert pipeline.expected_month([], datetime(2026, 3, 5)) == (2026, 2)
+    assert pipeline.expected_month(["2025-11", "2025-12"], datetime(2026, 1, 5)) == (2026, 1)
+    assert pipeline.expected_month(["2025-11"], datetime(2026, 1, 5)) == (2025, 12)
+
+
+@pytest.mark.parametrize("periods, now, delay", [
+    # December is due in January, January in February
+    (["2025-11"], datetime(2025, 12, 20), 6 * 3600.0),
+    (["2025-11"], datetime(2026, 1, 7, 23), 3600.0),
+    (["2025-11"], datetime(2026, 1, 9), 600.0),
+    (["2025-12"], datetime(2026, 1, 20), 6 * 3600.0),
+    (["2025-12"], datetime(2026, 2, 8), 600.0),
+])
+def test_next_check_delay_around_the_year_boundary(periods, now, delay):
+    status = pipeline.WatchStatus(dataset=CPI_ECOICOP.id, periods=periods)
+    assert pipeline.next_check_delay(status, now, _args()) == pytest.approx(delay)
+
+
+def test_next_check_delay_backs_off_after_failures():
+    status = pipeline.WatchStatus(dataset=CPI_ECOICOP.id, periods=["2025-12"], failures=3)
+    assert pipeline.next_check_delay(status, datetime(2026, 1, 20), _args()) == 4800.0
+
+
+class MissingExportDownloader:
+    # Answers every poll with a 404, as ČSÚ does for a year with no data yet
+    dataset = CPI_ECOICOP
+
+    def __init__(self):
+        self.years = []
+
+    def fetch_price_data(self, year, version=None):
+        self.years.append(year)
+        response = requests.Response()
+        response.status_code = 404
+        raise requests.HTTPError(f"404 for {year}", response=response)
+
+
+def test_a_missing_export_of_the_new_year_is_no_failure():
+    year = datetime.now().year
+    status = pipeline.WatchStatus(dataset=CPI_ECOICOP.id, periods=[f"{year - 1}-11", f"{year - 1}-12"])
+    downloader = MissingExportDownloader()
+
+    assert not pipeline.check_for_new_data(downloader, status, _args(), [])
+    assert downloader.years == [year]
+    assert status.periods == [f"{year - 1}-11", f"{year - 1}-12"]
+
+
+def test_a_missing_export_of_a_seen_year_is_a_failure():
+    year = datetime.now().year
+    status = pipeline.WatchStatus(dataset=CPI_ECOICOP.id, periods=[f"{year - 1}-12", f"{year}-01"])
+
+    with pytest.raises(requests.HTTPError):
+        pipeline.check_for_new_data(MissingExportDownloader(), status, _args(), [])
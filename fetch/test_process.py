@@ -0,0 +1,288 @@
+import calendar
+import json
+import random
+
+from datetime import date
+
+import pytest
+
+import process
+import synthetic
+
+BASE_2015 = process.BasePeriod(date(2015, 1, 1), date(2015, 12, 31))
+BASE_2025 = process.BasePeriod(date(2025, 1, 1), date(2025, 12, 31))
+
+
+def _run(tmp_path, name, input_files, *extra):
+    # Runs process.py into tmp_path / name and returns the generated exports
+    output_dir = tmp_path / name
+    process.main([
+        "--store", str(output_dir / "store.sqlite"),
+        "--basket-csv", str(tmp_path / "data" / "basket.csv"),
+        "--output-file", str(output_dir / "rates.ts"),
+        "--chunks-dir", str(output_dir / "rates"),
+        "--ecoicop-dir", str(output_dir / "ecoicop"),
+        "--manifest", str(output_dir / "outputs.json"),
+        "--no-cache",
+        *extra,
+        *map(str, input_files),
+    ])
+    exports = process.read_generated_ts(output_dir / "rates.ts")
+    del exports["inflationMetadata"]
+    return exports, process.read_ecoicop_chunks(output_dir / "ecoicop")
+
+
+def test_incremental_run_matches_a_full_one(tmp_path, capsys):
+    exports = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=3, extra_depth=1))
+    options = ["--output-format", "chunked", "--quantize", "2", "--delta", "--derived-series"]
+
+    _run(tmp_path, "incremental", exports[:2], *options)
+    capsys.readouterr()
+    incremental = _run(tmp_path, "incremental", exports[2:], "--incremental", *options)
+    output = capsys.readouterr().out
+    assert "Recomputing the 12 changed periods" in output
+    assert "New period 2020-12 (17 categories)" in output
+
+    full = _run(tmp_path, "full", exports, *options)
+    assert incremental == full
+    assert (
+        process.read_year_chunks(tmp_path / "incremental" / "rates")
+        == process.read_year_chunks(tmp_path / "full" / "rates")
+    )
+
+
+def test_incremental_run_needs_matching_outputs(tmp_path, capsys):
+    exports = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=2))
+
+    _run(tmp_path, "run", exports[:1], "--output-format", "columnar", "--quantize", "2")
+    capsys.readouterr()
+    _run(tmp_path, "run", exports[1:], "--incremental", "--output-format", "columnar", "--quantize", "3")
+    output = capsys.readouterr().out
+    assert "No incremental update, the last outputs were generated with other settings" in output
+    assert "Recomputing" not in output
+
+
+def test_cache_hits_report_the_same_file_metrics(tmp_path):
+    exports = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=2))
+    reports = []
+    for name in ("miss", "hit"):
+        (tmp_path / name).mkdir()
+        process.main([
+            "--store", ":memory:",
+            "--basket-csv", str(tmp_path / "data" / "basket.csv"),
+            "--output-file", str(tmp_path / name / "rates.ts"),
+            "--manifest", str(tmp_path / name / "outputs.json"),
+            "--cache-dir", str(tmp_path / "cache"),
+            "--metrics-out", str(tmp_path / name / "metrics.json"),
+            *map(str, exports),
+        ])
+        reports.append(json.loads((tmp_path / name / "metrics.json").read_text()))
+
+    miss, hit = reports
+    assert [file["cacheHit"] for file in miss["files"] + hit["files"]] == [False] * 2 + [True] * 2
+    for missed, cached in zip(miss["files"], hit["files"]):
+        assert set(missed) <= set(cached)
+        assert cached["coverageCheckSeconds"] == 0.0
+        assert cached["entries"] == missed["entries"]
+    assert all("maxRssGrowthMb" in stage for stage in hit["stages"].values())
+
+
+def _series(code, base, values, region=""):
+    # Entries of the code in the base, values maps "YYYY-MM" to the index
+    element = process.Element(dim="ECOICOP", dimText="ECOICOP", ciselnik="5", kod=code, text=code)
+    entries = []
+    for period, value in values.items():
+        year, month = map(int, period.split("-"))
+        time = process.validate_time(process.Time(
+            casOd=date(year, month, 1),
+            casDo=date(year, month, calendar.monthrange(year, month)[1]),
+            bazOd=base.start,
+            bazDo=base.end,
+        ))
+        entries.append(process.Entry(value=value, time=time, element=element, region=region))
+    return element, entries
+
+
+def _rebased_values(entries):
+    return {
+        (element.kod, f"{entry.time.casOd:%Y-%m}"): entry.value
+        for element, element_entries in entries.items()
+        for entry in element_entries
+    }
+
+
+# Published in the 2015 base up to 2025-01, from 2025-01 on in the 2025 base,
+# so that 2025-01 is in both
+OLD_01 = {"2024-11": 126.1, "2024-12": 127.4, "2025-01": 130.0}
+NEW_01 = {"2025-01": 100.0, "2025-02": 100.8, "2025-03": 101.3}
+
+
+def test_link_factor_comes_from_the_overlapping_month():
+    element_old, old = _series("01", BASE_2015, OLD_01)
+    _, new = _series("01", BASE_2025, NEW_01)
+    entries = {element_old: old + new}
+
+    factors = process.compute_link_factors(entries, BASE_2025)
+    assert factors[("", "01", BASE_2025)] == 1.0
+    assert factors[("", "01", BASE_2015)] == pytest.approx(100.0 / 130.0)
+
+    factors = process.compute_link_factors(entries, BASE_2015)
+    assert factors[("", "01", BASE_2025)] == pytest.approx(130.0 / 100.0)
+
+
+def test_rebased_series_are_continuous_across_the_bases():
+    element, old = _series("01", BASE_2015, OLD_01)
+    _, new = _series("01", BASE_2025, NEW_01)
+    # Only published in the old base, it takes over the factor of 01
+    child, child_old = _series("011", BASE_2015, {"2024-12": 140.0, "2025-01": 143.0})
+
+    rebased, reference = process.rebase_entries({element: old + new, child: child_old})
+    assert reference == BASE_2025
+    values = _rebased_values(rebased)
+
+    # Every month once, the overlap from the reference base
+    assert sorted(values) == sorted(
+        [("01", period) for period in {**OLD_01, **NEW_01}] + [("011", "2024-12"), ("011", "2025-01")]
+    )
+    assert values[("01", "2025-01")] == 100.0
+    # The month-on-month changes survive the linking on both sides of the overlap
+    assert values[("01", "2024-12")] / values[("01", "2025-01")] == pytest.approx(127.4 / 130.0)
+    assert values[("01", "2024-11")] / values[("01", "2024-12")] == pytest.approx(126.1 / 127.4)
+    assert values[("01", "2025-02")] / values[("01", "2025-01")] == pytest.approx(100.8 / 100.0)
+    assert values[("011", "2025-01")] == pytest.approx(143.0 * 100.0 / 130.0)
+    assert {entry.time.bazOd for element_entries in rebased.values() for entry in element_entries} == {date(2025, 1, 1)}
+
+
+def test_a_series_that_cannot_be_linked_is_rejected():
+    _, old = _series("01", BASE_2015, {"2024-12": 127.4})
+    element, new = _series("01", BASE_2025, {"2025-01": 100.0})
+
+    with pytest.raises(process.DataValidationError, match="does not overlap"):
+        process.rebase_entries({element: old + new})
+
+
+def test_the_first_matching_vec_wins(tmp_path):
+    export = tmp_path / "eucoicop_2018.xml"
+    export.write_text("""<?xml version="1.0" encoding="UTF-8"?>
+<vdbexport xmlns="http://vdb.czso.cz/xml/export">
+<metaSlovnik><vecneUpresneni>
+<element ID="E0"><dim>ECOICOP</dim><dimText>ECOICOP</dimText><ciselnik>5801</ciselnik><kod>01</kod><text>01</text></element>
+<element ID="E1"><dim>ECOICOP</dim><dimText>ECOICOP</dimText><ciselnik>5801</ciselnik><kod>011</kod><text>011</text></element>
+</vecneUpresneni><obdobi>
+<cas ID="T1"><casOd>2018-01-01</casOd><casDo>2018-01-31</casDo><bazOd>2015-01-01</bazOd><bazDo>2015-12-31</bazDo></cas>
+</obdobi></metaSlovnik>
+<data>
+<udaj><hod>101.5</hod><cas>T1</cas><vec>E1</vec><vec>E0</vec></udaj>
+</data>
+</vdbexport>
+""")
+    [entry] = process.iter_entries(export)
+    assert entry.element.kod == "011"
+    assert entry.value == 101.5
+
+
+def test_the_profile_preset_rejects_a_basket_that_does_not_add_up(tmp_path):
+    synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=1))
+    [vintage] = process.BasketVintages.load_from_specs([str(tmp_path / "data" / "basket.csv")]).vintages
+    preset = process.make_csu_profile_preset(vintage)
+    assert abs(sum(category["amount"] for category in preset) - 50000) < 100
+
+    partial = process.BasketVintage(effective_from=None, basket=process.ConsumerBasket(items=vintage.basket.items[:3]))
+    with pytest.raises(process.DataValidationError, match="add up to 50000"):
+        process.make_csu_profile_preset(partial)
+
+
+def _serialized_data():
+    # Index levels of three categories from 2019-01 to 2021-05, so that 2021
+    # is a partial year. "services" misses 2020-03, which spoils its 2020.
+    rng = random.Random(0)
+    periods = [f"{year}-{month:02d}" for year in (2019, 2020, 2021) for month in range(1, 13)][:29]
+    data = []
+    for category_id in ("food", "energy", "services"):
+        level = 100.0
+        rates = {}
+        for period in periods:
+            level *= 1 + rng.uniform(-0.01, 0.02)
+            rates[period] = round(level, 6)
+        data.append({"id": category_id, "name": category_id.title(), "description": "", "rates": rates})
+    del data[2]["rates"]["2020-03"]
+    return data
+
+
+@pytest.mark.parametrize("decimals, delta", [(None, False), (2, False), (2, True), (0, True)])
+def test_columnar_encoding_round_trips(decimals, delta):
+    data = _serialized_data()
+    series = process.encode_inflation_series(data, decimals, delta)
+    assert len(series["periods"]) == 29
+    assert series["categories"][2]["values"][series["periods"].index("2020-03")] is None
+
+    decoded = process.decode_inflation_series(json.loads(json.dumps(series)))
+    if decimals is None:
+        assert decoded == data
+    else:
+        assert [category["rates"].keys() for category in decoded] == [category["rates"].keys() for category in data]
+        for category, expected in zip(decoded, data):
+            for period, value in expected["rates"].items():
+                assert category["rates"][period] == round(value * 10 ** decimals) / 10 ** decimals
+        assert decoded == process.quantize_rates(data, decimals)
+
+
+@pytest.mark.parametrize("decimals, delta", [(None, False), (2, True)])
+def test_year_chunks_round_trip_with_the_yearly_sums(tmp_path, decimals, delta):
+    data = _serialized_data()
+    chunks = process.build_year_chunks(data, decimals, delta)
+    process.write_year_chunks(tmp_path / "rates", data, chunks)
+
+    assert process.read_year_chunks(tmp_path / "rates") == process.quantize_rates(data, decimals)
+
+    # The sums over the months of every year, None where a month is missing
+    index = process.build_inflation_index(data)
+    assert index["completeYears"] == [2019, 2020]
+    assert index["lastCompleteYear"] == 2020
+    for chunk, summary in zip(chunks, index["years"]):
+        assert (chunk["year"], chunk["months"], chunk["sums"]) == (summary["year"], summary["months"], summary["sums"])
+        for category, total in zip(data, summary["sums"]):
+            values = [category["rates"].get(f"{summary['year']}-{month:02d}") for month in summary["months"]]
+            assert total == (None if None in values else pytest.approx(sum(values)))
+    assert [summary["sums"][2] is None for summary in index["years"]] == [False, True, False]
+
+
+def _naive_derived_series(rates):
+    # compute_derived_series the slow way, every window looked up anew
+    def shifted(period, months):
+        year, month = map(int, period.split("-"))
+        ordinal = year * 12 + month - 1 - months
+        return f"{ordinal // 12}-{ordinal % 12 + 1:02d}"
+
+    def change(value, previous):
+        return None if value is None or not previous else (value / previous - 1) * 100
+
+    def average(period):
+        values = [rates.get(shifted(period, months)) for months in range(12)]
+        return None if None in values else sum(values) / 12
+
+    derived = {"mom": {}, "yoy": {}, "rolling12": {}}
+    for period, value in rates.items():
+        changes = {
+            "mom": change(value, rates.get(shifted(period, 1))),
+            "yoy": change(value, rates.get(shifted(period, 12))),
+            "rolling12": change(average(period), average(shifted(period, 12))),
+        }
+        for name, value_change in changes.items():
+            if value_change is not None:
+                derived[name][period] = value_change
+    return derived
+
+
+def test_derived_series_match_a_naive_recomputation():
+    for category in _serialized_data():
+        derived = process.compute_derived_series(category["rates"])
+        expected = _naive_derived_series(category["rates"])
+        for name in process.DERIVED_SERIES:
+            assert derived[name] == pytest.approx(expected[name], rel=1e-9)
+
+    food, _, services = (process.compute_derived_series(category["rates"]) for category in _serialized_data())
+    assert list(food["rolling12"]) == ["2020-12", "2021-01", "2021-02", "2021-03", "2021-04", "2021-05"]
+    # The gap in 2020-03 leaves out every window that covers it
+    assert "2020-04" not in services["mom"] and "2021-03" not in services["yoy"]
+    assert services["rolling12"] == {}
@@ -0,0 +1,176 @@
+import sqlite3
+
+from dataclasses import replace
+from datetime import date
+
+import process
+import synthetic
+
+from datasets import CPI_ECOICOP
+from store import ObservationStore
+
+# The schema of the version 1 stores, before the regions and datasets
+SCHEMA_V1 = """
+CREATE TABLE elements (
+    code TEXT PRIMARY KEY,
+    dim TEXT,
+    dim_text TEXT,
+    ciselnik TEXT,
+    text TEXT
+);
+CREATE TABLE observations (
+    code TEXT NOT NULL,
+    period_from TEXT NOT NULL,
+    period_to TEXT NOT NULL,
+    base_from TEXT NOT NULL,
+    base_to TEXT NOT NULL,
+    value REAL NOT NULL,
+    source TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (code, period_from, period_to, base_from, base_to)
+) WITHOUT ROWID;
+CREATE INDEX observations_period ON observations (period_from, period_to);
+PRAGMA user_version = 1;
+"""
+
+
+def _write_v1_store(path, entries):
+    connection = sqlite3.connect(str(path))
+    connection.executescript(SCHEMA_V1)
+    with connection:
+        connection.executemany(
+            "INSERT INTO elements VALUES (?, ?, ?, ?, ?)",
+            [(element.kod, element.dim, element.dimText, element.ciselnik, element.text) for element in entries],
+        )
+        connection.executemany(
+            "INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    element.kod,
+                    entry.time.casOd.isoformat(),
+                    entry.time.casDo.isoformat(),
+                    entry.time.bazOd.isoformat(),
+                    entry.time.bazDo.isoformat(),
+                    entry.value,
+                    "v1",
+                    "2024-01-01T00:00:00+00:00",
+                )
+                for element, element_entries in entries.items()
+                for entry in element_entries
+            ],
+        )
+    connection.close()
+
+
+def test_reingesting_into_a_migrated_v1_store_does_not_duplicate(tmp_path):
+    [export] = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=1))
+    entries = process.parse_xml(export, dataset=CPI_ECOICOP)
+    count = sum(len(element_entries) for element_entries in entries.values())
+    _write_v1_store(tmp_path / "store.sqlite", entries)
+
+    with ObservationStore(tmp_path / "store.sqlite") as store:
+        stats = store.upsert(entries, source=export.name, dataset=CPI_ECOICOP.id)
+        assert (stats.inserted, stats.revised, stats.unchanged) == (0, 0, count)
+        assert store.count() == count
+        assert len(list(store.observations(CPI_ECOICOP.id, region=""))) == count
+
+
+def test_datasets_and_regions_are_kept_apart(tmp_path):
+    [export] = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=1, regions=3))
+    entries = process.parse_xml(export, dataset=synthetic.DATASET)
+    regions = {entry.region for element_entries in entries.values() for entry in element_entries}
+    assert regions == {"", "R1", "R2"}
+
+    with ObservationStore(tmp_path / "store.sqlite") as store:
+        store.upsert(entries, source=export.name, dataset=CPI_ECOICOP.id)
+        national = list(store.observations(CPI_ECOICOP.id, region=""))
+        # The same observations of another dataset must not count as revisions
+        stats = store.upsert(entries, source=export.name, dataset=synthetic.DATASET.id)
+        assert stats.revised == 0
+        assert list(store.observations(CPI_ECOICOP.id, region="")) == national
+
+        national_entries = process.load_store_entries(store, CPI_ECOICOP)
+        assert sum(len(element_entries) for element_entries in national_entries.values()) == len(national)
+
+
+def _entry_count(entries):
+    return sum(len(element_entries) for element_entries in entries.values())
+
+
+def test_upsert_counts_new_revised_and_unchanged_observations(tmp_path):
+    first, second = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=2))
+    entries = process.parse_xml(first, dataset=CPI_ECOICOP)
+    count = _entry_count(entries)
+
+    with ObservationStore(tmp_path / "store.sqlite") as store:
+        stats = store.upsert(entries, source=first.name, dataset=CPI_ECOICOP.id)
+        assert (stats.inserted, stats.revised, stats.unchanged) == (count, 0, 0)
+        assert len(stats.changed) == count
+
+        # One value republished with another number, next to a new year
+        element = next(iter(entries))
+        revised = dict(entries)
+        revised[element] = [replace(entries[element][0], value=entries[element][0].value + 1)]
+        new_entries = process.parse_xml(second, dataset=CPI_ECOICOP)
+        stats = store.upsert(revised, source=first.name, dataset=CPI_ECOICOP.id)
+        stats_new = store.upsert(new_entries, source=second.name, dataset=CPI_ECOICOP.id)
+
+        assert (stats.inserted, stats.revised) == (0, 1)
+        assert stats.unchanged == _entry_count(revised) - 1
+        time = entries[element][0].time
+        assert stats.changed == [("", element.kod, time.casOd.isoformat(), time.casDo.isoformat())]
+        assert (stats_new.inserted, stats_new.revised, stats_new.unchanged) == (_entry_count(new_entries), 0, 0)
+        assert store.count() == count + _entry_count(new_entries)
+
+        stats = store.upsert(revised, source=first.name, dataset=CPI_ECOICOP.id)
+        assert (stats.inserted, stats.revised, stats.changed) == (0, 0, [])
+
+
+def test_loads_the_stored_entries(tmp_path):
+    exports = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=2))
+    parsed = [process.parse_xml(export, dataset=CPI_ECOICOP) for export in exports]
+
+    with ObservationStore(tmp_path / "store.sqlite") as store:
+        for export, entries in zip(exports, parsed):
+            store.upsert(entries, source=export.name, dataset=CPI_ECOICOP.id)
+    with ObservationStore(tmp_path / "store.sqlite") as store:
+        loaded = process.load_store_entries(store, CPI_ECOICOP)
+        periods = [parsed[1][element][0].time.casOd.isoformat() for element in list(parsed[1])[:1]]
+        partial = process.load_store_entries(store, CPI_ECOICOP, periods)
+
+    expected = {}
+    for entries in parsed:
+        for element, element_entries in entries.items():
+            expected.setdefault(element, []).extend(element_entries)
+    assert {element: set(element_entries) for element, element_entries in loaded.items()} == {
+        element: set(element_entries) for element, element_entries in expected.items()
+    }
+    assert {entry.time.casOd.isoformat() for element_entries in partial.values() for entry in element_entries} == set(periods)
+
+
+def test_a_period_is_kept_once_per_base_period(tmp_path):
+    [export] = synthetic.generate(tmp_path / "data", synthetic.SyntheticConfig(years=1))
+    entries = process.parse_xml(export, dataset=CPI_ECOICOP)
+    # The same months republished in another base period, as after a rebasing
+    rebased = {
+        element: [
+            replace(entry, value=entry.value / 2, time=replace(
+                entry.time, bazOd=date(2025, 1, 1), bazDo=date(2025, 12, 31)
+            ))
+            for entry in element_entries
+        ]
+        for element, element_entries in entries.items()
+    }
+    count = _entry_count(entries)
+
+    with ObservationStore(tmp_path / "store.sqlite") as store:
+        store.upsert(entries, source=export.name, dataset=CPI_ECOICOP.id)
+        stats = store.upsert(rebased, source="rebased.xml", dataset=CPI_ECOICOP.id)
+        # Another base is a new observation, not a revision of the old one
+        assert (stats.inserted, stats.revised, stats.unchanged) == (count, 0, 0)
+        assert store.count() == 2 * count
+
+        loaded = process.load_store_entries(store, CPI_ECOICOP)
+    bases = {(entry.time.bazOd, entry.time.bazDo) for element_entries in loaded.values() for entry in element_entries}
+    assert len(bases) == 2
+    assert _entry_count(loaded) == 2 * count
@@ -0,0 +1,25 @@
+"""
+Year arguments of the command line tools.
+
+fetch.py, pipeline.py and personal_inflation.py all take years either one
+by one or as inclusive ranges. The parser lives here so that
+personal_inflation.py does not have to import fetch.py and its requests
+dependency.
+"""
+
+import argparse
+from typing import List
+
+
+def parse_years(value: str) -> List[int]:
+    """Parses either a single year or an inclusive range such as 2018-2025."""
+    try:
+        if "-" in value:
+            start, end = value.split("-", 1)
+            years = list(range(int(start), int(end) + 1))
+            if not years:
+                raise ValueError
+            return years
+        return [int(value)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid year or year range: {value}")
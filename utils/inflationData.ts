@@ -0,0 +1,369 @@
+import { ref } from 'vue'
+import type { CategoryDefinition } from '~/types'
+import * as generated from '~/data/inflationRates'
+
+// data/inflationRates.ts is generated by fetch/process.py in one of three
+// formats. The json format exports `inflationRates`, a dict of rates keyed
+// by "YYYY-MM" for every category. The columnar format exports
+// `inflationSeries`, one shared period axis and an array of values per
+// category, optionally quantized and delta-encoded.
+// Both formats come with `inflationIndex`, precomputed yearly aggregates.
+// With --derived-series, they also export `inflationDerived`, the
+// month-over-month, year-over-year and rolling 12-month changes of every
+// category, and the year chunks carry them for their months.
+// The chunked format only exports `inflationChunks`, the categories and the
+// months of every year. The values and aggregates of a year are in
+// public/data/rates and are fetched the first time they are accessed, so
+// the bundle does not grow with the years of data. Until then, the
+// accessors behave as if the year had no data, and they are reactive, so
+// computed values update once it arrives.
+// Everything else should read the data through this module, which hides the
+// difference.
+
+interface GeneratedCategoryRates extends CategoryDefinition {
+  rates: Record<string, number>
+}
+
+interface GeneratedInflationSeries {
+  periods: string[]
+  // Values are integers scaled by this factor, null if not quantized
+  scale: number | null
+  // Values are differences from the previous non-null value
+  delta: boolean
+  categories: (CategoryDefinition & { values: (number | null)[] })[]
+}
+
+export interface YearSummary {
+  year: number
+  // Months of the year with data
+  months: number[]
+  // Sum of every category's values over the months, see getCategoryPosition,
+  // null (NaN) if the category misses some of the months
+  sums: (number | null)[]
+}
+
+interface GeneratedInflationIndex {
+  periods: string[]
+  categories: string[]
+  completeYears: number[]
+  lastCompleteYear: number | null
+  years: YearSummary[]
+}
+
+// mom and yoy: change against the previous month and the same month a year
+// earlier. rolling12: change of the 12-month average against the 12 months
+// before. All in percent, see compute_derived_series in fetch/process.py.
+export type DerivedSeriesKind = 'mom' | 'yoy' | 'rolling12'
+
+const DERIVED_SERIES_KINDS: DerivedSeriesKind[] = ['mom', 'yoy', 'rolling12']
+
+interface GeneratedDerivedSeries {
+  periods: string[]
+  series: DerivedSeriesKind[]
+  categories: ({ id: string } & Record<DerivedSeriesKind, (number | null)[]>)[]
+}
+
+interface GeneratedYearChunkInfo {
+  year: number
+  months: number[]
+  file: string
+  bytes: number
+}
+
+interface GeneratedInflationChunks {
+  categories: CategoryDefinition[]
+  completeYears: number[]
+  lastCompleteYear: number | null
+  // Whether the year chunks carry the derived series
+  derivedSeries?: boolean
+  years: GeneratedYearChunkInfo[]
+}
+
+interface GeneratedYearChunk {
+  year: number
+  months: number[]
+  scale: number | null
+  delta: boolean
+  // Per category, aligned with months
+  values: (number | null)[][]
+  sums: (number | null)[]
+  // Per kind and category, aligned with months
+  derived?: Record<DerivedSeriesKind, (number | null)[][]>
+}
+
+interface CategorySeries extends CategoryDefinition {
+  // Aligned with inflationPeriods, NaN where the period is missing
+  values: number[]
+  // Aligned with inflationPeriods like values, filled in by loadDerived
+  derived: Record<DerivedSeriesKind, number[]>
+}
+
+const data = generated as unknown as {
+  inflationRates?: GeneratedCategoryRates[]
+  inflationSeries?: GeneratedInflationSeries
+  inflationIndex?: GeneratedInflationIndex
+  inflationChunks?: GeneratedInflationChunks
+  inflationDerived?: GeneratedDerivedSeries
+}
+
+const CHUNKS_DIR = 'data/rates/'
+
+const formatPeriod = (year: number, month: number): string => `${year}-${String(month).padStart(2, '0')}`
+
+// Also used for the ECOICOP chunks, see composables/useEcoicopTree.ts
+export const decodeValues = (
+  values: (number | null)[],
+  series: Pick<GeneratedInflationSeries, 'scale' | 'delta'>
+): number[] => {
+  let previous = 0
+  return values.map(value => {
+    if (value === null) return NaN
+    if (series.delta) {
+      previous += value
+      value = previous
+    }
+    return series.scale !== null ? value / series.scale : value
+  })
+}
+
+const emptyDerived = (length: number): Record<DerivedSeriesKind, number[]> => ({
+  mom: new Array<number>(length).fill(NaN),
+  yoy: new Array<number>(length).fill(NaN),
+  rolling12: new Array<number>(length).fill(NaN)
+})
+
+const loadSeries = (): { periods: string[], categories: Omit<CategorySeries, 'derived'>[] } => {
+  if (data.inflationChunks) {
+    // The values are filled in as the year chunks arrive
+    const periods = data.inflationChunks.years.flatMap(info => info.months.map(month => formatPeriod(info.year, month)))
+    return {
+      periods,
+      categories: data.inflationChunks.categories.map(category => ({
+        id: category.id,
+        name: category.name,
+        description: category.description,
+        values: new Array<number>(periods.length).fill(NaN)
+      }))
+    }
+  }
+
+  if (data.inflationSeries) {
+    const series = data.inflationSeries
+    return {
+      periods: series.periods,
+      categories: series.categories.map(category => ({
+        id: category.id,
+        name: category.name,
+        description: category.description,
+        values: decodeValues(category.values, series)
+      }))
+    }
+  }
+
+  const rates = data.inflationRates ?? []
+  // "YYYY-MM" strings sort chronologically
+  const periods = Array.from(new Set(rates.flatMap(category => Object.keys(category.rates)))).sort()
+  return {
+    periods,
+    categories: rates.map(category => ({
+      id: category.id,
+      name: category.name,
+      description: category.description,
+      values: periods.map(period => category.rates[period] ?? NaN)
+    }))
+  }
+}
+
+// Only used for data generated before process.py emitted inflationIndex
+const buildIndex = (periods: string[], categories: CategorySeries[]): GeneratedInflationIndex => {
+  const indicesByYear = new Map<number, number[]>()
+  periods.forEach((period, index) => {
+    const year = parseInt(period.split('-')[0])
+    if (!indicesByYear.has(year)) indicesByYear.set(year, [])
+    indicesByYear.get(year)!.push(index)
+  })
+
+  const years = Array.from(indicesByYear.entries()).map(([year, indices]) => ({
+    year,
+    months: indices.map(index => parseInt(periods[index].split('-')[1])),
+    sums: categories.map(category => indices.reduce((acc, index) => acc + category.values[index], 0))
+  }))
+  const completeYears = years.filter(year => year.months.length === 12).map(year => year.year)
+  return {
+    periods,
+    categories: categories.map(category => category.id),
+    completeYears,
+    lastCompleteYear: completeYears.length > 0 ? Math.max(...completeYears) : (years[0]?.year ?? null),
+    years
+  }
+}
+
+const loadDerived = (periods: string[], series: Omit<CategorySeries, 'derived'>[]): CategorySeries[] => {
+  const categories = series.map(category => ({ ...category, derived: emptyDerived(periods.length) }))
+  const derived = data.inflationDerived
+  if (!derived) return categories
+
+  const positions = new Map(periods.map((period, index) => [period, index]))
+  const derivedById = new Map(derived.categories.map(category => [category.id, category]))
+  categories.forEach(category => {
+    const categoryDerived = derivedById.get(category.id)
+    if (!categoryDerived) return
+    DERIVED_SERIES_KINDS.forEach(kind => {
+      categoryDerived[kind].forEach((value, index) => {
+        const position = positions.get(derived.periods[index])
+        if (value !== null && position !== undefined) category.derived[kind][position] = value
+      })
+    })
+  })
+  return categories
+}
+
+const loadedSeries = loadSeries()
+const periods = loadedSeries.periods
+const categories = loadDerived(periods, loadedSeries.categories)
+const categoriesById = new Map(categories.map(category => [category.id, category]))
+const periodIndices = new Map(periods.map((period, index) => [period, index]))
+
+const yearlyIndex: GeneratedInflationIndex = data.inflationChunks
+  ? {
+      periods,
+      categories: categories.map(category => category.id),
+      completeYears: data.inflationChunks.completeYears,
+      lastCompleteYear: data.inflationChunks.lastCompleteYear,
+      // Added as the year chunks arrive
+      years: []
+    }
+  : data.inflationIndex ?? buildIndex(periods, categories)
+const categoryPositions = new Map(yearlyIndex.categories.map((id, position) => [id, position]))
+const yearSummaries = new Map(yearlyIndex.years.map(summary => [summary.year, summary]))
+
+const chunkInfos = new Map((data.inflationChunks?.years ?? []).map(info => [info.year, info]))
+const chunkRequests = new Map<number, Promise<void>>()
+// Bumped whenever a year chunk arrives. The accessors read it, so that
+// computed values depending on them are re-evaluated.
+const loadedVersion = ref(0)
+
+const applyChunk = (chunk: GeneratedYearChunk) => {
+  const periodIndicesOfYear = chunk.months.map(month => periodIndices.get(formatPeriod(chunk.year, month))!)
+  categories.forEach((category, position) => {
+    decodeValues(chunk.values[position], chunk).forEach((value, monthIndex) => {
+      category.values[periodIndicesOfYear[monthIndex]] = value
+    })
+    if (chunk.derived) {
+      DERIVED_SERIES_KINDS.forEach(kind => {
+        chunk.derived![kind][position].forEach((value, monthIndex) => {
+          category.derived[kind][periodIndicesOfYear[monthIndex]] = value ?? NaN
+        })
+      })
+    }
+  })
+  yearSummaries.set(chunk.year, { year: chunk.year, months: chunk.months, sums: chunk.sums })
+  loadedVersion.value++
+}
+
+// Resolves once the data of the year is available, right away if it is
+// already loaded or the year is not in the data
+export const loadYear = (year: number): Promise<void> => {
+  const info = chunkInfos.get(year)
+  if (!info || yearSummaries.has(year)) return Promise.resolve()
+
+  let request = chunkRequests.get(year)
+  if (!request) {
+    request = $fetch<GeneratedYearChunk>(`${useRuntimeConfig().app.baseURL}${CHUNKS_DIR}${info.file}`)
+      .then(applyChunk)
+      .catch((error) => {
+        // Allow a retry on the next access
+        chunkRequests.delete(year)
+        throw error
+      })
+    chunkRequests.set(year, request)
+  }
+  return request
+}
+
+const requestYear = (year: number) => {
+  // Prerendering has no use for the chunks, the browser loads them
+  if (!import.meta.client || !chunkInfos.has(year) || yearSummaries.has(year)) return
+  loadYear(year).catch(error => console.error(`Could not load the rates of ${year}`, error))
+}
+
+// Sorted "YYYY-MM" keys of all the periods with data
+export const inflationPeriods: readonly string[] = periods
+
+export const inflationCategories: CategoryDefinition[] = categories.map(({ id, name, description }) => ({
+  id,
+  name,
+  description
+}))
+
+export const hasPeriod = (period: string): boolean => periodIndices.has(period)
+
+export const getPeriodIndex = (period: string): number | undefined => periodIndices.get(period)
+
+// Values of the category aligned with inflationPeriods, NaN in the years
+// that are not loaded yet, see loadYear
+export const getCategorySeries = (categoryId: string): readonly number[] | undefined => {
+  void loadedVersion.value
+  return categoriesById.get(categoryId)?.values
+}
+
+export const getRate = (categoryId: string, period: string): number | undefined => {
+  void loadedVersion.value
+  const index = periodIndices.get(period)
+  const series = categoriesById.get(categoryId)
+  if (index === undefined || !series) return undefined
+  const value = series.values[index]
+  if (isNaN(value)) {
+    requestYear(parseInt(period.split('-')[0]))
+    return undefined
+  }
+  return value
+}
+
+// Whether the rates come in year chunks that are loaded on demand, the
+// other formats have the whole history at hand
+export const isChunked: boolean = Boolean(data.inflationChunks)
+
+// Whether process.py exported the derived series, see DerivedSeriesKind
+export const hasDerivedSeries: boolean = Boolean(data.inflationDerived ?? data.inflationChunks?.derivedSeries)
+
+// Derived series of the category aligned with inflationPeriods, NaN where
+// the change cannot be computed or the year is not loaded yet
+export const getDerivedSeries = (categoryId: string, kind: DerivedSeriesKind): readonly number[] | undefined => {
+  void loadedVersion.value
+  return categoriesById.get(categoryId)?.derived[kind]
+}
+
+export const getDerivedValue = (categoryId: string, kind: DerivedSeriesKind, period: string): number | undefined => {
+  void loadedVersion.value
+  const index = periodIndices.get(period)
+  const series = categoriesById.get(categoryId)
+  if (index === undefined || !series) return undefined
+  const value = series.derived[kind][index]
+  if (isNaN(value)) {
+    requestYear(parseInt(period.split('-')[0]))
+    return undefined
+  }
+  return value
+}
+
+// The most recent year with all 12 months, the earliest year if there is none
+export const lastCompleteYear: number | null = yearlyIndex.lastCompleteYear
+
+export const getYearSummary = (year: number): YearSummary | undefined => {
+  void loadedVersion.value
+  const summary = yearSummaries.get(year)
+  if (!summary) requestYear(year)
+  return summary
+}
+
+// Starts loading the most recent complete year and the one before it, which
+// the calculator shows first
+export const prefetchLastCompleteYear = () => {
+  if (lastCompleteYear === null) return
+  requestYear(lastCompleteYear)
+  requestYear(lastCompleteYear - 1)
+}
+
+// Position of the category in YearSummary.sums
+export const getCategoryPosition = (categoryId: string): number | undefined => categoryPositions.get(categoryId)